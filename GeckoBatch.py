@@ -0,0 +1,263 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import freeze_support
+from pathlib import Path
+
+from builder import BuildError, BuildOptions, build, load_dol
+from fileutils import get_program_folder
+from kernel import Toolchain
+from tools import TGREENLIT, TREDLIT, TYELLOWLIT, CommandLineParser, color_text
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# Options given as hex strings, like on the command line
+HEX_OPTIONS = ("allocation", "initAddress", "hookAddress")
+
+class ManifestError(Exception): pass
+
+class BatchJob(object):
+    """ One build of a batch manifest """
+
+    def __init__(self, index: int, name: str, dol: Path, codes: Path, dest: Path, options: dict):
+        self.index = index
+        self.name = name
+        self.dol = dol
+        self.codes = codes
+        self.dest = dest
+        self.options = options
+        # Name and size of the shared memory holding the dol, set when the batch shares it between workers
+        self.sharedDol = None
+
+def load_manifest(path: Path) -> list:
+    """ Returns the BatchJob of a JSON or TOML manifest. The manifest has a list of jobs,
+        each with a dol, codes and dest path and any BuildOptions, and optional defaults
+        applying to every job. Relative paths are relative to the manifest """
+
+    try:
+        if path.suffix.lower() == ".toml":
+            if tomllib is None:
+                raise ManifestError("TOML manifests require Python 3.11 or newer")
+            with path.open("rb") as f:
+                manifest = tomllib.load(f)
+        else:
+            with path.open("r", encoding="utf-8") as f:
+                manifest = json.load(f)
+    except OSError as e:
+        raise ManifestError(f"Failed to read the manifest: {e}")
+    except ValueError as e:
+        raise ManifestError(f"{path} is not a valid manifest: {e}")
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("jobs"), list):
+        raise ManifestError(f"{path} has no list of jobs")
+
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for i, entry in enumerate(manifest["jobs"]):
+        if not isinstance(entry, dict):
+            raise ManifestError(f"Job {i + 1} of {path} is not a table")
+
+        settings = {**defaults, **entry}
+        missing = [key for key in ("dol", "codes", "dest") if key not in settings]
+        if missing:
+            raise ManifestError(f"Job {i + 1} of {path} has no " + ", ".join(missing))
+
+        name = str(settings.pop("name", f"job {i + 1}"))
+        dol, codes, dest = [path.parent / settings.pop(key) for key in ("dol", "codes", "dest")]
+
+        for key in HEX_OPTIONS:
+            if isinstance(settings.get(key), str):
+                try:
+                    settings[key] = int(settings[key], 16)
+                except ValueError:
+                    raise ManifestError(f"{key} of {name} is not a hex number")
+
+        try:
+            BuildOptions(**settings)
+        except TypeError as e:
+            raise ManifestError(f"{name}: {e}")
+
+        jobs.append(BatchJob(i, name, dol, codes, dest, settings))
+
+    return jobs
+
+# Per worker process caches, so each process reads each binary and dol only once
+_toolchains = {}
+_dols = {}
+_sharedMemory = {}
+
+def _toolchain(handlerPath) -> Toolchain:
+    if handlerPath not in _toolchains:
+        _toolchains[handlerPath] = Toolchain.load(None if handlerPath is None else Path(handlerPath))
+    return _toolchains[handlerPath]
+
+def _dol(job: BatchJob):
+    """ Returns the parsed dol of the job, which builds copy. A dol in shared memory is
+        parsed in place, so its sections are only copied by the builds patching them """
+
+    if job.sharedDol is not None:
+        name, size = job.sharedDol
+        if name not in _dols:
+            _sharedMemory[name] = shared_memory.SharedMemory(name)
+            _dols[name] = load_dol(_sharedMemory[name].buf[:size])
+        return _dols[name]
+
+    key = (str(job.dol.resolve()), job.dol.stat().st_mtime_ns)
+    if key not in _dols:
+        _dols[key] = load_dol(job.dol)
+    return _dols[key]
+
+def share_dols(jobs: list) -> list:
+    """ Places each dol of the jobs in shared memory once, for every worker to read.
+        Returns the SharedMemory blocks, to be unlinked once the batch is done """
+
+    blocks = {}
+    shared = {}
+    for job in jobs:
+        key = str(job.dol.resolve())
+        if key not in shared:
+            try:
+                data = job.dol.read_bytes()
+            except OSError:
+                # Left to the job, which reports the error
+                data = b""
+
+            shared[key] = None
+            if data:
+                blocks[key] = shared_memory.SharedMemory(create=True, size=len(data))
+                blocks[key].buf[:len(data)] = data
+                shared[key] = (blocks[key].name, len(data))
+
+        job.sharedDol = shared[key]
+
+    return list(blocks.values())
+
+def run_job(job: BatchJob) -> dict:
+    """ Builds one job of the batch, returning a summary that can be sent back to the parent process """
+
+    summary = {"index": job.index, "name": job.name, "dest": str(job.dest), "error": None, "warnings": []}
+
+    try:
+        options = BuildOptions(**job.options)
+        if options.jobs is None:
+            options.jobs = 1
+        if options.cacheFolder is None:
+            options.cacheFolder = get_program_folder("GeckoLoader") / "cache" / "codelists"
+
+        result = build(_dol(job), job.codes, options, _toolchain(options.handlerPath))
+        job.dest.parent.mkdir(parents=True, exist_ok=True)
+        result.save(job.dest)
+    except BuildError as e:
+        summary["error"] = str(e)
+    except OSError as e:
+        summary["error"] = f"{e.strerror}: {e.filename}" if e.filename else str(e)
+    except Exception as e:
+        # Reported as a failed job rather than ending the whole batch
+        summary["error"] = f"{type(e).__name__}: {e}"
+    else:
+        summary["warnings"] = result.warnings
+        summary["patched"] = result.patched
+        summary["codelistSize"] = result.codelistSize
+        summary["elapsed"] = result.elapsed
+
+    return summary
+
+class GeckoBatchCli(CommandLineParser):
+
+    def __init__(self):
+        super().__init__(prog="GeckoBatch", description="Builds every job of a GeckoLoader batch manifest", allow_abbrev=False)
+
+        self.add_argument("manifest", help="JSON or TOML manifest listing the dol, codes, dest and options of each build")
+        self.add_argument(
+            "-j",
+            "--jobs",
+            help="Number of builds run at once, defaults to the CPU count",
+            type=int,
+            metavar="COUNT",
+        )
+        self.add_argument(
+            "-q", "--quiet", help="Only print the summary", action="store_true"
+        )
+
+    def report(self, summary: dict, done: int, total: int, quiet: bool):
+        if summary["error"] is not None:
+            print(color_text(f"  :: [{done}/{total}] {summary['name']} failed: {summary['error']}", defaultColor=TREDLIT))
+            return
+
+        if quiet:
+            return
+
+        if summary["patched"]:
+            status = f"codelist size is 0x{summary['codelistSize']:X}"
+        else:
+            status = "all codes were pre patched"
+        print(color_text(f"  :: [{done}/{total}] {summary['name']} -> {summary['dest']}, {status} ({summary['elapsed']:0.3f}s)", defaultColor=TGREENLIT))
+        for warning in summary["warnings"]:
+            print(color_text(f"  ::     {warning}", defaultColor=TYELLOWLIT))
+
+    def _exec(self, args) -> int:
+        if args.jobs is not None and args.jobs < 1:
+            self.error(color_text("The number of jobs must be at least 1\n", defaultColor=TREDLIT))
+
+        try:
+            jobs = load_manifest(Path(args.manifest))
+        except ManifestError as e:
+            self.error(color_text(f"{e}\n", defaultColor=TREDLIT))
+
+        start = time.perf_counter()
+        failed = []
+        workers = min(args.jobs or os.cpu_count() or 1, max(len(jobs), 1))
+
+        # Jobs of the same dol are submitted together, so they tend to share a worker's parsed dol
+        jobs.sort(key=lambda job: (str(job.dol), job.index))
+
+        if workers == 1:
+            for done, job in enumerate(jobs, 1):
+                summary = run_job(job)
+                self.report(summary, done, len(jobs), args.quiet)
+                if summary["error"] is not None:
+                    failed.append(summary)
+        else:
+            blocks = share_dols(jobs) if shared_memory is not None else []
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = {pool.submit(run_job, job): job for job in jobs}
+                    for done, future in enumerate(as_completed(futures), 1):
+                        try:
+                            summary = future.result()
+                        except Exception as e:
+                            # The worker itself failed, like a process that was killed
+                            job = futures[future]
+                            summary = {"index": job.index, "name": job.name, "dest": str(job.dest),
+                                       "error": f"{type(e).__name__}: {e}", "warnings": []}
+                        self.report(summary, done, len(jobs), args.quiet)
+                        if summary["error"] is not None:
+                            failed.append(summary)
+            finally:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+
+        elapsed = time.perf_counter() - start
+        print(color_text(f"\n  :: Built {len(jobs) - len(failed)} of {len(jobs)} jobs in {elapsed:0.4f} seconds with {workers} processes",
+                         defaultColor=TGREENLIT if not failed else TYELLOWLIT))
+        for summary in sorted(failed, key=lambda summary: summary["index"]):
+            print(color_text(f"  ::   {summary['name']}: {summary['error']}", defaultColor=TREDLIT))
+
+        return 1 if failed else 0
+
+if __name__ == "__main__":
+    freeze_support()
+
+    cli = GeckoBatchCli()
+    sys.exit(cli._exec(cli.parse_args()))
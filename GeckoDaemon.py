@@ -0,0 +1,57 @@
+import asyncio
+import sys
+from multiprocessing import freeze_support
+from pathlib import Path
+
+from daemon import BuildDaemon
+from daemonclient import DaemonError, default_socket_path
+from fileutils import get_program_folder
+from tools import TGREENLIT, TREDLIT, CommandLineParser, color_text
+
+class GeckoDaemonCli(CommandLineParser):
+
+    def __init__(self):
+        super().__init__(prog="GeckoDaemon", description="Serves GeckoLoader builds to local clients over a Unix socket", allow_abbrev=False)
+
+        self.add_argument(
+            "--socket",
+            help=f"Socket to listen on, defaults to {default_socket_path()}",
+            metavar="PATH",
+        )
+        self.add_argument(
+            "-j",
+            "--jobs",
+            help="Number of builds run at once, defaults to the CPU count",
+            type=int,
+            metavar="COUNT",
+        )
+        self.add_argument(
+            "-q", "--quiet", help="Print nothing but errors", action="store_true"
+        )
+
+    def _exec(self, args) -> int:
+        if args.jobs is not None and args.jobs < 1:
+            self.error(color_text("The number of jobs must be at least 1\n", defaultColor=TREDLIT))
+
+        socketPath = Path(args.socket).resolve() if args.socket else default_socket_path()
+        daemon = BuildDaemon(socketPath, args.jobs, get_program_folder("GeckoLoader") / "cache" / "codelists")
+
+        try:
+            daemon.check_socket()
+            if not args.quiet:
+                print(color_text(f"  :: Listening on {socketPath} with {daemon.workers} processes, press Ctrl+C to stop", defaultColor=TGREENLIT))
+            asyncio.run(daemon.serve())
+        except DaemonError as e:
+            self.error(color_text(f"{e}\n", defaultColor=TREDLIT))
+        except KeyboardInterrupt:
+            pass
+
+        if not args.quiet:
+            print(color_text(f"  :: Stopped after {daemon.completed} builds", defaultColor=TGREENLIT))
+        return 0
+
+if __name__ == "__main__":
+    freeze_support()
+
+    cli = GeckoDaemonCli()
+    sys.exit(cli._exec(cli.parse_args()))
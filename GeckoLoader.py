@@ -1,28 +1,30 @@
 # Written by JoshuaMK 2020
 
-import atexit
 import logging
 import os
 import pickle as cPickle
 import re
-import shutil
 import signal
 import sys
-import tempfile
 from contextlib import redirect_stderr, redirect_stdout
 from distutils.version import LooseVersion
 from io import StringIO
+from multiprocessing import freeze_support
 from pathlib import Path
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+from builder import BuildError, BuildOptions, BuildResult, build, read_dol
 from children_ui import PrefWindow, SettingsWindow
+from codedb import CodeDatabase, CodeDatabaseError
+from conflicts import CONFLICT_POLICIES
 from dolreader import DolFile
 from fileutils import get_program_folder, resource_path
-from kernel import CodeHandler, KernelLoader
+from kernel import CODE_DATABASE_SUFFIXES, Toolchain
 from main_ui import MainWindow
 from tools import CommandLineParser, color_text
 from versioncheck import Updater
+from watcher import FileWatcher, WatchSession
 
 try:
     import colorama
@@ -48,17 +50,6 @@ except ImportError:
 
 __version__ = "v7.1.1"
 
-TMPDIR = Path(tempfile.mkdtemp(prefix="GeckoLoader-"))
-
-
-@atexit.register
-def clean_tmp_resources():
-    tmpfolder = TMPDIR.parent
-    for entry in tmpfolder.iterdir():
-        if entry.name.startswith("GeckoLoader-"):
-            shutil.rmtree(entry, ignore_errors=True)
-
-
 class GeckoLoaderCli(CommandLineParser):
 
     def __init__(self, name, version=None, description=""):
@@ -67,6 +58,7 @@ class GeckoLoaderCli(CommandLineParser):
         )
         self.__version__ = version
         self.__doc__ = description
+        self._toolchains = {}
 
         self.add_argument("dolfile", help="DOL file")
         self.add_argument("codelist", help="Folder or Gecko GCT|TXT file")
@@ -117,6 +109,54 @@ class GeckoLoaderCli(CommandLineParser):
                         ram writes into the dol file, and removing them from the codelist""",
             action="store_true",
         )
+        self.add_argument(
+            "--staticasm",
+            help="""Used with --optimize, compiles C2 insert ASM codes directly into the dol
+                        instead of having the codehandler reinstall them every frame.
+                        Uses the low memory codehandler region (0x80001800) unless --staticasmregion is given,
+                        so it can't be used alongside a loader or emulator that puts its own codehandler there""",
+            action="store_true",
+        )
+        self.add_argument(
+            "--staticasmregion",
+            help="Define the memory --staticasm compiles C2 codes to in hex, from START up to END",
+            nargs=2,
+            metavar=("START", "END"),
+        )
+        self.add_argument(
+            "--costreport",
+            help="""Prints the estimated per frame codehandler cost of the codelist, ranked by code block.
+                        When used with --optimize, the savings of the optimizer are shown as well""",
+            action="store_true",
+        )
+        self.add_argument(
+            "--costbudget",
+            help="""Fails the build if the estimated codehandler cost of the final codelist
+                        is above this many instructions per frame""",
+            type=int,
+            metavar="INSTRUCTIONS",
+        )
+        self.add_argument(
+            "--compress",
+            help="""Compresses the codelist inside the dol, which the loader decompresses into the arena at boot.
+                        Requires a GeckoLoader kernel built with compression support""",
+            action="store_true",
+        )
+        self.add_argument(
+            "-j",
+            "--jobs",
+            help="Number of processes used to parse a folder of codelists, defaults to the CPU count",
+            type=int,
+            metavar="COUNT",
+        )
+        self.add_argument(
+            "--conflicts",
+            help="""What to do when codes of different files in a folder of codelists write to the same memory:
+                        error fails the build, warn lists them (default), last keeps the codes of the file merged last
+                        and drops the earlier ones they overwrite entirely""",
+            choices=CONFLICT_POLICIES,
+            default="warn",
+        )
         self.add_argument(
             "-p",
             "--protect",
@@ -141,11 +181,58 @@ class GeckoLoaderCli(CommandLineParser):
                         all other commands excluding --checkupdate""",
             action="store_true",
         )
+        self.add_argument(
+            "--importini",
+            help="""Imports the Gecko codes of a Dolphin GameSettings folder into the code database
+                        given as the codelist (.db), only re-reading inis that changed since the last import""",
+            metavar="FOLDER",
+        )
+        self.add_argument(
+            "--gameid",
+            help="Game ID to select codes for when the codelist is a code database",
+            metavar="ID",
+        )
+        self.add_argument(
+            "--code",
+            help="""Name of a code to select from the code database, can be given multiple times.
+                        Codes enabled in Dolphin are selected when none are given""",
+            action="append",
+            dest="codes",
+            metavar="NAME",
+        )
         self.add_argument(
             "--encrypt",
             help="Encrypts the codelist on compile time, helping to slow the snoopers",
             action="store_true",
         )
+        self.add_argument(
+            "--deterministic",
+            help="""Derives the encryption key from the inputs instead of picking it at random,
+                        so identical inputs always build the same DOL""",
+            action="store_true",
+        )
+        self.add_argument(
+            "--seed",
+            help="Derives the encryption key from this seed and the inputs, implies --deterministic",
+            metavar="SEED",
+        )
+        self.add_argument(
+            "--buildcache",
+            help="""Reuses the DOL of a previous build with identical inputs and options, and caches
+                        the DOL of new builds. Implies --deterministic""",
+            action="store_true",
+        )
+        self.add_argument(
+            "--no-cache",
+            help="Parses the text codelists from scratch, without reading or writing the cache of parsed codelists",
+            action="store_true",
+        )
+        self.add_argument(
+            "--watch",
+            help="""Keeps running, rebuilding the DOL whenever it or the codelist changes.
+                        Only the codelists that changed are parsed again""",
+            action="store_true",
+        )
         self.add_argument(
             "-q", "--quiet", help="Print nothing to the console", action="store_true"
         )
@@ -278,6 +365,23 @@ class GeckoLoaderCli(CommandLineParser):
         else:
             _codehook = None
 
+        if args.staticasmregion:
+            try:
+                _staticAsmRegion = tuple([int(address, 16) for address in args.staticasmregion])
+            except ValueError:
+                self.error(
+                    color_text("The static ASM region was invalid\n", defaultColor=TREDLIT)
+                )
+            if not 0x80000000 <= _staticAsmRegion[0] < _staticAsmRegion[1] <= 0x81800000:
+                self.error(
+                    color_text(
+                        "The static ASM region was beyond bounds\n",
+                        defaultColor=TREDLIT,
+                    )
+                )
+        else:
+            _staticAsmRegion = None
+
         if args.handlerpath:
             codeHandlerFile = Path(args.handlerpath).resolve()
         else:
@@ -288,17 +392,45 @@ class GeckoLoaderCli(CommandLineParser):
                 color_text(f'File "{dolFile}" does not exist\n', defaultColor=TREDLIT)
             )
 
-        if not codeList.exists():
+        if args.importini:
+            importFolder = Path(args.importini).resolve()
+            if not importFolder.is_dir():
+                self.error(
+                    color_text(
+                        f'Folder "{importFolder}" does not exist\n', defaultColor=TREDLIT
+                    )
+                )
+            if codeList.suffix.lower() not in CODE_DATABASE_SUFFIXES:
+                self.error(
+                    color_text(
+                        "Inis can only be imported into a code database (.db)\n", defaultColor=TREDLIT
+                    )
+                )
+        else:
+            importFolder = None
+
+        if not codeList.exists() and importFolder is None:
             self.error(
                 color_text(
                     f'File/folder "{codeList}" does not exist\n', defaultColor=TREDLIT
                 )
             )
 
+        if args.jobs is not None and args.jobs < 1:
+            self.error(
+                color_text("The job count must be at least 1\n", defaultColor=TREDLIT)
+            )
+
+        if args.costbudget is not None and args.costbudget < 0:
+            self.error(
+                color_text("The cost budget can't be negative\n", defaultColor=TREDLIT)
+            )
+
         return {
             "dol": dolFile,
             "codepath": codeList,
             "codehandler": codeHandlerFile,
+            "bundledhandler": not args.handlerpath,
             "destination": dest,
             "allocation": _allocation,
             "hookaddress": _codehook,
@@ -306,48 +438,197 @@ class GeckoLoaderCli(CommandLineParser):
             "initaddress": None if args.init is None else int(args.init, 16),
             "includeall": args.txtcodes.lower() == "all",
             "optimize": args.optimize,
+            "staticasm": args.staticasm,
+            "staticasmregion": _staticAsmRegion,
+            "costreport": args.costreport,
+            "costbudget": args.costbudget,
+            "jobs": args.jobs,
+            "conflicts": args.conflicts,
+            "importini": importFolder,
+            "gameid": args.gameid,
+            "codes": args.codes,
             "protect": args.protect,
             "encrypt": args.encrypt,
+            "compress": args.compress,
+            "deterministic": args.deterministic,
+            "seed": args.seed,
+            "buildcache": args.buildcache,
+            "nocache": args.no_cache,
+            "watch": args.watch,
             "verbosity": args.verbose,
             "quiet": args.quiet,
         }
 
-    def _exec(self, args, tmpdir):
+    def import_ini(self, database: Path, folder: Path, jobs: int, quiet: bool):
+        try:
+            with CodeDatabase(database) as codeDatabase:
+                imported, removed, failed = codeDatabase.import_folder(folder, jobs)
+        except CodeDatabaseError as e:
+            self.error(color_text(f"{e}\n", defaultColor=TREDLIT))
+
+        if not quiet:
+            print(
+                color_text(
+                    f"  :: Imported {imported} inis into the code database, removed {removed}, {failed} could not be read",
+                    defaultColor=TGREENLIT if failed == 0 else TYELLOW,
+                )
+            )
+
+    def get_toolchain(self, handlerPath: Path = None) -> Toolchain:
+        """ Returns the Toolchain of the given codehandler, or of the bundled one,
+            loading it again only when one of its binaries changed """
+
+        paths = [resource_path("bin/geckoloader.bin"), resource_path("bin/codehandler.bin") if handlerPath is None else handlerPath]
+
+        key = tuple([(str(path), path.stat().st_mtime_ns) for path in paths])
+        if key not in self._toolchains:
+            self._toolchains[key] = Toolchain.load(handlerPath)
+        return self._toolchains[key]
+
+    def build_options(self, context: dict) -> BuildOptions:
+        return BuildOptions(
+            allocation=context["allocation"],
+            initAddress=context["initaddress"],
+            hookAddress=context["hookaddress"],
+            hookType=context["hooktype"],
+            includeAll=context["includeall"],
+            optimize=context["optimize"],
+            staticAsm=context["staticasm"],
+            staticAsmRegion=context["staticasmregion"],
+            protect=context["protect"],
+            encrypt=context["encrypt"],
+            compress=context["compress"],
+            costReport=context["costreport"],
+            costBudget=context["costbudget"],
+            jobs=context["jobs"],
+            conflicts=context["conflicts"],
+            gameId=context["gameid"],
+            codeNames=context["codes"],
+            deterministic=context["deterministic"],
+            seed=context["seed"],
+            cacheFolder=None if context["nocache"] else get_program_folder("GeckoLoader") / "cache" / "codelists",
+            buildCache=get_program_folder("GeckoLoader") / "cache" / "builds" if context["buildcache"] else None,
+        )
+
+    def watch(self, context: dict, options: BuildOptions, toolchain: Toolchain):
+        """ Rebuilds the DOL on every change of it or of the codelist until interrupted """
+
+        session = WatchSession(context["dol"], context["codepath"], context["destination"], options, toolchain,
+                               options.cacheFolder)
+
+        with FileWatcher(session.paths) as watcher:
+            if not context["quiet"]:
+                print(color_text(f"\n  :: Watching {context['dol'].name} and {context['codepath'].name} for changes, press Ctrl+C to stop",
+                                 defaultColor=TGREENLIT))
+
+            changed = None
+            try:
+                while True:
+                    try:
+                        result = session.rebuild(changed)
+                    except BuildError as e:
+                        print(color_text(f"\n  :: Build failed: {e}", defaultColor=TREDLIT))
+                    else:
+                        if not context["quiet"]:
+                            self.report_rebuild(result, context["destination"], changed)
+                    changed = watcher.wait()
+            except KeyboardInterrupt:
+                pass
+
+    def report_rebuild(self, result, dest: Path, changed: set):
+        files = "" if changed is None else f", {len(changed)} changed file{'s' if len(changed) != 1 else ''}"
+        if result.patched:
+            status = f"codelist size is 0x{result.codelistSize:X}"
+        else:
+            status = "all codes were pre patched"
+        print(color_text(f"\n  :: Built {dest.name} in {result.elapsed * 1000:0.1f} ms{files}, {status}", defaultColor=TGREENLIT))
+        for warning in result.warnings:
+            print(color_text(f"  :: {warning}", defaultColor=TYELLOWLIT))
+
+    def report_build(self, result: BuildResult, context: dict, gameStart: int):
+        """ Prints the summary of a build. gameStart: entry point of the dol before it was patched """
+
+        if context["quiet"]:
+            return
+
+        for warning in result.warnings:
+            print(color_text(f"  :: {warning}", defaultColor=TYELLOWLIT))
+
+        if context["costreport"]:
+            print("")
+            result.cost.print(baseline=result.baselineCost)
+
+        if context["verbosity"] >= 3:
+            result.dolFile.print_info()
+            print("-"*64)
+
+        if not result.patched:
+            if context["verbosity"] >= 1:
+                print(color_text("\n  :: All codes have been successfully pre patched", defaultColor=TGREENLIT))
+            return
+
+        if context["verbosity"] >= 2:
+            print("")
+            info = [f"  :: Start of game modified to address 0x{result.initAddress:X}",
+                    f"  :: Game function `__start()' located at address 0x{gameStart:X}",
+                    f"  :: Allocation is 0x{result.allocation:X}; codelist size is 0x{result.codelistSize:X}",
+                    f"  :: Codehandler hooked at 0x{result.hookAddress:X}",
+                    f"  :: Codehandler is of type `{result.handlerType}'",
+                    f"  :: Of the {DolFile.maxTextSections} text sections in this DOL file, {len(result.dolFile.textSections)} are now being used",
+                    f"  :: Of the {DolFile.maxDataSections} data sections in this DOL file, {len(result.dolFile.dataSections)} are now being used"]
+            if result.deduplicatedSize:
+                info.insert(3, f"  :: Removed 0x{result.deduplicatedSize:X} bytes of duplicate code blocks from the merged codelists")
+            for bit in info:
+                print(color_text(bit, defaultColor=TGREENLIT))
+
+        elif context["verbosity"] >= 1:
+            print("")
+            info = [f"  :: GeckoLoader set at address 0x{result.initAddress:X}",
+                    f"  :: Legacy size is 0x{result.allocation:X}; codelist size is 0x{result.codelistSize:X}",
+                    f"  :: Codehandler is of type `{result.handlerType}'"]
+            if result.deduplicatedSize:
+                info.insert(2, f"  :: Removed 0x{result.deduplicatedSize:X} bytes of duplicate code blocks from the merged codelists")
+            for bit in info:
+                print(color_text(bit, defaultColor=TGREENLIT))
+
+    def _exec(self, args):
         context = self._validate_args(args)
+        options = self.build_options(context)
 
         try:
-            with context["dol"].open("rb") as dol:
-                dolFile = DolFile(dol)
-
-            with resource_path(context["codehandler"]).open("rb") as handler:
-                codeHandler = CodeHandler(handler)
-                codeHandler.allocation = context["allocation"]
-                codeHandler.hookAddress = context["hookaddress"]
-                codeHandler.hookType = context["hooktype"]
-                codeHandler.includeAll = context["includeall"]
-                codeHandler.optimizeList = context["optimize"]
-
-            with resource_path("bin/geckoloader.bin").open("rb") as kernelfile:
-                geckoKernel = KernelLoader(kernelfile, cli)
-                geckoKernel.initAddress = context["initaddress"]
-                geckoKernel.verbosity = context["verbosity"]
-                geckoKernel.quiet = context["quiet"]
-                geckoKernel.encrypt = context["encrypt"]
-                geckoKernel.protect = context["protect"]
+            toolchain = self.get_toolchain(None if context["bundledhandler"] else context["codehandler"])
+            options.validate(toolchain)
+
+            if context["importini"] is not None:
+                self.import_ini(context["codepath"], context["importini"], context["jobs"], context["quiet"])
 
             if not context["destination"].parent.exists():
                 context["destination"].parent.mkdir(parents=True, exist_ok=True)
 
-            geckoKernel.build(
-                context["codepath"],
-                dolFile,
-                codeHandler,
-                TMPDIR,
-                context["destination"],
-            )
+            if context["watch"]:
+                self.watch(context, options, toolchain)
+                return
+
+            dolData = read_dol(context["dol"])
+            result = build(dolData, context["codepath"], options, toolchain)
+            try:
+                result.save(context["destination"])
+            except OSError as e:
+                raise BuildError(f"Failed to save the dol: {e}")
 
         except FileNotFoundError as e:
             self.error(color_text(e, defaultColor=TREDLIT))
+        except BuildError as e:
+            self.error(color_text(f"{e}\n", defaultColor=TREDLIT))
+
+        if result.cached:
+            if not context["quiet"]:
+                print(color_text(f"\n  :: Reused the cached build of identical inputs, saved to {context['destination']}\n",
+                                 defaultColor=TGREENLIT))
+            return
+
+        self.report_build(result, context, DolFile(dolData).entryPoint)
+        print(color_text(f"\n  :: Completed in {result.elapsed:0.4f} seconds!\n", defaultColor=TGREENLIT))
 
 
 class GUI(object):
@@ -1009,7 +1290,7 @@ class GUI(object):
 
         with redirect_stdout(_outpipe), redirect_stderr(_errpipe):
             try:
-                self.cli._exec(args, tmpdir=TMPDIR)
+                self.cli._exec(args)
             except (SystemExit, Exception):
                 _status = False
             else:
@@ -1058,6 +1339,8 @@ class GUI(object):
 
 
 if __name__ == "__main__":
+    freeze_support()
+
     cli = GeckoLoaderCli(
         "GeckoLoader",
         __version__,
@@ -1075,4 +1358,4 @@ if __name__ == "__main__":
         cli.print_splash()
     else:
         args = cli.parse_args()
-        cli._exec(args, TMPDIR)
+        cli._exec(args)
@@ -0,0 +1,268 @@
+import functools
+import hashlib
+import importlib
+import marshal
+import time
+from io import BytesIO
+from pathlib import Path
+
+from cache import BuildCache, CodelistCache
+from conflicts import CONFLICT_POLICIES
+from dolreader import DolFile
+# The BuildError subclasses are imported for library users to catch from here
+from kernel import (COMPRESSION_UNSUPPORTED, AllocationError, BuildError, CodehandlerError,
+                    CodeHookError, CodelistError, CostBudgetError, KernelError, Toolchain)
+
+# Options that don't change the built dol, left out of the BuildCache key.
+# The handler is keyed by the binaries of the toolchain instead of its path
+UNKEYED_OPTIONS = ("jobs", "cacheFolder", "buildCache", "handlerPath")
+
+# Modules whose code decides the built dol. Their code is part of the BuildCache
+# key, as entries built by another version of them differ from a new build
+BUILD_MODULES = ("builder", "codedb", "codelist", "compression", "conflicts", "costmodel", "dolreader",
+                 "fileutils", "handlers", "kernel", "optimizer", "placeholders", "tools")
+
+# Fields of a BuildResult besides the dol, kept with the dol in the BuildCache
+SUMMARY_FIELDS = ("patched", "initAddress", "hookAddress", "allocation", "codelistSize", "handlerType",
+                  "deduplicatedSize", "cost", "baselineCost", "warnings")
+
+class BuildOptions(object):
+    """ Settings of a build, the library counterpart of the command line options """
+
+    def __init__(self, **options):
+        self.allocation = None
+        self.initAddress = None
+        self.hookAddress = None
+        self.hookType = "VI"
+        self.includeAll = False
+        self.optimize = False
+        self.staticAsm = False
+        self.staticAsmRegion = None
+        self.protect = False
+        self.encrypt = False
+        self.compress = False
+        self.costReport = False
+        self.costBudget = None
+        self.jobs = None
+        self.conflicts = "warn"
+        self.gameId = None
+        self.codeNames = None
+        self.handlerPath = None
+        self.cacheFolder = None
+        self.deterministic = False
+        self.seed = None
+        self.buildCache = None
+
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise TypeError(f"Unknown build option `{name}'")
+            setattr(self, name, value)
+
+    def validate(self, toolchain: Toolchain = None):
+        """ Raises BuildError for invalid options, and KernelError for options the toolchain can't build """
+
+        if self.hookType not in ("VI", "GX", "PAD"):
+            raise BuildError(f"Unsupported hook type `{self.hookType}'")
+        if self.conflicts not in CONFLICT_POLICIES:
+            raise BuildError(f"Unsupported conflict policy `{self.conflicts}'")
+        if self.jobs is not None and self.jobs < 1:
+            raise BuildError("The number of jobs must be at least 1")
+        if self.costBudget is not None and self.costBudget < 0:
+            raise BuildError("The cost budget can't be negative")
+        if self.staticAsmRegion is not None:
+            try:
+                start, end = self.staticAsmRegion
+            except (TypeError, ValueError):
+                raise BuildError("The static ASM region must be a (start, end) pair of addresses")
+            if not 0x80000000 <= start < end <= 0x81800000 or start & 3:
+                raise BuildError("The static ASM region must be a word aligned range of MEM1")
+        if self.compress and toolchain is not None and not toolchain.supportsCompression:
+            raise KernelError(COMPRESSION_UNSUPPORTED)
+
+    @property
+    def keySeed(self) -> str:
+        """ Seed of the encryption key, None for a random key. Builds using
+            the build cache are always deterministic """
+
+        if self.seed is not None:
+            return str(self.seed)
+        if self.deterministic or self.buildCache is not None:
+            return ""
+        return None
+
+class BuildResult(object):
+    """ The patched dol of a successful build and what went into it """
+
+    def __init__(self, dolFile: DolFile, summary: dict = None):
+        self.dolFile = dolFile
+        self.patched = True
+        self.initAddress = None
+        self.hookAddress = None
+        self.allocation = None
+        self.codelistSize = 0
+        self.handlerType = None
+        self.deduplicatedSize = 0
+        self.cost = None
+        self.baselineCost = None
+        self.warnings = []
+        self.elapsed = 0.0
+        self.cached = False
+
+        for name, value in (summary or {}).items():
+            setattr(self, name, value)
+
+    def summary(self) -> dict:
+        return {name: getattr(self, name) for name in SUMMARY_FIELDS}
+
+    @property
+    def data(self) -> bytes:
+        stream = BytesIO()
+        self.dolFile.save(stream)
+        return stream.getvalue()
+
+    def save(self, dest: Path):
+        with dest.open("wb") as final:
+            self.dolFile.save(final)
+
+def build_summary(patched: bool, geckoKernel, codeHandler) -> dict:
+    """ Returns the SUMMARY_FIELDS of a build from its KernelLoader and CodeHandler """
+
+    return {"patched": patched,
+            "initAddress": geckoKernel.initAddress,
+            "hookAddress": codeHandler.hookAddress,
+            "allocation": codeHandler.allocation,
+            "codelistSize": codeHandler.geckoCodes.size,
+            "handlerType": codeHandler.type,
+            "deduplicatedSize": codeHandler.deduplicatedSize,
+            "cost": geckoKernel.cost,
+            "baselineCost": geckoKernel.baselineCost,
+            "warnings": list(codeHandler.warnings)}
+
+@functools.lru_cache(maxsize=None)
+def modules_hash() -> bytes:
+    """ Returns the hash of the source of the BUILD_MODULES, or of their compiled
+        code when the source isn't shipped, like in a frozen executable """
+
+    digest = hashlib.sha256()
+    for name in BUILD_MODULES:
+        module = importlib.import_module(name)
+        try:
+            data = Path(module.__file__).read_bytes()
+        except (OSError, TypeError):
+            data = marshal.dumps(module.__loader__.get_code(name))
+        digest.update(hashlib.sha256(data).digest())
+    return digest.digest()
+
+def build_key(dolData: bytes, codes: Path, options: BuildOptions, toolchain: Toolchain) -> str:
+    """ Returns the BuildCache key of a build, hashing the dol, the codelist,
+        the binaries of the toolchain, the code of the build modules and the
+        options changing the output """
+
+    settings = sorted([(name, value) for name, value in vars(options).items() if name not in UNKEYED_OPTIONS])
+    try:
+        codesHash = BuildCache.hash_codes(Path(codes))
+    except OSError as e:
+        raise CodelistError(f"Failed to read the codelist: {e}")
+
+    return BuildCache.key(dolData, codesHash, toolchain.kernel, toolchain.handler, modules_hash(),
+                          repr(settings).encode("utf-8"))
+
+def read_dol(dol) -> bytes:
+    """ Returns the raw data of a dol given as a path, raw data or DolFile """
+
+    if isinstance(dol, DolFile):
+        stream = BytesIO()
+        dol.save(stream)
+        return stream.getvalue()
+    elif isinstance(dol, (bytes, bytearray, memoryview)):
+        return bytes(dol)
+
+    try:
+        return Path(dol).read_bytes()
+    except OSError as e:
+        raise BuildError(f"Failed to read the dol: {e}")
+
+def load_dol(dol) -> DolFile:
+    """ Returns a DolFile the build can patch from a path, the raw dol or a DolFile,
+        which is copied so it can be shared by several builds. Raw data is read in
+        place until patched, so it must not change during the build """
+
+    if isinstance(dol, DolFile):
+        return dol.copy()
+    elif isinstance(dol, (bytes, bytearray, memoryview)):
+        return DolFile(dol)
+
+    try:
+        with Path(dol).open("rb") as f:
+            return DolFile(f)
+    except OSError as e:
+        raise BuildError(f"Failed to read the dol: {e}")
+
+def build(dol, codes: Path, options: BuildOptions = None, toolchain: Toolchain = None, parseCache: CodelistCache = None) -> BuildResult:
+    """ Builds a dol with the given codelist loaded by GeckoLoader, returning the BuildResult.
+        Nothing is printed and nothing is written to disk, errors raise a BuildError subclass.
+        dol: path, raw data or DolFile of the dol, left untouched
+        codes: .txt/.gct file, folder of them, or code database
+        toolchain: binaries to build with, shared between builds. Loaded for this build when not given
+        parseCache: CodelistCache of the parsed text codelists, instead of the one in options.cacheFolder
+        With options.buildCache set, the dol of a previous build of identical inputs is returned instead """
+
+    start = time.perf_counter()
+    options = options or BuildOptions()
+
+    try:
+        toolchain = toolchain or Toolchain.load(None if options.handlerPath is None else Path(options.handlerPath))
+    except OSError as e:
+        raise KernelError(f"Failed to load the GeckoLoader binaries: {e}")
+    options.validate(toolchain)
+
+    cache = None
+    if options.buildCache is not None:
+        cache = BuildCache(Path(options.buildCache))
+        dol = read_dol(dol)
+        key = build_key(dol, codes, options, toolchain)
+        entry = cache.get(key)
+        if entry is not None:
+            result = BuildResult(DolFile(entry["dol"]), entry["result"])
+            result.cached = True
+            result.elapsed = time.perf_counter() - start
+            return result
+
+    dolFile = load_dol(dol)
+
+    codeHandler = toolchain.code_handler()
+    codeHandler.allocation = options.allocation
+    codeHandler.hookAddress = options.hookAddress
+    codeHandler.hookType = options.hookType
+    codeHandler.includeAll = options.includeAll
+    codeHandler.optimizeList = options.optimize
+    codeHandler.staticAsm = options.staticAsm
+    codeHandler.staticAsmRegion = options.staticAsmRegion
+    codeHandler.jobs = options.jobs
+    codeHandler.conflictPolicy = options.conflicts
+    codeHandler.gameId = options.gameId
+    codeHandler.codeNames = options.codeNames
+    if parseCache is not None:
+        codeHandler.parseCache = parseCache
+    elif options.cacheFolder is not None:
+        codeHandler.parseCache = CodelistCache(Path(options.cacheFolder))
+
+    geckoKernel = toolchain.kernel_loader()
+    geckoKernel.initAddress = options.initAddress
+    geckoKernel.encrypt = options.encrypt
+    geckoKernel.compress = options.compress
+    geckoKernel.protect = options.protect
+    geckoKernel.costReport = options.costReport
+    geckoKernel.costBudget = options.costBudget
+    geckoKernel.seed = options.keySeed
+
+    try:
+        patched = geckoKernel.assemble(Path(codes), dolFile, codeHandler)
+    except (OSError, NotImplementedError) as e:
+        raise BuildError(str(e))
+
+    result = BuildResult(dolFile, build_summary(patched, geckoKernel, codeHandler))
+    if cache is not None:
+        cache.put(key, result.data, result.summary())
+    result.elapsed = time.perf_counter() - start
+    return result
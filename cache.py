@@ -0,0 +1,228 @@
+import hashlib
+import os
+import pickle as cPickle
+from pathlib import Path
+
+class PickleCache(object):
+    """ Folder of pickled cache entries. The least recently used entries are
+        evicted once there are more than maxEntries, or the entries take up
+        more than maxSize bytes """
+
+    def __init__(self, folder: Path, maxEntries: int, maxSize: int):
+        self.folder = folder
+        self.maxEntries = maxEntries
+        self.maxSize = maxSize
+
+    def _read(self, entryPath: Path) -> dict:
+        try:
+            with entryPath.open("rb") as f:
+                return cPickle.load(f)
+        except (OSError, cPickle.UnpicklingError, EOFError):
+            return None
+
+    def _write(self, entryPath: Path, entry: dict) -> bool:
+        """ Writes an entry atomically, returns False if the cache can't be written to """
+
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            tmpPath = entryPath.with_suffix(f".{os.getpid()}.tmp")
+            with tmpPath.open("wb") as f:
+                cPickle.dump(entry, f, protocol=cPickle.HIGHEST_PROTOCOL)
+            os.replace(tmpPath, entryPath)
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _touch(entryPath: Path):
+        try:
+            os.utime(entryPath)
+        except OSError:
+            pass
+
+    def evict(self):
+        try:
+            entries = [(entry.stat(), entry) for entry in self.folder.glob("*.pickle")]
+        except OSError:
+            return
+
+        entries.sort(key=lambda entry: entry[0].st_mtime_ns, reverse=True)
+        totalSize = 0
+        for i, (stat, entry) in enumerate(entries):
+            totalSize += stat.st_size
+            if i >= self.maxEntries or totalSize > self.maxSize:
+                try:
+                    entry.unlink()
+                except OSError:
+                    pass
+
+    def clear(self):
+        for entry in self.folder.glob("*.pickle"):
+            try:
+                entry.unlink()
+            except OSError:
+                pass
+
+class CodelistCache(PickleCache):
+    """ Persistent cache of parsed text codelists, keyed by path, size, mtime,
+        content hash and the includeAll setting """
+
+    VERSION = 1
+
+    def __init__(self, folder: Path, maxEntries: int = 256, maxSize: int = 64 << 20):
+        super().__init__(folder, maxEntries, maxSize)
+
+    def _entry_path(self, path: Path, includeAll: bool) -> Path:
+        key = f"{self.VERSION}|{path.resolve()}|{includeAll}".encode("utf-8")
+        return self.folder / (hashlib.sha1(key).hexdigest() + ".pickle")
+
+    @staticmethod
+    def hash(data: bytes) -> str:
+        return hashlib.sha1(data).hexdigest()
+
+    def get(self, path: Path, includeAll: bool) -> bytes:
+        """ Returns the parsed codes cached for this file, or None on a miss.
+            The file is only read to check its content hash when the size or mtime changed """
+
+        entryPath = self._entry_path(path, includeAll)
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+
+        entry = self._read(entryPath)
+        if entry is None or entry.get("version") != self.VERSION or entry.get("includeAll") != includeAll:
+            return None
+
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            try:
+                data = path.read_bytes()
+            except OSError:
+                return None
+            if self.hash(data) != entry["hash"]:
+                return None
+            entry["size"] = stat.st_size
+            entry["mtime"] = stat.st_mtime_ns
+            self._write(entryPath, entry)
+        else:
+            self._touch(entryPath)
+
+        return entry["codes"]
+
+    def put(self, path: Path, includeAll: bool, data: bytes, codes: bytes):
+        try:
+            stat = path.stat()
+        except OSError:
+            return
+
+        entry = {"version": self.VERSION,
+                 "path": str(path.resolve()),
+                 "size": stat.st_size,
+                 "mtime": stat.st_mtime_ns,
+                 "hash": self.hash(data),
+                 "includeAll": includeAll,
+                 "codes": codes}
+
+        if self._write(self._entry_path(path, includeAll), entry):
+            self.evict()
+
+class MemoryCodelistCache(CodelistCache):
+    """ CodelistCache holding its entries in memory, for a process rebuilding the
+        same codelists over and over. Entries missing from memory are read from
+        the persistent cache in folder when one is given, and new entries are
+        written to both. Only the persistent cache is sent to worker processes """
+
+    def __init__(self, folder: Path = None, maxEntries: int = 4096, maxSize: int = 64 << 20):
+        super().__init__(folder, maxEntries, maxSize)
+        self.entries = {}
+
+    def __getstate__(self) -> dict:
+        state = dict(vars(self))
+        state["entries"] = {}
+        return state
+
+    def _entry_path(self, path: Path, includeAll: bool) -> Path:
+        if self.folder is None:
+            return Path(f"{path.resolve()}|{includeAll}")
+        return super()._entry_path(path, includeAll)
+
+    def _read(self, entryPath: Path) -> dict:
+        # Entries are moved to the end when read, so evict drops the least recently used
+        entry = self.entries.pop(entryPath, None)
+        if entry is None and self.folder is not None:
+            entry = super()._read(entryPath)
+        if entry is not None:
+            self.entries[entryPath] = entry
+        return entry
+
+    def _write(self, entryPath: Path, entry: dict) -> bool:
+        self.entries[entryPath] = entry
+        if self.folder is not None:
+            super()._write(entryPath, entry)
+        return True
+
+    def _touch(self, entryPath: Path):
+        pass
+
+    def evict(self):
+        while len(self.entries) > self.maxEntries:
+            del self.entries[next(iter(self.entries))]
+        if self.folder is not None:
+            super().evict()
+
+    def clear(self):
+        self.entries.clear()
+        if self.folder is not None:
+            super().clear()
+
+class BuildCache(PickleCache):
+    """ Content addressed cache of built dols. Entries are keyed by the hashes of
+        every input of a deterministic build, so a hit is the exact dol the build
+        would produce """
+
+    VERSION = 1
+
+    def __init__(self, folder: Path, maxEntries: int = 64, maxSize: int = 256 << 20):
+        super().__init__(folder, maxEntries, maxSize)
+
+    @classmethod
+    def key(cls, *parts: bytes) -> str:
+        """ Returns the key of a build from its inputs, each hashed separately
+            so that no two different sets of inputs share a key """
+
+        digest = hashlib.sha256(f"{cls.VERSION}".encode("utf-8"))
+        for part in parts:
+            digest.update(hashlib.sha256(part).digest())
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_codes(path: Path) -> bytes:
+        """ Returns the hash of a codelist file, or of every file of a folder of codelists """
+
+        if not path.is_dir():
+            return hashlib.sha256(path.read_bytes()).digest()
+
+        digest = hashlib.sha256()
+        for file in sorted(path.iterdir()):
+            if file.is_file():
+                digest.update(file.name.encode("utf-8") + b"\x00")
+                digest.update(hashlib.sha256(file.read_bytes()).digest())
+        return digest.digest()
+
+    def get(self, key: str) -> dict:
+        """ Returns the entry of the build, or None on a miss """
+
+        entryPath = self.folder / (key + ".pickle")
+        entry = self._read(entryPath)
+        if entry is None or entry.get("version") != self.VERSION or entry.get("key") != key:
+            return None
+
+        self._touch(entryPath)
+        return entry
+
+    def put(self, key: str, dol: bytes, result: dict):
+        """ Caches the built dol with the summary of the build that made it """
+
+        entry = {"version": self.VERSION, "key": key, "dol": dol, "result": result}
+        if self._write(self.folder / (key + ".pickle"), entry):
+            self.evict()
@@ -0,0 +1,194 @@
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+CODE_LINE = re.compile(r"^([0-9A-F]{8})[\t ]+([0-9A-F]{8})", re.IGNORECASE)
+CODE_NAME = re.compile(r"^(.*?)(?:\s*\[(.*)\])?\s*$")
+
+class CodeDatabaseError(Exception): pass
+
+class IniCode(object):
+    """ A Gecko code of a Dolphin GameSettings ini """
+
+    def __init__(self, name: str, creator: str = ""):
+        self.name = name
+        self.creator = creator
+        self.lines = bytearray()
+        self.notes = []
+        self.enabled = False
+
+def parse_game_ini(path: Path) -> list:
+    """ Returns the IniCode of the [Gecko] section of a Dolphin GameSettings ini in order,
+        flagged enabled when listed in [Gecko_Enabled] and not in [Gecko_Disabled] """
+
+    with path.open("rb") as f:
+        text = f.read().decode("utf-8-sig", errors="replace")
+
+    codes = []
+    enabled = set()
+    disabled = set()
+    section = None
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1]
+            continue
+
+        if section == "Gecko":
+            if line.startswith("$"):
+                name, creator = CODE_NAME.match(line[1:]).groups()
+                codes.append(IniCode(name, creator or ""))
+            elif not codes:
+                continue
+            elif line.startswith("*"):
+                codes[-1].notes.append(line[1:])
+            elif match := CODE_LINE.match(line):
+                codes[-1].lines += bytes.fromhex(match.group(1) + match.group(2))
+        elif section in ("Gecko_Enabled", "Gecko_Disabled") and line.startswith("$"):
+            (enabled if section == "Gecko_Enabled" else disabled).add(line[1:].strip())
+
+    for code in codes:
+        code.enabled = code.name in enabled and code.name not in disabled
+
+    return codes
+
+def _parse_game_ini(path: Path) -> tuple:
+    try:
+        return path, parse_game_ini(path), None
+    except (OSError, ValueError) as e:
+        return path, None, str(e)
+
+class CodeDatabase(object):
+    """ SQLite index of the Gecko codes in Dolphin GameSettings inis, by game ID and code name.
+        Games match the ini named after their full ID (GMSE01.ini) and the region
+        free ini named after its first three characters (GMS.ini), the former
+        taking precedence when both have a code of the same name """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            gameid TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS codes (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+            gameid TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            creator TEXT NOT NULL,
+            notes TEXT NOT NULL,
+            enabled INTEGER NOT NULL,
+            data BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS codes_game_name ON codes (gameid, name);
+        CREATE INDEX IF NOT EXISTS codes_path ON codes (path);
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        try:
+            self.connection = sqlite3.connect(str(path))
+            self.connection.execute("PRAGMA foreign_keys = ON")
+            self.connection.executescript(CodeDatabase.SCHEMA)
+        except sqlite3.DatabaseError as e:
+            raise CodeDatabaseError(f"{path} is not a code database: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def import_folder(self, folder: Path, jobs: int = None) -> tuple:
+        """ Imports every ini of a GameSettings folder that changed since the last import,
+            parsing them in a process pool. Codes of inis that no longer exist are removed.
+            Returns the (imported, removed, failed) counts, failed inis are left as they were """
+
+        known = {path: (size, mtime) for path, size, mtime in self.connection.execute("SELECT path, size, mtime FROM files")}
+        folderKey = str(folder.resolve())
+
+        present = {}
+        for file in sorted(folder.iterdir()):
+            if file.suffix.lower() == ".ini" and file.is_file():
+                stat = file.stat()
+                present[str(file.resolve())] = (stat.st_size, stat.st_mtime_ns)
+
+        changed = [Path(path) for path, stat in present.items() if known.get(path) != stat]
+        removed = [path for path in known if path not in present and str(Path(path).parent) == folderKey]
+
+        if jobs == 1 or len(changed) < 2:
+            results = [_parse_game_ini(path) for path in changed]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                results = list(pool.map(_parse_game_ini, changed, chunksize=16))
+
+        failed = 0
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+
+            for path, codes, error in results:
+                if error is not None:
+                    failed += 1
+                    continue
+
+                key = str(path)
+                gameId = path.stem.upper()
+                self.connection.execute("DELETE FROM files WHERE path = ?", (key,))
+                self.connection.execute("INSERT INTO files (path, gameid, size, mtime) VALUES (?, ?, ?, ?)",
+                                        (key, gameId, *present[key]))
+                self.connection.executemany("INSERT INTO codes (path, gameid, position, name, creator, notes, enabled, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                            [(key, gameId, i, code.name, code.creator, "\n".join(code.notes), code.enabled, bytes(code.lines))
+                                             for i, code in enumerate(codes)])
+
+        return len(changed) - failed, len(removed), failed
+
+    def _game_rows(self, gameId: str) -> list:
+        """ Returns (name, creator, enabled, data) of a game's codes, the full ID's ini
+            overriding codes of the same name in the region free one """
+
+        gameId = gameId.upper()
+        rows = self.connection.execute("""SELECT name, creator, enabled, data, gameid = ? AS specific FROM codes
+                                          WHERE gameid IN (?, ?) ORDER BY specific, position""",
+                                       (gameId, gameId, gameId[:3])).fetchall()
+
+        overridden = {row[0] for row in rows if row[4]}
+        return [row[:4] for row in rows if row[4] or row[0] not in overridden]
+
+    def games(self) -> list:
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT gameid FROM codes ORDER BY gameid")]
+
+    def find(self, gameId: str) -> list:
+        """ Returns the (name, creator, enabled) of every code available to a game """
+
+        return [row[:3] for row in self._game_rows(gameId)]
+
+    def select(self, gameId: str, names: list = None) -> bytes:
+        """ Returns the raw code lines of the named codes in the given order,
+            or of every code enabled in Dolphin when no names are given """
+
+        rows = self._game_rows(gameId)
+        if not rows:
+            raise CodeDatabaseError(f"No codes for game ID `{gameId}' were imported")
+
+        if not names:
+            return b"".join([data for _, _, enabled, data in rows if enabled])
+
+        byName = {}
+        for name, _, _, data in rows:
+            byName.setdefault(name, data)
+
+        missing = [name for name in names if name not in byName]
+        if missing:
+            raise CodeDatabaseError(f"Codes not found for game ID `{gameId}': " + ", ".join(missing))
+
+        return b"".join([byName[name] for name in names])
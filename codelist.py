@@ -0,0 +1,466 @@
+import struct
+import threading
+
+from fileutils import get_alignment
+
+GCT_MAGIC = b"\x00\xD0\xC0\xDE" * 2
+GCT_END = b"\xF0\x00\x00\x00\x00\x00\x00\x00"
+# The codeword and info of a code line
+CODE_LINE = struct.Struct(">II")
+
+# Bytes of codelist data whose parsed codes parse_codelist keeps, for processes
+# parsing the same codelists again, like watch mode rebuilds
+PARSE_CACHE_SIZE = 4 << 20
+
+_parsed = {}
+_parsedSize = 0
+_parsedLock = threading.Lock()
+
+class CodeType:
+    """ Normalized codetypes of the Gecko codehandler. The address bit (bit 24)
+        and the pointer flag (po instead of ba, bit 28) are stripped """
+
+    Write8 = 0x00
+    Write16 = 0x02
+    Write32 = 0x04
+    WriteString = 0x06
+    WriteSerial = 0x08
+    IfEqual32 = 0x20
+    IfNotEqual32 = 0x22
+    IfGreater32 = 0x24
+    IfLower32 = 0x26
+    IfEqual16 = 0x28
+    IfNotEqual16 = 0x2A
+    IfGreater16 = 0x2C
+    IfLower16 = 0x2E
+    LoadBase = 0x40
+    SetBase = 0x42
+    StoreBase = 0x44
+    BaseCodeAddress = 0x46
+    LoadPointer = 0x48
+    SetPointer = 0x4A
+    StorePointer = 0x4C
+    PointerCodeAddress = 0x4E
+    ExecuteASM = 0xC0
+    InsertASM = 0xC2
+    Branch = 0xC6
+    OnOffSwitch = 0xCC
+    AddressRangeCheck = 0xCE
+    FullTerminator = 0xE0
+    Endif = 0xE2
+    EndOfCodes = 0xF0
+    InsertASMChecksum = 0xF2
+    InsertASMChecksumPointer = 0xF4
+    MemorySearch = 0xF6
+
+class GeckoCode(object):
+    """ A single code entry of a GCT, including any lines of data that belong to it.
+        Codes are never changed once made, the with_ methods return modified copies """
+
+    def __init__(self, codeword: int, info: int, payload: bytes = b""):
+        self.codeword = codeword
+        self.info = info
+        self.payload = payload
+        self._raw = None
+
+        # The codetype with the address bit and pointer flag stripped, see CodeType
+        codetype = (codeword >> 24) & 0xFE
+        if codetype < 0x60 or 0xC0 <= codetype < 0xE0:
+            codetype &= 0xEE
+        self.codetype = codetype
+
+        # Does this code push a new level of code execution status?
+        self.isConditional = (codetype & 0xE0 == 0x20 or codetype & 0xF0 == 0xA0
+                              or codetype in (CodeType.AddressRangeCheck, CodeType.MemorySearch))
+
+    def __repr__(self) -> str:
+        return f"GeckoCode({self.codeword:08X} {self.info:08X}, payload={len(self.payload)} bytes)"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, GeckoCode):
+            return NotImplemented
+        return self.raw == other.raw
+
+    def __hash__(self) -> int:
+        return hash(self.raw)
+
+    def copy(self):
+        """ Returns an identical code that is a distinct object, for lists telling codes apart by identity """
+
+        code = object.__new__(GeckoCode)
+        code.__dict__.update(self.__dict__)
+        return code
+
+    @property
+    def raw(self) -> bytes:
+        if self._raw is None:
+            self._raw = CODE_LINE.pack(self.codeword, self.info) + self.payload
+        return self._raw
+
+    @property
+    def size(self) -> int:
+        return 8 + len(self.payload)
+
+    @property
+    def offset(self) -> int:
+        """ The 25 bit address offset field, including the address bit of the codetype """
+        return self.codeword & 0x1FFFFFF
+
+    @property
+    def isPointer(self) -> bool:
+        """ Is the address of this code relative to the pointer (po) rather than the base address (ba)? """
+        if self.codetype in (CodeType.InsertASMChecksum, CodeType.InsertASMChecksumPointer):
+            return self.codetype == CodeType.InsertASMChecksumPointer
+        return (self.codeword & 0x10000000) != 0
+
+    @property
+    def isWrite(self) -> bool:
+        return self.codetype & 0xE0 == 0x00
+
+    @property
+    def isIf(self) -> bool:
+        """ Is this a memory comparison conditional (2x/3x)? """
+        return self.codetype & 0xE0 == 0x20
+
+    @property
+    def isFlowControl(self) -> bool:
+        """ Does this code jump between lines of the codelist (6x), or toggle its status by itself (CC)? """
+        return self.codetype & 0xE0 == 0x60 or self.codetype == CodeType.OnOffSwitch
+
+    @property
+    def isTerminator(self) -> bool:
+        return self.codetype in (CodeType.FullTerminator, CodeType.Endif)
+
+    @property
+    def endifFirst(self) -> bool:
+        """ Conditionals with bit 0 of the address set apply an endif before they are evaluated """
+        return self.isConditional and self.codetype != CodeType.MemorySearch and (self.codeword & 1) != 0
+
+    @property
+    def endifCount(self) -> int:
+        return self.codeword & 0xFF if self.codetype == CodeType.Endif else 0
+
+    @property
+    def isElse(self) -> bool:
+        return self.codetype == CodeType.Endif and (self.codeword & 0x100000) != 0
+
+    def with_endif_first(self, endif: bool):
+        """ Returns a copy of this conditional with the endif bit set or cleared """
+
+        codeword = (self.codeword | 1) if endif else (self.codeword & 0xFFFFFFFE)
+        return GeckoCode(codeword, self.info, self.payload)
+
+    @staticmethod
+    def endif(count: int = 1, isElse: bool = False, info: int = 0):
+        return GeckoCode(0xE2000000 | (0x100000 if isElse else 0) | (count & 0xFF), info)
+
+    @staticmethod
+    def set_pointer(address: int):
+        return GeckoCode(0x4A000000, address)
+
+    @property
+    def isSetter(self) -> bool:
+        """ Is this a 4x code that only changes ba or po? """
+        return self.codetype in (CodeType.LoadBase, CodeType.SetBase, CodeType.BaseCodeAddress,
+                                 CodeType.LoadPointer, CodeType.SetPointer, CodeType.PointerCodeAddress)
+
+    def register_usage(self) -> dict:
+        """ Returns how this code reads ba and po: {"ba": "address" | "value", ...}.
+            "address" means the register is only used as the base of this code's address,
+            "value" means the value itself is used. Registers that aren't read are left out """
+
+        codetype = self.codetype
+        base = "po" if self.isPointer else "ba"
+
+        if codetype < 0x40 or codetype in (CodeType.InsertASM, CodeType.Branch,
+                                             CodeType.InsertASMChecksum, CodeType.InsertASMChecksumPointer):
+            return {base: "address"}
+        elif codetype & 0xE0 == 0x40:
+            target = "ba" if codetype < CodeType.LoadPointer else "po"
+            usage = {}
+            if codetype in (CodeType.StoreBase, CodeType.StorePointer):
+                if (self.codeword >> 16) & 0xF:
+                    usage[base] = "value"
+                usage[target] = "value"
+                return usage
+            if (self.codeword >> 16) & 0xF:
+                usage[base] = "address" if base == target else "value"
+            if (self.codeword >> 20) & 0xF:
+                usage.setdefault(target, "address")
+            return usage
+        elif codetype in (0x80, 0x82, 0x84) and (self.codeword >> 16) & 0xF == 0:
+            return {}
+        elif codetype & 0xE0 == 0x80 and codetype not in (0x86, 0x88):
+            return {"ba": "value", "po": "value"}
+        elif codetype & 0xF0 == 0xA0 or codetype == CodeType.AddressRangeCheck:
+            return {"ba": "value", "po": "value"}
+        elif codetype == CodeType.MemorySearch and not (self.info & 0xFFFF0000 and self.info & 0xFFFF):
+            return {"ba": "value", "po": "value"}
+        return {}
+
+    def with_address(self, address: int, pointer: bool = False):
+        """ Returns a copy of this code addressing the given absolute address through
+            the default ba (0x80000000), or None if that isn't encodable.
+            pointer: address through the default po instead """
+
+        offset = address - AddressState.DEFAULT
+        if not 0 <= offset < 0x2000000:
+            return None
+
+        codetype = self.codetype
+        if codetype in (CodeType.InsertASMChecksum, CodeType.InsertASMChecksumPointer):
+            codetype = CodeType.InsertASMChecksumPointer if pointer else CodeType.InsertASMChecksum
+        elif pointer:
+            codetype |= 0x10
+        if self.isConditional:
+            offset |= self.codeword & 1
+        elif self.codetype in (CodeType.InsertASM, CodeType.Branch, CodeType.InsertASMChecksum, CodeType.InsertASMChecksumPointer):
+            offset |= self.codeword & 3
+        return GeckoCode((codetype << 24) | offset, self.info, self.payload)
+
+    def target_address(self, state) -> int:
+        """ Returns the address this code operates on given an AddressState, or None if it can't be resolved """
+
+        base = state.po if self.isPointer else state.ba
+        if base is None:
+            return None
+        offset = self.offset
+        if self.isConditional:
+            offset &= 0x1FFFFFE
+        elif self.codetype in (CodeType.Branch, CodeType.InsertASM, CodeType.InsertASMChecksum, CodeType.InsertASMChecksumPointer):
+            offset &= 0x1FFFFFC
+        return (base + offset) & 0xFFFFFFFF
+
+    def write_range(self, state) -> tuple:
+        """ Returns the (start, end) range of memory this code writes to
+            given an AddressState, or None if it can't be resolved """
+
+        codetype = self.codetype
+        if codetype in (CodeType.Write8, CodeType.Write16, CodeType.Write32, CodeType.WriteString, CodeType.WriteSerial,
+                        CodeType.InsertASM, CodeType.Branch, CodeType.InsertASMChecksum, CodeType.InsertASMChecksumPointer):
+            address = self.target_address(state)
+            if address is None:
+                return None
+        elif codetype in (CodeType.StoreBase, CodeType.StorePointer):
+            if self.codeword & 0xF000 or self.codeword & 0xF00000:
+                return None
+            address = self.info
+            if self.codeword & 0xF0000 == 0x10000:
+                base = state.po if self.isPointer else state.ba
+                if base is None:
+                    return None
+                address = (address + base) & 0xFFFFFFFF
+            elif self.codeword & 0xF0000:
+                return None
+            return (address, address + 4)
+        else:
+            return None
+
+        if codetype == CodeType.Write8:
+            return (address, address + (self.info >> 16) + 1)
+        elif codetype == CodeType.Write16:
+            return (address, address + (((self.info >> 16) + 1) << 1))
+        elif codetype == CodeType.WriteString:
+            return (address, address + self.info)
+        elif codetype == CodeType.WriteSerial:
+            data = int.from_bytes(self.payload[:2], "big", signed=False)
+            size = 1 << ((data >> 12) & 0x3)
+            increment = int.from_bytes(self.payload[2:4], "big", signed=False)
+            return (address, address + ((data & 0xFFF) * increment) + size)
+        else:
+            return (address, address + 4)
+
+def code_length(codeword: int, info: int) -> int:
+    """ Returns the full length in bytes of the code starting with the given line """
+
+    codetype = (codeword >> 24) & 0xFE
+
+    if codetype in (0x06, 0x16):
+        return 0x8 + info + get_alignment(info, 8)
+    elif codetype in (0x08, 0x18):
+        return 0x10
+    elif codetype in (0xC0, 0xC2, 0xC4, 0xD2, 0xD4):
+        return 0x8 + (info << 3)
+    elif codetype in (0xF2, 0xF4):
+        return 0x8 + ((info & 0xFF) << 3)
+    elif codetype == 0xF6:
+        return 0x8 + ((codeword & 0xFF) << 3)
+    else:
+        return 0x8
+
+def parse_codelist(data: bytes) -> list:
+    """ Splits raw GCT data into a list of GeckoCode, stopping at the end of the codelist.
+        The GCT magic header is skipped when present """
+
+    global _parsedSize
+
+    data = bytes(data)
+    with _parsedLock:
+        cached = _parsed.get(data)
+    # Every call gets its own code objects, as deduplication and the cost model track codes by id
+    if cached is not None:
+        return [code.copy() for code in cached]
+
+    offset = 8 if data[:8] == GCT_MAGIC else 0
+
+    codes = []
+    while offset + 8 <= len(data):
+        codeword, info = CODE_LINE.unpack_from(data, offset)
+        if (codeword >> 24) == CodeType.EndOfCodes:
+            break
+
+        length = code_length(codeword, info)
+        codes.append(GeckoCode(codeword, info, data[offset + 8:offset + length]))
+        offset += length
+
+    if len(data) <= PARSE_CACHE_SIZE:
+        with _parsedLock:
+            if data not in _parsed:
+                while _parsedSize + len(data) > PARSE_CACHE_SIZE:
+                    oldest = next(iter(_parsed))
+                    del _parsed[oldest]
+                    _parsedSize -= len(oldest)
+                _parsed[data] = tuple([code.copy() for code in codes])
+                _parsedSize += len(data)
+    return codes
+
+def assemble_codelist(codes: list) -> bytes:
+    """ Builds raw GCT data, including the magic header and end of codes line """
+
+    return GCT_MAGIC + b"".join([code.raw for code in codes]) + GCT_END
+
+# Codetypes that can change ba or po
+STATE_CODETYPES = frozenset((CodeType.FullTerminator, CodeType.Endif, CodeType.SetBase, CodeType.SetPointer,
+                             CodeType.LoadBase, CodeType.BaseCodeAddress, CodeType.LoadPointer,
+                             CodeType.PointerCodeAddress, CodeType.MemorySearch))
+
+class AddressState(object):
+    """ Build time knowledge of the codehandler's base address (ba) and pointer (po).
+        A value of None means the register can't be known until runtime """
+
+    DEFAULT = 0x80000000
+
+    def __init__(self, ba: int = DEFAULT, po: int = DEFAULT):
+        self.ba = ba
+        self.po = po
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, AddressState) and self.ba == other.ba and self.po == other.po
+
+    def __repr__(self) -> str:
+        ba = "?" if self.ba is None else f"0x{self.ba:08X}"
+        po = "?" if self.po is None else f"0x{self.po:08X}"
+        return f"AddressState(ba={ba}, po={po})"
+
+    def copy(self):
+        return AddressState(self.ba, self.po)
+
+    def merge(self, other):
+        """ Returns the state that holds when either this or the other state could have been taken """
+
+        return AddressState(self.ba if self.ba == other.ba else None,
+                            self.po if self.po == other.po else None)
+
+    def apply(self, code: GeckoCode):
+        """ Updates the state with the effect of the given code, assuming it executes """
+
+        codetype = code.codetype
+        if codetype not in STATE_CODETYPES:
+            return
+        elif codetype in (CodeType.FullTerminator, CodeType.Endif):
+            if code.info & 0xFFFF0000:
+                self.ba = code.info & 0xFFFF0000
+            if code.info & 0xFFFF:
+                self.po = (code.info & 0xFFFF) << 16
+        elif codetype in (CodeType.SetBase, CodeType.SetPointer):
+            if codetype == CodeType.SetBase:
+                self.ba = self._set_value(code, self.ba)
+            else:
+                self.po = self._set_value(code, self.po)
+        elif codetype in (CodeType.LoadBase, CodeType.BaseCodeAddress):
+            self.ba = None
+        elif codetype in (CodeType.LoadPointer, CodeType.PointerCodeAddress, CodeType.MemorySearch):
+            self.po = None
+
+    def _set_value(self, code: GeckoCode, current: int) -> int:
+        """ Resolves the value of a 42/4A code (42TYZ00N XXXXXXXX). T=1 adds to the
+            register, Y=1 adds ba (po for 5x codes) and Z=1 adds gecko register N """
+
+        add = (code.codeword >> 20) & 0xF
+        relative = (code.codeword >> 16) & 0xF
+        if (code.codeword >> 12) & 0xF or add > 1 or relative > 1:
+            return None
+
+        value = code.info
+        if relative:
+            base = self.po if code.isPointer else self.ba
+            if base is None:
+                return None
+            value += base
+        if add:
+            if current is None:
+                return None
+            value += current
+        return value & 0xFFFFFFFF
+
+class _Level(object):
+    """ One level of code execution status pushed by a conditional """
+
+    def __init__(self, state: AddressState):
+        self.saved = state.copy()
+        self.thenState = None
+
+def iter_states(codes: list):
+    """ Yields (code, AddressState, depth) for each code, where the state is
+        what is known about ba/po right before the code executes and depth is
+        the number of conditionals the code is nested in. Blocks that change
+        ba/po conditionally leave the register unknown once they close.
+        Codes that run with the same ba/po share their state, which must not be changed """
+
+    state = AddressState()
+    snapshot = state.copy()
+    stack = []
+
+    for code in codes:
+        codetype = code.codetype
+        if code.isConditional:
+            if code.endifFirst and stack:
+                state = state.merge(stack.pop().saved)
+                snapshot = state.copy()
+            yield code, snapshot, len(stack)
+            stack.append(_Level(state))
+        else:
+            if codetype == CodeType.FullTerminator:
+                while stack:
+                    state = _close_level(stack.pop(), state)
+                snapshot = state.copy()
+            elif codetype == CodeType.Endif:
+                for _ in range(min(code.endifCount, len(stack))):
+                    state = _close_level(stack.pop(), state)
+                if code.isElse and stack:
+                    level = stack[-1]
+                    if level.thenState is None:
+                        level.thenState = state
+                        state = level.saved.copy()
+                snapshot = state.copy()
+            yield code, snapshot, len(stack)
+
+        if codetype in STATE_CODETYPES:
+            state.apply(code)
+            snapshot = state.copy()
+
+def _close_level(level: _Level, state: AddressState) -> AddressState:
+    if level.thenState is not None:
+        return state.merge(level.thenState)
+    return state.merge(level.saved)
+
+def split_blocks(codes: list) -> list:
+    """ Splits the codelist into blocks that start at the top level, keeping every
+        conditional together with the codes it guards and the terminators closing it """
+
+    blocks = []
+    for code, _, depth in iter_states(codes):
+        if not blocks or (depth == 0 and not code.isTerminator):
+            blocks.append([])
+        blocks[-1].append(code)
+    return blocks
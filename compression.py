@@ -0,0 +1,150 @@
+YAZ0_MAGIC = b"Yaz0"
+YAZ0_HEADER_SIZE = 0x10
+
+MIN_MATCH = 3
+MAX_MATCH = 0xFF + 0x12
+WINDOW_SIZE = 0x1000
+MAX_CANDIDATES = 16
+
+class CompressionError(Exception): pass
+
+def match_length(data: bytes, candidate: int, position: int, limit: int, known: int = 0) -> int:
+    """ Returns how many bytes at position repeat those at candidate, up to limit.
+        known: bytes already known to match. Most matches are short, so the length
+        is bracketed by doubling before the binary search """
+
+    low = known
+    high = min(max(known, 4) << 1, limit)
+    while data[candidate + low:candidate + high] == data[position + low:position + high]:
+        if high == limit:
+            return limit
+        low = high
+        high = min(high << 1, limit)
+
+    high -= 1
+    while low < high:
+        middle = (low + high + 1) >> 1
+        if data[candidate + low:candidate + middle] == data[position + low:position + middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def hash_chain(data: bytes) -> list:
+    """ Returns for each position the last earlier position starting with the same
+        MIN_MATCH bytes, or -1. Positions too close to the end to match get -1 """
+
+    chain = [-1] * len(data)
+    last = {}
+    get = last.get
+    for position, key in enumerate([data[i:i + MIN_MATCH] for i in range(len(data) - MIN_MATCH + 1)]):
+        chain[position] = get(key, -1)
+        last[key] = position
+    return chain
+
+def compress(data: bytes) -> bytes:
+    """ Compresses data to the Yaz0 format, the same LZ variant the games
+        themselves decode. The result is padded to a multiple of 4 bytes """
+
+    data = bytes(data)
+    size = len(data)
+    result = bytearray(YAZ0_MAGIC + size.to_bytes(4, "big", signed=False) + b"\x00" * 8)
+    chain = hash_chain(data)
+
+    group = bytearray()
+    flags = 0
+    count = 0
+    i = 0
+
+    while i < size:
+        bestLength = 0
+        bestDistance = 0
+
+        candidate = chain[i]
+        if candidate >= 0 and i - candidate <= WINDOW_SIZE:
+            limit = MAX_MATCH if i + MAX_MATCH <= size else size - i
+            for _ in range(MAX_CANDIDATES):
+                # Only a candidate matching one byte further can beat the best match
+                if data[candidate + bestLength] == data[i + bestLength]:
+                    length = match_length(data, candidate, i, limit, MIN_MATCH)
+                    if length > bestLength:
+                        bestLength = length
+                        bestDistance = i - candidate
+                        if length == limit:
+                            break
+                candidate = chain[candidate]
+                if candidate < 0 or i - candidate > WINDOW_SIZE:
+                    break
+
+        if bestLength >= MIN_MATCH:
+            distance = bestDistance - 1
+            if bestLength >= 0x12:
+                group += bytes([distance >> 8, distance & 0xFF, bestLength - 0x12])
+            else:
+                group += bytes([((bestLength - 2) << 4) | (distance >> 8), distance & 0xFF])
+            i += bestLength
+        else:
+            flags |= 0x80 >> count
+            group.append(data[i])
+            i += 1
+
+        count += 1
+        if count == 8:
+            result.append(flags)
+            result += group
+            group.clear()
+            flags = 0
+            count = 0
+
+    if count:
+        result.append(flags)
+        result += group
+
+    result += b"\x00" * (-len(result) & 3)
+    return bytes(result)
+
+def decompress(data: bytes) -> bytes:
+    """ Reference decoder of Yaz0 data, matching the loader's """
+
+    if data[:4] != YAZ0_MAGIC or len(data) < YAZ0_HEADER_SIZE:
+        raise CompressionError("Data is not Yaz0 compressed")
+
+    size = int.from_bytes(data[4:8], "big", signed=False)
+    result = bytearray()
+    i = YAZ0_HEADER_SIZE
+
+    try:
+        while len(result) < size:
+            flags = data[i]
+            i += 1
+            for bit in range(8):
+                if len(result) >= size:
+                    break
+
+                if flags & (0x80 >> bit):
+                    result.append(data[i])
+                    i += 1
+                    continue
+
+                distance = (((data[i] & 0xF) << 8) | data[i + 1]) + 1
+                length = data[i] >> 4
+                i += 2
+                if length == 0:
+                    length = data[i] + 0x12
+                    i += 1
+                else:
+                    length += 2
+
+                if distance > len(result):
+                    raise CompressionError(f"Back reference at 0x{i:X} is out of bounds")
+
+                start = len(result) - distance
+                if distance >= length:
+                    result += result[start:start + length]
+                else:
+                    for j in range(length):
+                        result.append(result[start + j])
+    except IndexError:
+        raise CompressionError("Compressed data is truncated")
+
+    return bytes(result[:size])
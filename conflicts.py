@@ -0,0 +1,136 @@
+import heapq
+
+from codelist import CodeType, iter_states
+from optimizer import read_range
+from tools import IntervalSet
+
+CONFLICT_POLICIES = ("error", "warn", "last")
+
+# Codes that can be dropped once everything they write is overwritten by a later file
+REPLACEABLE_CODETYPES = (CodeType.Write8, CodeType.Write16, CodeType.Write32, CodeType.WriteString,
+                         CodeType.WriteSerial, CodeType.InsertASM, CodeType.Branch,
+                         CodeType.InsertASMChecksum, CodeType.InsertASMChecksumPointer)
+
+class WriteTarget(object):
+    """ A static range of memory a code of a merged codelist writes to or hooks """
+
+    def __init__(self, start: int, end: int, source: int, index: int, code, depth: int):
+        self.start = start
+        self.end = end
+        self.source = source
+        self.index = index
+        self.code = code
+        self.depth = depth
+
+    def __lt__(self, other) -> bool:
+        return (self.start, self.end, self.source, self.index) < (other.start, other.end, other.source, other.index)
+
+class WriteConflict(object):
+    """ Two codes of different source files writing to overlapping memory,
+        earlier being the one of the file merged first """
+
+    def __init__(self, earlier: WriteTarget, later: WriteTarget):
+        self.earlier = earlier
+        self.later = later
+
+    @property
+    def start(self) -> int:
+        return max(self.earlier.start, self.later.start)
+
+    @property
+    def end(self) -> int:
+        return min(self.earlier.end, self.later.end)
+
+    def describe(self, names: list) -> str:
+        return (f"0x{self.start:08X}-0x{self.end:08X} is written by "
+                f"`{self.earlier.code.codeword:08X} {self.earlier.code.info:08X}' of {names[self.earlier.source]} and "
+                f"`{self.later.code.codeword:08X} {self.later.code.info:08X}' of {names[self.later.source]}")
+
+def merged_states(codeLists: list) -> list:
+    """ Returns (source, index, code, state, depth) for each code of the merged codelists,
+        see iter_states. codeLists is the list of GeckoCode of each source file, in the
+        order they are merged """
+
+    merged = [(source, index, code) for source, codes in enumerate(codeLists) for index, code in enumerate(codes)]
+    return [(source, index, code, state, depth)
+            for (source, index, _), (code, state, depth) in zip(merged, iter_states([code for _, _, code in merged]))]
+
+def write_targets(codeLists: list) -> list:
+    """ Returns the WriteTarget of every code of the merged codelists whose
+        destination is known at build time """
+
+    targets = []
+    for source, index, code, state, depth in merged_states(codeLists):
+        writeRange = code.write_range(state)
+        if writeRange is not None and writeRange[0] < writeRange[1]:
+            targets.append(WriteTarget(writeRange[0], writeRange[1], source, index, code, depth))
+    return targets
+
+def find_conflicts(codeLists: list) -> list:
+    """ Returns every WriteConflict between codes of different source files,
+        found with a sweep over the targets sorted by start address """
+
+    conflicts = []
+    active = []
+    for target in sorted(write_targets(codeLists)):
+        while active and active[0][0] <= target.start:
+            heapq.heappop(active)
+
+        for _, other in active:
+            if other.source != target.source:
+                earlier, later = (other, target) if other.source < target.source else (target, other)
+                conflicts.append(WriteConflict(earlier, later))
+
+        heapq.heappush(active, (target.end, target))
+
+    conflicts.sort(key=lambda conflict: (conflict.earlier.source, conflict.earlier.index, conflict.later.source, conflict.later.index))
+    return conflicts
+
+def keep_last(codeLists: list, conflicts: list) -> tuple:
+    """ Removes the codes of earlier files whose whole write range is overwritten
+        by unconditional codes of later files before anything reads it, so the last
+        file wins without the codehandler writing the same memory twice per frame.
+        Returns the new code lists and the conflicts that remain """
+
+    merged = merged_states(codeLists)
+    positions = {(source, index): i for i, (source, index, _, _, _) in enumerate(merged)}
+
+    overwrites = {}
+    for conflict in conflicts:
+        earlier = conflict.earlier
+        if earlier.code.codetype not in REPLACEABLE_CODETYPES:
+            continue
+        # Serial writes skip the memory between their values
+        if conflict.later.depth == 0 and conflict.later.code.codetype != CodeType.WriteSerial:
+            overwrites.setdefault((earlier.source, earlier.index), (earlier, {}))[1][positions[(conflict.later.source, conflict.later.index)]] = conflict.later
+
+    removed = set()
+    for key, (earlier, laters) in overwrites.items():
+        if overwritten_unread(merged, positions[key], earlier, laters):
+            removed.add(key)
+
+    newLists = [[code for index, code in enumerate(codes) if (source, index) not in removed]
+                for source, codes in enumerate(codeLists)]
+    remaining = [conflict for conflict in conflicts
+                 if (conflict.earlier.source, conflict.earlier.index) not in removed
+                 and (conflict.later.source, conflict.later.index) not in removed]
+    return newLists, remaining
+
+def overwritten_unread(merged: list, position: int, earlier: WriteTarget, laters: dict) -> bool:
+    """ Is every byte the earlier target writes overwritten by one of the later targets,
+        given by their position in the merged codelists, before any code reads it? """
+
+    pending = IntervalSet([(earlier.start, earlier.end)])
+    for i in range(position + 1, len(merged)):
+        if i in laters:
+            pending.remove(laters[i].start, laters[i].end)
+            if not pending:
+                return True
+            continue
+
+        _, _, code, state, _ = merged[i]
+        readRange = read_range(code, state)
+        if readRange == (None, None) or (readRange is not None and pending.overlaps(*readRange)):
+            return False
+
+    return False
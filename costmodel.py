@@ -0,0 +1,200 @@
+import tools
+from codelist import AddressState, CodeType, GeckoCode, iter_states, split_blocks
+
+# Estimated PPC instructions spent by the Gecko codehandler. These are derived
+# from the structure of the handler's routines rather than measured on hardware,
+# so they are for comparing codelists against each other, not cycle counting.
+DISPATCH_COST = 14
+CODE_COSTS = {
+    CodeType.Write8: (6, 4),
+    CodeType.Write16: (6, 4),
+    CodeType.Write32: (6, 0),
+    CodeType.WriteString: (8, 3),
+    CodeType.WriteSerial: (10, 8),
+    CodeType.LoadBase: (10, 0),
+    CodeType.SetBase: (8, 0),
+    CodeType.StoreBase: (8, 0),
+    CodeType.BaseCodeAddress: (6, 0),
+    CodeType.LoadPointer: (10, 0),
+    CodeType.SetPointer: (8, 0),
+    CodeType.StorePointer: (8, 0),
+    CodeType.PointerCodeAddress: (6, 0),
+    CodeType.ExecuteASM: (8, 1),
+    CodeType.InsertASM: (20, 0),
+    CodeType.Branch: (12, 0),
+    CodeType.InsertASMChecksum: (24, 3),
+    CodeType.InsertASMChecksumPointer: (24, 3),
+    CodeType.FullTerminator: (8, 0),
+    CodeType.Endif: (8, 0),
+    CodeType.MemorySearch: (12, 6),
+}
+IF_COST = 10
+DEFAULT_COST = 10
+CACHE_LINE = 32
+
+def cache_lines(start: int, end: int) -> int:
+    if end <= start:
+        return 0
+    return ((end - 1) // CACHE_LINE) - (start // CACHE_LINE) + 1
+
+def code_cost(code: GeckoCode, state: AddressState) -> tuple:
+    """ Returns the estimated (instructions, bytes written, cache lines flushed)
+        of one execution of a code, including the handler's dispatch """
+
+    codetype = code.codetype
+    if code.isIf:
+        return (DISPATCH_COST + IF_COST, 0, 0)
+
+    base, repeat = CODE_COSTS.get(codetype, (DEFAULT_COST, 0))
+    instructions = DISPATCH_COST + base
+    written = 0
+    flushed = 0
+
+    writeRange = code.write_range(state)
+    if writeRange is None and code.isWrite:
+        writeRange = code.write_range(AddressState(0, 0))
+
+    if codetype in (CodeType.Write8, CodeType.Write16):
+        instructions += repeat * ((code.info >> 16) + 1)
+    elif codetype == CodeType.WriteString:
+        instructions += repeat * code.info
+    elif codetype == CodeType.WriteSerial:
+        instructions += repeat * ((int.from_bytes(code.payload[:2], "big", signed=False) & 0xFFF) + 1)
+    elif codetype == CodeType.ExecuteASM:
+        instructions += repeat * (len(code.payload) >> 2)
+    elif codetype == CodeType.InsertASMChecksum or codetype == CodeType.InsertASMChecksumPointer:
+        instructions += repeat * ((code.info >> 24) & 0xFF)
+    elif codetype == CodeType.MemorySearch:
+        start = code.info & 0xFFFF0000
+        end = (code.info & 0xFFFF) << 16
+        instructions += repeat * (max(end - start, 0) >> 2)
+
+    if codetype in (CodeType.InsertASM, CodeType.InsertASMChecksum, CodeType.InsertASMChecksumPointer):
+        # The hook branch and the branch back at the end of the payload
+        written = 8
+        flushed = 2
+    elif writeRange is not None:
+        if codetype == CodeType.WriteSerial:
+            data = int.from_bytes(code.payload[:2], "big", signed=False)
+            count = (data & 0xFFF) + 1
+            written = count << ((data >> 12) & 0x3)
+            flushed = count
+        else:
+            written = writeRange[1] - writeRange[0]
+            flushed = cache_lines(*writeRange)
+
+    return (instructions, written, flushed)
+
+class BlockCost(object):
+    """ Estimated per frame codehandler work of one code block """
+
+    def __init__(self, index: int, offset: int, codes: list):
+        self.index = index
+        self.offset = offset
+        self.codes = codes
+        self.instructions = 0
+        self.skippedInstructions = 0
+        self.bytesWritten = 0
+        self.cacheLines = 0
+        self.depth = 0
+
+    @property
+    def size(self) -> int:
+        return sum([code.size for code in self.codes])
+
+    @property
+    def name(self) -> str:
+        return f"{self.codes[0].codeword:08X} {self.codes[0].info:08X}"
+
+class CostReport(object):
+    """ Estimated per frame codehandler work of a whole codelist """
+
+    def __init__(self, blocks: list):
+        self.blocks = blocks
+
+    @property
+    def instructions(self) -> int:
+        return sum([block.instructions for block in self.blocks])
+
+    @property
+    def skippedInstructions(self) -> int:
+        return sum([block.skippedInstructions for block in self.blocks])
+
+    @property
+    def bytesWritten(self) -> int:
+        return sum([block.bytesWritten for block in self.blocks])
+
+    @property
+    def cacheLines(self) -> int:
+        return sum([block.cacheLines for block in self.blocks])
+
+    @property
+    def depth(self) -> int:
+        return max([block.depth for block in self.blocks], default=0)
+
+    @property
+    def size(self) -> int:
+        return sum([block.size for block in self.blocks])
+
+    def ranked(self) -> list:
+        return sorted(self.blocks, key=lambda block: (block.instructions, block.bytesWritten), reverse=True)
+
+    def summary(self) -> str:
+        return (f"{self.instructions} instructions ({self.skippedInstructions} when all conditionals fail), "
+                f"{self.bytesWritten} bytes written, {self.cacheLines} cache lines flushed, "
+                f"{len(self.blocks)} blocks, max depth {self.depth}")
+
+    def format(self, limit: int = 20, baseline=None) -> list:
+        """ Returns the lines of a ranked report of the most expensive blocks.
+            baseline: the CostReport of the codelist before it was optimized """
+
+        lines = [f"  :: Estimated codehandler cost per frame: {self.summary()}"]
+
+        if baseline is not None:
+            lines.append(f"  :: Before optimizing: {baseline.summary()}")
+            lines.append(f"  :: Optimizing saved {baseline.instructions - self.instructions} instructions, "
+                         f"{baseline.bytesWritten - self.bytesWritten} bytes written and "
+                         f"{baseline.cacheLines - self.cacheLines} cache lines per frame, "
+                         f"and 0x{baseline.size - self.size:X} bytes of codelist")
+
+        if self.blocks:
+            lines.append("  ::")
+            lines.append("  ::   Rank  Offset    First line          Instrs   Written  Lines  Depth")
+            for rank, block in enumerate(self.ranked()[:limit]):
+                lines.append(f"  ::   {rank + 1:<5} 0x{block.offset:06X}  {block.name}  {block.instructions:>7}  {block.bytesWritten:>8}  {block.cacheLines:>5}  {block.depth:>5}")
+
+        return lines
+
+    def print(self, limit: int = 20, baseline=None):
+        for line in self.format(limit, baseline):
+            print(tools.color_text(line, defaultColor=tools.TGREENLIT))
+
+def estimate_cost(codes: list) -> CostReport:
+    """ Estimates the per frame codehandler work of each block of the codelist.
+        Instructions assume every conditional passes, skippedInstructions assume
+        they all fail, in which case the handler only dispatches the skipped codes """
+
+    states = {id(code): (state, depth) for code, state, depth in iter_states(codes)}
+    blocks = []
+    offset = 8
+
+    for i, blockCodes in enumerate(split_blocks(codes)):
+        block = BlockCost(i, offset, blockCodes)
+        for j, code in enumerate(blockCodes):
+            state, depth = states[id(code)]
+            instructions, written, flushed = code_cost(code, state)
+
+            block.instructions += instructions
+            block.bytesWritten += written
+            block.cacheLines += flushed
+            block.depth = max(block.depth, depth + (1 if code.isConditional else 0))
+
+            if j == 0 or code.isTerminator:
+                block.skippedInstructions += instructions
+            else:
+                block.skippedInstructions += DISPATCH_COST
+
+        offset += block.size
+        blocks.append(block)
+
+    return CostReport(blocks)
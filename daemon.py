@@ -0,0 +1,335 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Queue
+from pathlib import Path
+
+from builder import BuildError, BuildOptions, build, load_dol, read_dol
+from cache import MemoryCodelistCache
+from daemonclient import (BUILD_CANCELLED, BUILD_FAILED, INTERNAL_ERROR,
+                          INVALID_PARAMS, INVALID_REQUEST, METHOD_NOT_FOUND,
+                          PARSE_ERROR, PROTOCOL_VERSION, DaemonError)
+from fileutils import resource_path
+from kernel import Toolchain
+
+# Per worker process state, kept warm between the builds of the daemon.
+# The toolchains and dols are kept in least recently used order
+MAX_TOOLCHAINS = 4
+MAX_DOLS = 8
+_toolchains = {}
+_dols = {}
+_parseCache = None
+_events = None
+
+def _init_worker(events: Queue, cacheFolder: Path):
+    global _events, _parseCache
+
+    # Ctrl+C reaches the whole process group, the daemon shuts the workers down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _events = events
+    _parseCache = MemoryCodelistCache(cacheFolder)
+
+def _remember(entries: dict, key, load, maxEntries: int):
+    """ Returns the entry of the key, loading it when missing, and evicts the least
+        recently used entries past maxEntries """
+
+    entry = entries.pop(key, None)
+    if entry is None:
+        entry = load()
+    entries[key] = entry
+    while len(entries) > maxEntries:
+        del entries[next(iter(entries))]
+    return entry
+
+def _toolchain(handlerPath) -> Toolchain:
+    """ Returns the Toolchain of the handler, loading it again when one of its binaries changed """
+
+    paths = [resource_path("bin/geckoloader.bin"), resource_path("bin/codehandler.bin") if handlerPath is None else Path(handlerPath)]
+
+    key = tuple([(str(path), path.stat().st_mtime_ns) for path in paths])
+    return _remember(_toolchains, key, lambda: Toolchain.load(None if handlerPath is None else Path(handlerPath)), MAX_TOOLCHAINS)
+
+def _dol(path: Path):
+    """ Returns the parsed dol, parsing it again when it changed """
+
+    stat = path.stat()
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    for older in [older for older in _dols if older[0] == key[0] and older != key]:
+        del _dols[older]
+    return _remember(_dols, key, lambda: load_dol(read_dol(path)), MAX_DOLS)
+
+def run_build(buildId, dol: str, codes: str, options: dict) -> tuple:
+    """ Builds in a worker process, returning the summary of the build and the built dol """
+
+    _events.put((buildId, "building"))
+
+    options = BuildOptions(**options)
+    if options.jobs is None:
+        options.jobs = 1
+
+    try:
+        result = build(_dol(Path(dol)), Path(codes), options, _toolchain(options.handlerPath), _parseCache)
+    except OSError as e:
+        raise BuildError(f"{e.strerror}: {e.filename}" if e.filename else str(e))
+
+    summary = result.summary()
+    summary["cost"] = None if result.cost is None else result.cost.instructions
+    summary["baselineCost"] = None if result.baselineCost is None else result.baselineCost.instructions
+    summary["cached"] = result.cached
+    summary["elapsed"] = result.elapsed
+    return summary, result.data
+
+def _valid_id(requestId) -> bool:
+    """ Is this a request id the daemon accepts, a string, an integer or null? """
+
+    return requestId is None or (isinstance(requestId, (str, int)) and not isinstance(requestId, bool))
+
+class _Connection(object):
+    """ A client of the daemon, to which the replies and events of its requests are sent """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+
+    def send(self, message: dict):
+        if self.writer.is_closing():
+            return
+        self.writer.write(json.dumps(message).encode("utf-8") + b"\n")
+
+    def reply(self, requestId, result):
+        if requestId is not None:
+            self.send({"jsonrpc": "2.0", "id": requestId, "result": result})
+
+    def fail(self, requestId, code: int, message: str):
+        self.send({"jsonrpc": "2.0", "id": requestId, "error": {"code": code, "message": message}})
+
+    def notify(self, method: str, params: dict):
+        self.send({"jsonrpc": "2.0", "method": method, "params": params})
+
+class _Build(object):
+    """ A build requested from the daemon, by the id of its request """
+
+    def __init__(self, connection: _Connection):
+        self.connection = connection
+        self.future = None
+        self.cancelled = False
+
+class BuildDaemon(object):
+    """ Local build server speaking JSON-RPC 2.0 over a Unix domain socket, one message
+        per line. Builds run on a pool of worker processes that keep the toolchains,
+        parsed dols and parsed codelists of earlier builds in memory.
+
+        Methods:
+            build {dol, codes, dest, options}: builds and saves dest, returning the summary
+                of the build. Sends progress events {id, stage} as the build is queued,
+                built and saved. The id of the request is the id of the build
+            cancel {id}: cancels a build. Queued builds never run, builds already running
+                finish in their worker, but dest isn't written
+            ping: returns the status of the daemon
+            shutdown: stops the daemon once the reply is sent
+
+        Request ids are strings, integers or null """
+
+    def __init__(self, socketPath: Path, workers: int = None, cacheFolder: Path = None):
+        self.socketPath = socketPath
+        self.workers = workers or os.cpu_count() or 1
+        self.cacheFolder = cacheFolder
+        self.builds = {}
+        self.completed = 0
+        self._tasks = set()
+        self._clients = {}
+        self._loop = None
+        self._stopped = None
+        self._pool = None
+        self._events = None
+
+    def check_socket(self):
+        """ Removes the socket of a daemon that didn't shut down cleanly.
+            Raises DaemonError when a daemon is still listening on it """
+
+        if not hasattr(socket, "AF_UNIX"):
+            raise DaemonError("Unix domain sockets are unsupported on this platform")
+
+        if not self.socketPath.exists():
+            self.socketPath.parent.mkdir(parents=True, exist_ok=True)
+            return
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(self.socketPath))
+            except OSError:
+                self.socketPath.unlink()
+                return
+        raise DaemonError(f"A daemon is already listening on {self.socketPath}")
+
+    async def serve(self):
+        """ Serves requests until shutdown is called """
+
+        self.check_socket()
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._events = Queue()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                         initargs=(self._events, self.cacheFolder))
+        threading.Thread(target=self._read_events, daemon=True).start()
+
+        server = await asyncio.start_unix_server(self.handle_client, path=str(self.socketPath))
+        os.chmod(self.socketPath, 0o600)
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            for pending in self.builds.values():
+                pending.cancelled = True
+                pending.future.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            # Closed connections end their handlers, which asyncio would cancel otherwise
+            for writer in self._clients.values():
+                writer.close()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._events.put(None)
+            try:
+                self.socketPath.unlink()
+            except OSError:
+                pass
+
+    def stop(self):
+        self._stopped.set()
+
+    def _read_events(self):
+        """ Forwards the events of the workers to the event loop, until None is received """
+
+        while (event := self._events.get()) is not None:
+            self._loop.call_soon_threadsafe(self.progress, *event)
+
+    def progress(self, buildId, stage: str):
+        pending = self.builds.get(buildId)
+        if pending is not None and not pending.cancelled:
+            pending.connection.notify("progress", {"id": buildId, "stage": stage})
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = _Connection(writer)
+        self._clients[asyncio.current_task()] = writer
+        try:
+            while line := await reader.readline():
+                self.dispatch(connection, line)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self._clients[asyncio.current_task()]
+            writer.close()
+
+    def dispatch(self, connection: _Connection, line: bytes):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            connection.fail(None, PARSE_ERROR, f"Invalid JSON: {e}")
+            return
+
+        if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" or not isinstance(request.get("method"), str):
+            connection.fail(request.get("id") if isinstance(request, dict) else None, INVALID_REQUEST, "Not a JSON-RPC 2.0 request")
+            return
+
+        requestId = request.get("id")
+        if not _valid_id(requestId):
+            connection.fail(None, INVALID_REQUEST, "The id must be a string, an integer or null")
+            return
+
+        params = request.get("params", {})
+        method = request["method"]
+        if not isinstance(params, dict):
+            connection.fail(requestId, INVALID_PARAMS, "The params must be an object")
+        elif method == "build":
+            self.start_build(connection, requestId, params)
+        elif method == "cancel":
+            if _valid_id(params.get("id")):
+                connection.reply(requestId, {"cancelled": self.cancel(params.get("id"))})
+            else:
+                connection.fail(requestId, INVALID_PARAMS, "The id must be a string, an integer or null")
+        elif method == "ping":
+            connection.reply(requestId, {"version": PROTOCOL_VERSION, "workers": self.workers,
+                                         "running": len(self.builds), "completed": self.completed})
+        elif method == "shutdown":
+            connection.reply(requestId, None)
+            self.stop()
+        else:
+            connection.fail(requestId, METHOD_NOT_FOUND, f"Unknown method `{method}'")
+
+    def start_build(self, connection: _Connection, buildId, params: dict):
+        if buildId is None:
+            connection.fail(None, INVALID_REQUEST, "A build request needs an id")
+            return
+        if buildId in self.builds:
+            connection.fail(buildId, INVALID_REQUEST, f"A build with the id {buildId} is already running")
+            return
+
+        paths = [params.get(key) for key in ("dol", "codes", "dest")]
+        if not all([isinstance(path, str) and Path(path).is_absolute() for path in paths]):
+            connection.fail(buildId, INVALID_PARAMS, "The dol, codes and dest paths must be given and absolute")
+            return
+
+        options = params.get("options", {})
+        try:
+            BuildOptions(**options).validate()
+        except (TypeError, BuildError) as e:
+            connection.fail(buildId, INVALID_PARAMS, str(e))
+            return
+
+        pending = _Build(connection)
+        pending.future = self._pool.submit(run_build, buildId, paths[0], paths[1], options)
+        self.builds[buildId] = pending
+        connection.notify("progress", {"id": buildId, "stage": "queued"})
+
+        task = self._loop.create_task(self.finish_build(buildId, pending, Path(paths[2])))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def finish_build(self, buildId, pending: _Build, dest: Path):
+        connection = pending.connection
+        try:
+            try:
+                summary, data = await asyncio.wrap_future(pending.future)
+            except Exception:
+                # A build cancelled while running is reported cancelled however it ended
+                if not pending.cancelled:
+                    raise
+            if pending.cancelled:
+                raise asyncio.CancelledError()
+
+            connection.notify("progress", {"id": buildId, "stage": "saving"})
+            await self._loop.run_in_executor(None, self.save, dest, data)
+        except asyncio.CancelledError:
+            connection.fail(buildId, BUILD_CANCELLED, "The build was cancelled")
+        except BuildError as e:
+            connection.fail(buildId, BUILD_FAILED, str(e))
+        except OSError as e:
+            connection.fail(buildId, BUILD_FAILED, f"Failed to save the dol: {e}")
+        except Exception as e:
+            connection.fail(buildId, INTERNAL_ERROR, f"{type(e).__name__}: {e}")
+        else:
+            summary["dest"] = str(dest)
+            connection.reply(buildId, summary)
+        finally:
+            del self.builds[buildId]
+            self.completed += 1
+
+    @staticmethod
+    def save(dest: Path, data: bytes):
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest.write_bytes(data)
+
+    def cancel(self, buildId) -> bool:
+        """ Cancels a build, returning False if there is no such build """
+
+        pending = self.builds.get(buildId)
+        if pending is None or pending.cancelled:
+            return False
+
+        pending.cancelled = True
+        pending.future.cancel()
+        return True
@@ -0,0 +1,157 @@
+import argparse
+import itertools
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+
+# Version of the protocol spoken by the daemon, see daemon.BuildDaemon
+PROTOCOL_VERSION = 1
+
+# JSON-RPC 2.0 error codes, and the ones of the daemon
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+BUILD_FAILED = 1
+BUILD_CANCELLED = 2
+
+class DaemonError(Exception):
+    """ A failed call to the daemon. code is the JSON-RPC error code, None when
+        the daemon couldn't be reached """
+
+    def __init__(self, message: str, code: int = None):
+        super().__init__(message)
+        self.code = code
+
+def default_socket_path() -> Path:
+    """ Returns the socket the daemon listens on by default, in the runtime folder of the user """
+
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return Path(runtime) / "geckoloader.sock"
+    return Path.home() / ".GeckoLoader" / "daemon.sock"
+
+class DaemonClient(object):
+    """ Connection to a running build daemon. Only uses the standard library,
+        so scripts calling the daemon start in milliseconds """
+
+    def __init__(self, socketPath: Path = None, timeout: float = None):
+        self.socketPath = socketPath or default_socket_path()
+        self._ids = itertools.count(1)
+
+        if not hasattr(socket, "AF_UNIX"):
+            raise DaemonError("Unix domain sockets are unsupported on this platform")
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(str(self.socketPath))
+        except OSError as e:
+            self._socket.close()
+            raise DaemonError(f"No daemon is listening on {self.socketPath}: {e.strerror}")
+        self._stream = self._socket.makefile("rwb")
+
+    def close(self):
+        self._stream.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def call(self, method: str, params: dict = None, requestId=None, onProgress=None):
+        """ Calls a method of the daemon and returns its result, raising DaemonError
+            on an error response. onProgress is called with the params of each
+            progress event sent until the response """
+
+        requestId = self.next_id() if requestId is None else requestId
+        message = {"jsonrpc": "2.0", "id": requestId, "method": method, "params": params or {}}
+        try:
+            self._stream.write(json.dumps(message).encode("utf-8") + b"\n")
+            self._stream.flush()
+
+            while True:
+                line = self._stream.readline()
+                if not line:
+                    raise DaemonError("The daemon closed the connection")
+
+                reply = json.loads(line)
+                if reply.get("id") == requestId and "method" not in reply:
+                    break
+                if reply.get("method") == "progress" and onProgress is not None:
+                    onProgress(reply["params"])
+        except OSError as e:
+            raise DaemonError(f"Lost the connection to the daemon: {e}")
+
+        if "error" in reply:
+            raise DaemonError(reply["error"]["message"], reply["error"]["code"])
+        return reply["result"]
+
+    def ping(self) -> dict:
+        return self.call("ping")
+
+    def build(self, dol: Path, codes: Path, dest: Path, options: dict = None, requestId=None, onProgress=None) -> dict:
+        """ Builds the dol with the codelist and saves it to dest, returning the summary of the build.
+            options: BuildOptions by name. Paths are sent absolute, as the daemon runs elsewhere """
+
+        params = {"dol": str(Path(dol).resolve()), "codes": str(Path(codes).resolve()),
+                  "dest": str(Path(dest).resolve()), "options": options or {}}
+        return self.call("build", params, requestId, onProgress)
+
+    def cancel(self, requestId) -> bool:
+        """ Cancels a build by the id of its request, from any connection """
+
+        return self.call("cancel", {"id": requestId})["cancelled"]
+
+    def shutdown(self):
+        self.call("shutdown")
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="daemonclient", description="Calls a running GeckoLoader build daemon")
+    parser.add_argument("--socket", help="Socket of the daemon", metavar="PATH")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("ping", help="Prints the status of the daemon")
+    commands.add_parser("stop", help="Stops the daemon")
+    buildParser = commands.add_parser("build", help="Builds a dol")
+    buildParser.add_argument("dol")
+    buildParser.add_argument("codes")
+    buildParser.add_argument("dest")
+    buildParser.add_argument("--options", help="BuildOptions as a JSON object", default="{}", metavar="JSON")
+    cancelParser = commands.add_parser("cancel", help="Cancels a build")
+    cancelParser.add_argument("id")
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        try:
+            options = json.loads(args.options)
+        except ValueError as e:
+            parser.error(f"--options is not valid JSON: {e}")
+
+    try:
+        with DaemonClient(Path(args.socket) if args.socket else None) as client:
+            if args.command == "ping":
+                print(json.dumps(client.ping()))
+            elif args.command == "stop":
+                client.shutdown()
+            elif args.command == "cancel":
+                return 0 if client.cancel(args.id) else 1
+            else:
+                requestId = f"{os.getpid()}-{client.next_id()}"
+                onProgress = lambda event: print(f"{event['id']}: {event['stage']}", file=sys.stderr)
+                print(json.dumps(client.build(args.dol, args.codes, args.dest, options, requestId, onProgress)))
+    except DaemonError as e:
+        print(f"daemonclient: error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,61 @@ class UnmappedAddressError(Exception): pass
 class SectionCountFullError(Exception): pass
 class AddressOutOfRangeError(Exception): pass
 
+class SectionData(object):
+    """ Stream of a section's data over a buffer shared with other DolFile,
+        copied into a private BytesIO the first time it's written """
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer).toreadonly()
+        self._stream = None
+        self._position = 0
+
+    @property
+    def shared(self) -> bool:
+        return self._stream is None
+
+    def read(self, size: int = -1) -> bytes:
+        if self._stream is not None:
+            return self._stream.read(size)
+
+        end = len(self._buffer) if size is None or size < 0 else min(self._position + size, len(self._buffer))
+        data = self._buffer[self._position:end].tobytes()
+        self._position = max(self._position, end)
+        return data
+
+    def write(self, data: bytes) -> int:
+        if self._stream is None:
+            self._stream = BytesIO(self._buffer)
+            self._stream.seek(self._position)
+        return self._stream.write(data)
+
+    def seek(self, where: int, whence: int = 0) -> int:
+        if self._stream is not None:
+            return self._stream.seek(where, whence)
+
+        if whence == 1:
+            where += self._position
+        elif whence == 2:
+            where += len(self._buffer)
+        self._position = max(where, 0)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position if self._stream is None else self._stream.tell()
+
+    def getbuffer(self) -> memoryview:
+        return self._buffer if self._stream is None else self._stream.getbuffer()
+
+    def getvalue(self) -> bytes:
+        return self._buffer.tobytes() if self._stream is None else self._stream.getvalue()
+
+    def copy(self):
+        """ Returns a stream of the same data, sharing the buffer until either is written """
+
+        if self._stream is None:
+            return SectionData(self._buffer)
+        return BytesIO(self._stream.getvalue())
+
 class DolFile(object):
 
     class SectionType:
@@ -22,7 +77,9 @@ class DolFile(object):
     entryInfoLoc = 0xE0
 
     def __init__(self, f=None):
-        
+        """ f: file object of the dol, or a buffer of it that the sections are
+            read from without copying, see SectionData """
+
         self.textSections = []
         self.dataSections = []
 
@@ -31,7 +88,12 @@ class DolFile(object):
         self.entryPoint = 0x80003000
 
         if f is None: return
-        
+
+        buffer = None
+        if isinstance(f, (bytes, bytearray, memoryview)):
+            buffer = memoryview(f)
+            f = BytesIO(buffer[:0x100])
+
         # Read text and data section addresses and sizes 
         for i in range(DolFile.maxTextSections + DolFile.maxDataSections):
             f.seek(DolFile.offsetInfoLoc + (i << 2))
@@ -42,8 +104,11 @@ class DolFile(object):
             size = read_uint32(f)
             
             if offset >= 0x100:
-                f.seek(offset)
-                data = BytesIO(f.read(size))
+                if buffer is not None:
+                    data = SectionData(buffer[offset:offset + size])
+                else:
+                    f.seek(offset)
+                    data = BytesIO(f.read(size))
                 if i < DolFile.maxTextSections:
                     self.textSections.append({"offset": offset, "address": address, "size": size, "data": data, "type": DolFile.SectionType.Text})
                 else:
@@ -60,6 +125,25 @@ class DolFile(object):
         self.seek(self._currLogicAddr)
         f.seek(0)
 
+    def copy(self):
+        """ Returns a DolFile of the same contents. Section data is shared between
+            the copies until one of them writes to it """
+
+        dolFile = DolFile()
+        for sections, copies in ((self.textSections, dolFile.textSections), (self.dataSections, dolFile.dataSections)):
+            for section in sections:
+                data = section["data"]
+                copies.append({**section, "data": data.copy() if isinstance(data, SectionData) else BytesIO(data.getvalue())})
+
+        dolFile.bssAddress = self.bssAddress
+        dolFile.bssSize = self.bssSize
+        dolFile.entryPoint = self.entryPoint
+
+        if dolFile.textSections or dolFile.dataSections:
+            dolFile._currLogicAddr = dolFile.first_section["address"]
+            dolFile.seek(dolFile._currLogicAddr)
+        return dolFile
+
     def __repr__(self) -> str:
         return f"repr={vars(self)}"
 
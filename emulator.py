@@ -0,0 +1,665 @@
+import random
+
+from codelist import CodeType, GeckoCode, assemble_codelist, parse_codelist
+from dolreader import DolFile, SectionData, UnmappedAddressError
+from kernel import GCT
+
+MEM1_START = 0x80000000
+MEM1_SIZE = 0x1800000
+
+class EmulatorError(Exception): pass
+class UnsupportedCodeError(EmulatorError): pass
+class MemoryAccessError(EmulatorError): pass
+
+class Memory(object):
+    """ Flat image of MEM1 (0x80000000 - 0x81800000), cached (8) and uncached (C) addresses alias """
+
+    def __init__(self, data: bytearray = None):
+        self.data = bytearray(MEM1_SIZE) if data is None else data
+        # Offset ranges written since track() was called, None when not tracking
+        self.written = None
+
+    @classmethod
+    def from_dol(cls, dolFile: DolFile):
+        """ Returns the memory image right after the dol is loaded, with bss cleared """
+
+        memory = cls()
+        for section in dolFile.sections:
+            memory.write(section["address"], section["data"].getvalue())
+        return memory
+
+    def copy(self):
+        return Memory(bytearray(self.data))
+
+    def track(self):
+        """ Records the ranges written from now on, see restore """
+
+        self.written = []
+
+    def restore(self, base):
+        """ Undoes the tracked writes by copying their ranges back from base, the image
+            this one was equal to when tracking started, and keeps tracking """
+
+        for start, end in self.written:
+            self.data[start:end] = base.data[start:end]
+        self.written = []
+
+    def offset(self, address: int, size: int) -> int:
+        if address >> 28 not in (0x8, 0xC):
+            raise MemoryAccessError(f"Address 0x{address:08X} is outside of MEM1")
+
+        offset = address & 0xFFFFFFF
+        if offset + size > MEM1_SIZE:
+            raise MemoryAccessError(f"Access of 0x{size:X} bytes at 0x{address:08X} is outside of MEM1")
+        return offset
+
+    def read(self, address: int, size: int) -> bytes:
+        offset = self.offset(address, size)
+        return bytes(self.data[offset:offset + size])
+
+    def read_uint(self, address: int, size: int) -> int:
+        offset = self.offset(address, size)
+        return int.from_bytes(self.data[offset:offset + size], "big", signed=False)
+
+    def write(self, address: int, data: bytes):
+        offset = self.offset(address, len(data))
+        self.data[offset:offset + len(data)] = data
+        if self.written is not None:
+            self.written.append((offset, offset + len(data)))
+
+    def write_uint(self, address: int, value: int, size: int):
+        self.write(address, (value & ((1 << (size << 3)) - 1)).to_bytes(size, "big", signed=False))
+
+    def find(self, pattern: bytes, start: int, end: int) -> int:
+        """ Returns the first word aligned address of pattern in [start, end), or None """
+
+        startOffset = self.offset(start, 0)
+        endOffset = self.offset(end, 0) if end > start else startOffset
+        index = self.data.find(pattern, startOffset, endOffset)
+        while index >= 0 and index & 3:
+            index = self.data.find(pattern, index + 1, endOffset)
+        if index < 0:
+            return None
+        return MEM1_START + index
+
+    def diff(self, other, blockSize: int = 0x1000, ranges: list = None) -> list:
+        """ Returns the (start, end) address ranges where this image differs from another.
+            ranges: the only offset ranges where the images can differ, instead of all of MEM1 """
+
+        differences = []
+        if ranges is None:
+            if self.data == other.data:
+                return differences
+            ranges = [(0, MEM1_SIZE)]
+
+        view = memoryview(self.data)
+        otherView = memoryview(other.data)
+        for rangeStart, rangeEnd in merge_ranges(ranges):
+            for block in range(rangeStart, rangeEnd, blockSize):
+                blockEnd = min(block + blockSize, rangeEnd)
+                if view[block:blockEnd] == otherView[block:blockEnd]:
+                    continue
+                for i in range(block, blockEnd):
+                    if self.data[i] == other.data[i]:
+                        continue
+                    address = MEM1_START + i
+                    if differences and differences[-1][1] == address:
+                        differences[-1] = (differences[-1][0], address + 1)
+                    else:
+                        differences.append((address, address + 1))
+
+        return differences
+
+def merge_ranges(ranges: list) -> list:
+    """ Returns the sorted union of (start, end) ranges """
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class Emulator(object):
+    """ Reference interpreter of the Gecko codehandler, running a codelist against a Memory image.
+
+        PPC code isn't executed: C0 codes are recorded in asmCalls. C2/F2/F4 codes write
+        the branch to their payload in the codelist at the hook like the codehandler does,
+        and are recorded in hooks (hook address -> payload) and hookBranches (hook address
+        -> branch). F2/F4 checksums aren't verified. The codelist itself is assumed to be copied to
+        codelistAddress, which 46/4E codes resolve against. Flow control (6x, CC) and
+        the 8x/Ax forms that aren't listed in the dispatch table raise UnsupportedCodeError """
+
+    def __init__(self, codes: list, memory: Memory, codelistAddress: int = 0x80003000):
+        self.memory = memory
+        self.codelistAddress = codelistAddress
+        self.registers = [0] * 16
+        self.hooks = {}
+        self.hookBranches = {}
+        self.asmCalls = []
+        self.frame = 0
+        self.ba = MEM1_START
+        self.po = MEM1_START
+        self._stack = []
+        self._active = True
+
+        dispatch = {
+            CodeType.Write8: self._write8,
+            CodeType.Write16: self._write16,
+            CodeType.Write32: self._write32,
+            CodeType.WriteString: self._write_string,
+            CodeType.WriteSerial: self._write_serial,
+            CodeType.LoadBase: self._load,
+            CodeType.SetBase: self._set,
+            CodeType.StoreBase: self._store,
+            CodeType.BaseCodeAddress: self._code_address,
+            CodeType.LoadPointer: self._load,
+            CodeType.SetPointer: self._set,
+            CodeType.StorePointer: self._store,
+            CodeType.PointerCodeAddress: self._code_address,
+            0x80: self._set_register,
+            0x82: self._load_register,
+            0x84: self._store_register,
+            0x86: self._operate_register,
+            CodeType.ExecuteASM: self._execute_asm,
+            CodeType.InsertASM: self._insert_asm,
+            CodeType.Branch: self._branch,
+            CodeType.AddressRangeCheck: self._range_check,
+            CodeType.FullTerminator: self._full_terminator,
+            CodeType.Endif: self._endif,
+            CodeType.InsertASMChecksum: self._insert_asm,
+            CodeType.InsertASMChecksumPointer: self._insert_asm,
+            CodeType.MemorySearch: self._memory_search,
+        }
+        for codetype in range(0x20, 0x30, 2):
+            dispatch[codetype] = self._if
+
+        # Decode the codelist once so frames only pay for executing it
+        self.program = []
+        address = codelistAddress + 8
+        for code in codes:
+            handler = dispatch.get(code.codetype, self._unsupported)
+            self.program.append((handler, code, code.isConditional or code.isTerminator, address))
+            address += code.size
+
+    def run(self, frames: int = 1):
+        for _ in range(frames):
+            self.run_frame()
+
+    def run_frame(self):
+        self.ba = MEM1_START
+        self.po = MEM1_START
+        self._stack = []
+        self._active = True
+        self.frame += 1
+
+        for handler, code, alwaysDispatch, address in self.program:
+            if self._active or alwaysDispatch:
+                handler(code, address)
+
+    def _base(self, code: GeckoCode) -> int:
+        return self.po if code.isPointer else self.ba
+
+    def _address(self, code: GeckoCode) -> int:
+        return (self._base(code) + code.offset) & 0xFFFFFFFF
+
+    def _push(self, result: bool):
+        self._stack.append(self._active and result)
+        self._active = self._stack[-1]
+
+    def _pop(self, count: int):
+        if count:
+            del self._stack[-count:]
+        self._active = self._stack[-1] if self._stack else True
+
+    def _unsupported(self, code: GeckoCode, address: int):
+        raise UnsupportedCodeError(f"Codetype 0x{code.codetype:02X} ({code.codeword:08X} {code.info:08X}) isn't supported")
+
+    def _write8(self, code: GeckoCode, address: int):
+        self.memory.write(self._address(code), bytes([code.info & 0xFF]) * ((code.info >> 16) + 1))
+
+    def _write16(self, code: GeckoCode, address: int):
+        self.memory.write(self._address(code), (code.info & 0xFFFF).to_bytes(2, "big", signed=False) * ((code.info >> 16) + 1))
+
+    def _write32(self, code: GeckoCode, address: int):
+        self.memory.write_uint(self._address(code), code.info, 4)
+
+    def _write_string(self, code: GeckoCode, address: int):
+        self.memory.write(self._address(code), code.payload[:code.info])
+
+    def _write_serial(self, code: GeckoCode, address: int):
+        target = self._address(code)
+        data = int.from_bytes(code.payload[:2], "big", signed=False)
+        size = 1 << ((data >> 12) & 0x3)
+        count = (data & 0xFFF) + 1
+        addressIncrement = int.from_bytes(code.payload[2:4], "big", signed=False)
+        valueIncrement = int.from_bytes(code.payload[4:8], "big", signed=False)
+
+        if size > 4:
+            self._unsupported(code, address)
+
+        if valueIncrement == 0 and addressIncrement == size:
+            self.memory.write(target, (code.info & ((1 << (size << 3)) - 1)).to_bytes(size, "big", signed=False) * count)
+            return
+
+        value = code.info
+        for _ in range(count):
+            self.memory.write_uint(target, value, size)
+            target = (target + addressIncrement) & 0xFFFFFFFF
+            value = (value + valueIncrement) & 0xFFFFFFFF
+
+    def _if(self, code: GeckoCode, address: int):
+        if code.endifFirst and self._stack:
+            self._pop(1)
+
+        if not self._active:
+            self._push(False)
+            return
+
+        target = self._address(code) & 0xFFFFFFFE
+        if code.codetype & 0x8:
+            value = self.memory.read_uint(target, 2) & ~(code.info >> 16) & 0xFFFF
+            compare = code.info & 0xFFFF
+        else:
+            value = self.memory.read_uint(target & 0xFFFFFFFC, 4)
+            compare = code.info
+
+        comparison = code.codetype & 0x6
+        if comparison == 0:
+            self._push(value == compare)
+        elif comparison == 2:
+            self._push(value != compare)
+        elif comparison == 4:
+            self._push(value > compare)
+        else:
+            self._push(value < compare)
+
+    def _value(self, code: GeckoCode) -> int:
+        """ Resolves XXXXXXXX of a 4x code (4NTYZ00N), adding ba/po (Y) and gecko register N (Z) """
+
+        if (code.codeword >> 16) & 0xF > 1 or (code.codeword >> 12) & 0xF > 1:
+            self._unsupported(code, None)
+
+        value = code.info
+        if (code.codeword >> 16) & 0xF:
+            value += self._base(code)
+        if (code.codeword >> 12) & 0xF:
+            value += self.registers[code.codeword & 0xF]
+        return value & 0xFFFFFFFF
+
+    def _assign(self, code: GeckoCode, value: int):
+        """ Sets ba for 40-46 codes or po for 48-4E codes, adding to it if T=1 """
+
+        add = (code.codeword >> 20) & 0xF
+        if add > 1:
+            self._unsupported(code, None)
+
+        if code.codetype < CodeType.LoadPointer:
+            self.ba = ((self.ba if add else 0) + value) & 0xFFFFFFFF
+        else:
+            self.po = ((self.po if add else 0) + value) & 0xFFFFFFFF
+
+    def _load(self, code: GeckoCode, address: int):
+        self._assign(code, self.memory.read_uint(self._value(code), 4))
+
+    def _set(self, code: GeckoCode, address: int):
+        self._assign(code, self._value(code))
+
+    def _store(self, code: GeckoCode, address: int):
+        value = self.ba if code.codetype == CodeType.StoreBase else self.po
+        self.memory.write_uint(self._value(code), value, 4)
+
+    def _code_address(self, code: GeckoCode, address: int):
+        offset = code.codeword & 0xFFFF
+        if offset & 0x8000:
+            offset -= 0x10000
+        value = (address + offset) & 0xFFFFFFFF
+        if code.codetype == CodeType.BaseCodeAddress:
+            self.ba = value
+        else:
+            self.po = value
+
+    def _set_register(self, code: GeckoCode, address: int):
+        """ 80SY000N XXXXXXXX: grN = (grN if S) + XXXXXXXX + (ba/po if Y) """
+
+        add = (code.codeword >> 20) & 0xF
+        relative = (code.codeword >> 16) & 0xF
+        if add > 1 or relative > 1:
+            self._unsupported(code, address)
+
+        value = code.info
+        if relative:
+            value += self._base(code)
+        if add:
+            value += self.registers[code.codeword & 0xF]
+        self.registers[code.codeword & 0xF] = value & 0xFFFFFFFF
+
+    def _load_register(self, code: GeckoCode, address: int):
+        """ 82UY000N XXXXXXXX: grN = [XXXXXXXX + (ba/po if Y)] of size U """
+
+        size = 1 << ((code.codeword >> 20) & 0xF)
+        if size > 4 or (code.codeword >> 16) & 0xF > 1:
+            self._unsupported(code, address)
+
+        target = code.info
+        if (code.codeword >> 16) & 0xF:
+            target += self._base(code)
+        self.registers[code.codeword & 0xF] = self.memory.read_uint(target & 0xFFFFFFFF, size)
+
+    def _store_register(self, code: GeckoCode, address: int):
+        """ 84UYZZZN XXXXXXXX: [XXXXXXXX + (ba/po if Y)] = grN of size U, ZZZ + 1 times """
+
+        size = 1 << ((code.codeword >> 20) & 0xF)
+        if size > 4 or (code.codeword >> 16) & 0xF > 1:
+            self._unsupported(code, address)
+
+        target = code.info
+        if (code.codeword >> 16) & 0xF:
+            target += self._base(code)
+        value = self.registers[code.codeword & 0xF] & ((1 << (size << 3)) - 1)
+        count = ((code.codeword >> 4) & 0xFFF) + 1
+        self.memory.write(target & 0xFFFFFFFF, value.to_bytes(size, "big", signed=False) * count)
+
+    def _operate_register(self, code: GeckoCode, address: int):
+        """ 86T0000N XXXXXXXX: grN = grN <op T> XXXXXXXX, for the integer operations """
+
+        operation = (code.codeword >> 20) & 0xF
+        if (code.codeword >> 16) & 0xF or operation > 8:
+            self._unsupported(code, address)
+
+        value = self.registers[code.codeword & 0xF]
+        operand = code.info
+        if operation == 0:
+            value += operand
+        elif operation == 1:
+            value *= operand
+        elif operation == 2:
+            value |= operand
+        elif operation == 3:
+            value &= operand
+        elif operation == 4:
+            value ^= operand
+        elif operation == 5:
+            value = 0 if operand & 0x20 else value << (operand & 0x1F)
+        elif operation == 6:
+            value = 0 if operand & 0x20 else value >> (operand & 0x1F)
+        elif operation == 7:
+            operand &= 0x1F
+            value = (value << operand) | (value >> (32 - operand))
+        else:
+            signed = value - 0x100000000 if value & 0x80000000 else value
+            value = signed >> min(operand & 0x3F, 31)
+        self.registers[code.codeword & 0xF] = value & 0xFFFFFFFF
+
+    def _execute_asm(self, code: GeckoCode, address: int):
+        self.asmCalls.append(code.payload)
+
+    def _insert_asm(self, code: GeckoCode, address: int):
+        hook = self._address(code) & 0xFFFFFFFC
+        branch = ((address + 8 - hook) & 0x3FFFFFC) | 0x48000000
+        self.memory.write_uint(hook, branch, 4)
+        self.hooks[hook] = code.payload
+        self.hookBranches[hook] = branch
+
+    def _branch(self, code: GeckoCode, address: int):
+        origin = self._address(code) & 0xFFFFFFFC
+        destination = code.info & 0xFFFFFFFC
+        self.memory.write_uint(origin, (destination - origin) & 0x3FFFFFD | 0x48000000 | (code.offset & 1), 4)
+
+    def _range_check(self, code: GeckoCode, address: int):
+        if code.endifFirst and self._stack:
+            self._pop(1)
+        value = self._base(code)
+        self._push((code.info & 0xFFFF0000) <= value < ((code.info & 0xFFFF) << 16))
+
+    def _memory_search(self, code: GeckoCode, address: int):
+        if not self._active:
+            self._push(False)
+            return
+
+        start = code.info & 0xFFFF0000 or self.ba
+        end = (code.info & 0xFFFF) << 16 or self.po
+        found = self.memory.find(code.payload, start, end)
+        if found is not None:
+            self.po = found
+        self._push(found is not None)
+
+    def _apply_registers(self, code: GeckoCode):
+        if code.info & 0xFFFF0000:
+            self.ba = code.info & 0xFFFF0000
+        if code.info & 0xFFFF:
+            self.po = (code.info & 0xFFFF) << 16
+
+    def _full_terminator(self, code: GeckoCode, address: int):
+        self._pop(len(self._stack))
+        self._apply_registers(code)
+
+    def _endif(self, code: GeckoCode, address: int):
+        self._pop(min(code.endifCount, len(self._stack)))
+        if code.isElse and self._stack:
+            parentActive = len(self._stack) < 2 or self._stack[-2]
+            self._stack[-1] = parentActive and not self._stack[-1]
+            self._active = self._stack[-1]
+        self._apply_registers(code)
+
+def copy_dol(dolFile: DolFile) -> DolFile:
+    return dolFile.copy()
+
+def run_codelist(codes: list, dolFile: DolFile, frames: int = 1, memory: Memory = None) -> Emulator:
+    """ Runs the codelist for the given number of frames against the memory image of the dol.
+        memory: a prebuilt image of the dol to copy instead of loading it again """
+
+    emulator = Emulator(codes, memory.copy() if memory is not None else Memory.from_dol(dolFile))
+    emulator.run(frames)
+    return emulator
+
+def compare_runs(original: Emulator, optimized: Emulator, frames: int = 2, tracked: bool = False) -> list:
+    """ Runs both emulators for the given number of frames and returns how they differ:
+        a list of strings, empty if the final memory, gecko registers, installed hooks
+        and ASM executed in the last frame are the same. The branches of hooks installed
+        by both are patched in the optimized memory to match, see Emulator.
+        tracked: both memories were tracked from identical images, so only the ranges
+        they wrote are compared """
+
+    original.run(frames - 1)
+    optimized.run(frames - 1)
+    original.asmCalls.clear()
+    optimized.asmCalls.clear()
+    original.run_frame()
+    optimized.run_frame()
+
+    # Branches to the same payload only differ by where it is in each codelist,
+    # so the bytes of them that weren't overwritten since are taken as equal
+    for hook, branch in original.hookBranches.items():
+        if optimized.hooks.get(hook) != original.hooks[hook]:
+            continue
+        branches = zip(original.memory.read(hook, 4), optimized.memory.read(hook, 4),
+                       branch.to_bytes(4, "big"), optimized.hookBranches[hook].to_bytes(4, "big"))
+        optimized.memory.write(hook, bytes([byte if byte == branchByte and other == otherBranchByte else other
+                                            for byte, other, branchByte, otherBranchByte in branches]))
+
+    ranges = original.memory.written + optimized.memory.written if tracked else None
+
+    differences = []
+    for start, end in original.memory.diff(optimized.memory, ranges=ranges):
+        differences.append(f"Memory differs at 0x{start:08X}-0x{end:08X}: "
+                           f"{original.memory.read(start, end - start).hex().upper()} != "
+                           f"{optimized.memory.read(start, end - start).hex().upper()}")
+    if original.registers != optimized.registers:
+        differences.append(f"Gecko registers differ: {original.registers} != {optimized.registers}")
+    if original.hooks != optimized.hooks:
+        differences.append(f"Installed hooks differ at {sorted(set(original.hooks.items()) ^ set(optimized.hooks.items()))}")
+    if original.asmCalls != optimized.asmCalls:
+        differences.append("Executed ASM differs")
+    return differences
+
+def compare_builds(codes: list, dolFile: DolFile, optimizedCodes: list, optimizedDol: DolFile, frames: int = 2, memory: Memory = None) -> list:
+    """ Runs both builds for the given number of frames and returns how they differ, see
+        compare_runs. Pre patched writes land in the first frame of the optimized build,
+        so compare after at least 2 frames for codelists that read what they write.
+        memory: a prebuilt image of the original dol """
+
+    original = Emulator(codes, memory.copy() if memory is not None else Memory.from_dol(dolFile))
+    optimized = Emulator(optimizedCodes, Memory.from_dol(optimizedDol))
+    return compare_runs(original, optimized, frames)
+
+class OptimizerCheck(object):
+    """ Checks the optimizer on codelists for a dol, see check. The memory image of the dol
+        is built once. Both builds of each check run on scratch copies of it, which only
+        have the memory they wrote restored afterwards """
+
+    def __init__(self, dolFile: DolFile, memory: Memory = None):
+        """ memory: a prebuilt image of the dol """
+
+        self.dolFile = dolFile
+        self.memory = memory if memory is not None else Memory.from_dol(dolFile)
+        self._original = self.memory.copy()
+        self._optimized = self.memory.copy()
+        self._original.track()
+        self._optimized.track()
+
+    def check(self, codes: list, frames: int = 2, staticAsm: bool = False) -> list:
+        """ Optimizes the codelist against a copy of the dol and compares both builds, see compare_builds.
+            Static ASM hooks are compiled into the dol rather than installed by the codehandler,
+            so they always show up as differences when staticAsm is used """
+
+        optimizedDol = copy_dol(self.dolFile)
+        geckoCodes = GCT(assemble_codelist(codes))
+        geckoCodes.optimize_codelist(optimizedDol, staticAsm)
+        optimizedCodes = parse_codelist(geckoCodes.codeList.getvalue())
+
+        try:
+            # The optimized build starts from the image of the dol with the sections the optimizer patched
+            for section in optimizedDol.sections:
+                if not isinstance(section["data"], SectionData) or not section["data"].shared:
+                    self._optimized.write(section["address"], section["data"].getvalue())
+            return compare_runs(Emulator(codes, self._original), Emulator(optimizedCodes, self._optimized), frames, True)
+        finally:
+            self._original.restore(self.memory)
+            self._optimized.restore(self.memory)
+
+def check_optimizer(codes: list, dolFile: DolFile, frames: int = 2, staticAsm: bool = False, memory: Memory = None) -> list:
+    """ Optimizes the codelist against a copy of the dol and compares both builds, see OptimizerCheck.
+        memory: a prebuilt image of the dol """
+
+    return OptimizerCheck(dolFile, memory).check(codes, frames, staticAsm)
+
+def random_codelist(rng: random.Random, dolFile: DolFile, length: int = 16) -> list:
+    """ Generates a random codelist of the codetypes the optimizer works on, addressing
+        the sections and bss of the dol. Pointers are only ever set to known addresses """
+
+    regions = [(section["address"], section["size"], section["type"]) for section in dolFile.sections]
+    if dolFile.bssSize:
+        regions.append((dolFile.bssAddress, dolFile.bssSize, None))
+    textRegions = [region for region in regions if region[2] == DolFile.SectionType.Text]
+
+    def random_address(size: int = 4) -> int:
+        start, regionSize, _ = rng.choice(regions)
+        return (start + rng.randrange(0, max(regionSize - 0x20, 4))) & ~(size - 1) & 0xFFFFFFFF
+
+    def addressed(codetype: int, address: int):
+        """ Addresses through ba, po or a freshly set po """
+
+        choice = rng.randrange(3)
+        if choice == 0 or address - MEM1_START >= 0x2000000:
+            return [], (codetype << 24) | ((address - MEM1_START) & 0x1FFFFFF)
+        elif choice == 1:
+            base = address & 0xFFFF0000
+            return [GeckoCode(0x4A000000, base)], ((codetype | 0x10) << 24) | (address - base)
+        return [GeckoCode(0x42000000, address & 0xFFFFF000)], (codetype << 24) | (address & 0xFFF)
+
+    codes = []
+    depth = 0
+    while len(codes) < length:
+        choice = rng.randrange(12)
+        if choice <= 3:
+            kind = rng.choice((CodeType.Write8, CodeType.Write16, CodeType.Write32, CodeType.WriteString, CodeType.WriteSerial))
+            address = random_address(4)
+            setters, codeword = addressed(kind, address)
+            codes.extend(setters)
+            if kind == CodeType.Write8:
+                codes.append(GeckoCode(codeword, (rng.randrange(4) << 16) | rng.randrange(0x100)))
+            elif kind == CodeType.Write16:
+                codes.append(GeckoCode(codeword, (rng.randrange(4) << 16) | rng.randrange(0x10000)))
+            elif kind == CodeType.Write32:
+                codes.append(GeckoCode(codeword, rng.getrandbits(32)))
+            elif kind == CodeType.WriteString:
+                size = rng.randrange(1, 20)
+                payload = bytes(rng.getrandbits(8) for _ in range(size))
+                codes.append(GeckoCode(codeword, size, payload + b"\x00" * (-size & 7)))
+            else:
+                size = rng.randrange(3)
+                payload = (((size << 12) | rng.randrange(4)).to_bytes(2, "big", signed=False)
+                           + ((1 << size) * rng.randrange(1, 3)).to_bytes(2, "big", signed=False)
+                           + rng.choice((0, rng.getrandbits(32))).to_bytes(4, "big", signed=False))
+                codes.append(GeckoCode(codeword, rng.getrandbits(8 << size), payload))
+        elif choice <= 5:
+            kind = rng.randrange(0x20, 0x30, 2)
+            address = random_address(4)
+            setters, codeword = addressed(kind, address)
+            if depth and rng.randrange(4) == 0 and not setters:
+                codeword |= 1
+                depth -= 1
+            codes.extend(setters)
+            try:
+                dolFile.seek(address)
+                current = int.from_bytes(dolFile.read(4), "big", signed=False)
+            except UnmappedAddressError:
+                current = 0
+            if kind & 0x8:
+                current >>= 16
+                info = (rng.choice((0, 0xFF00)) << 16) | rng.choice((current, rng.getrandbits(16)))
+            else:
+                info = rng.choice((current, rng.getrandbits(32)))
+            codes.append(GeckoCode(codeword, info))
+            depth += 1
+        elif choice == 6 and depth:
+            count = rng.randrange(1, depth + 1)
+            isElse = rng.randrange(3) == 0
+            codes.append(GeckoCode.endif(count, isElse, rng.choice((0, 0, 0x80008000))))
+            depth -= count
+        elif choice == 7:
+            codes.append(GeckoCode(0xE0000000, rng.choice((0, 0x80008000))))
+            depth = 0
+        elif choice == 8:
+            address = random_address(4)
+            codes.append(GeckoCode(0x44000000, address))
+        elif choice == 9:
+            address = random_address(4)
+            setters, codeword = addressed(CodeType.Branch, address)
+            codes.extend(setters)
+            codes.append(GeckoCode(codeword | rng.randrange(2), random_address(4)))
+        elif choice == 10:
+            address = random_address(4)
+            setters, codeword = addressed(CodeType.InsertASM, address)
+            codes.extend(setters)
+            codes.append(GeckoCode(codeword, 1, rng.getrandbits(32).to_bytes(4, "big", signed=False) + b"\x00" * 4))
+        elif textRegions:
+            start, size, _ = rng.choice(textRegions)
+            offset = rng.randrange(0, max(size - 8, 4)) & ~3
+            dolFile.seek(start + offset)
+            pattern = dolFile.read(8)
+            end = min(start + size + 0xFFFF, 0x81800000) & 0xFFFF0000
+            codes.append(GeckoCode(0xF6000001, (start & 0xFFFF0000) | (end >> 16), pattern))
+            depth += 1
+            codes.append(GeckoCode(0x14000000 | (offset & 0xFFF), rng.getrandbits(32)))
+
+    return codes
+
+def fuzz_optimizer(dolFile: DolFile, cases: int = 1000, seed: int = 0, length: int = 16, frames: int = 2) -> list:
+    """ Checks the optimizer against random codelists, returns the (codes, differences)
+        of every case where the optimized build behaves differently """
+
+    rng = random.Random(seed)
+    checker = OptimizerCheck(dolFile)
+    failures = []
+    for _ in range(cases):
+        codes = random_codelist(rng, dolFile, length)
+        try:
+            differences = checker.check(codes, frames)
+        except EmulatorError as e:
+            differences = [str(e)]
+        if differences:
+            failures.append((codes, differences))
+    return failures
@@ -0,0 +1,73 @@
+import hashlib
+
+from codelist import CodeType
+
+# Handlers smaller than this are MINI handlers
+MINI_HANDLER_SIZE = 0x900
+
+class HandlerError(Exception): pass
+
+# Codetypes a handler of unknown capabilities is trusted with when it's a MINI handler
+BASIC_CODETYPES = frozenset((CodeType.Write8, CodeType.Write16, CodeType.Write32, CodeType.WriteString,
+                             CodeType.IfEqual32, CodeType.IfNotEqual32, CodeType.IfGreater32, CodeType.IfLower32,
+                             CodeType.IfEqual16, CodeType.IfNotEqual16, CodeType.IfGreater16, CodeType.IfLower16,
+                             CodeType.InsertASM, CodeType.FullTerminator, CodeType.Endif))
+
+# Codetypes supported by known handler binaries, by SHA-1. None means every codetype
+HANDLER_CAPABILITIES = {
+    "9874ffbed79449c0c0584d291eccb15a594535d2": None,
+}
+
+CODETYPE_NAMES = {
+    CodeType.Write8: "00 (8 bit write)",
+    CodeType.Write16: "02 (16 bit write)",
+    CodeType.Write32: "04 (32 bit write)",
+    CodeType.WriteString: "06 (string write)",
+    CodeType.WriteSerial: "08 (serial write)",
+    CodeType.LoadBase: "40 (load ba)",
+    CodeType.SetBase: "42 (set ba)",
+    CodeType.StoreBase: "44 (store ba)",
+    CodeType.BaseCodeAddress: "46 (ba to code address)",
+    CodeType.LoadPointer: "48 (load po)",
+    CodeType.SetPointer: "4A (set po)",
+    CodeType.StorePointer: "4C (store po)",
+    CodeType.PointerCodeAddress: "4E (po to code address)",
+    CodeType.ExecuteASM: "C0 (execute ASM)",
+    CodeType.InsertASM: "C2 (insert ASM)",
+    CodeType.Branch: "C6 (create branch)",
+    CodeType.OnOffSwitch: "CC (on/off switch)",
+    CodeType.AddressRangeCheck: "CE (address range check)",
+    CodeType.FullTerminator: "E0 (full terminator)",
+    CodeType.Endif: "E2 (endif)",
+    CodeType.InsertASMChecksum: "F2 (insert ASM with checksum)",
+    CodeType.InsertASMChecksumPointer: "F4 (insert ASM with checksum)",
+    CodeType.MemorySearch: "F6 (memory search)",
+}
+
+def codetype_name(codetype: int) -> str:
+    return CODETYPE_NAMES.get(codetype, f"{codetype:02X}")
+
+def codetype_usage(codes: list) -> dict:
+    """ Returns how many codes of each normalized codetype the codelist uses """
+
+    usage = {}
+    for code in codes:
+        usage[code.codetype] = usage.get(code.codetype, 0) + 1
+    return usage
+
+def handler_capabilities(data: bytes) -> frozenset:
+    """ Returns the codetypes a handler binary supports, or None if it supports every codetype.
+        Handlers missing from HANDLER_CAPABILITIES are trusted with every codetype when they
+        are FULL handlers, and only the basic ones when they are MINI handlers """
+
+    digest = hashlib.sha1(data).hexdigest()
+    if digest in HANDLER_CAPABILITIES:
+        return HANDLER_CAPABILITIES[digest]
+    return BASIC_CODETYPES if len(data) < MINI_HANDLER_SIZE else None
+
+def missing_codetypes(usage: dict, capabilities: frozenset) -> list:
+    """ Returns the codetypes of the usage a handler with these capabilities can't run """
+
+    if capabilities is None:
+        return []
+    return sorted([codetype for codetype in usage if codetype not in capabilities])
@@ -1,15 +1,33 @@
-import functools
+import hashlib
+import itertools
+import locale
+import os
 import random
 import re
+import struct
 import sys
-import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 from pathlib import Path
 
 import tools
-from dolreader import DolFile, SectionCountFullError, UnmappedAddressError
-from fileutils import (get_alignment, read_uint16, read_uint32, write_bool,
-                       write_sint32, write_ubyte, write_uint16, write_uint32)
+from cache import CodelistCache
+from codedb import CodeDatabase, CodeDatabaseError
+from codelist import (GCT_END, GCT_MAGIC, assemble_codelist, code_length,
+                      parse_codelist)
+from compression import compress
+from conflicts import find_conflicts, keep_last
+from costmodel import CostReport, estimate_cost
+from dolreader import DolFile, SectionCountFullError
+from fileutils import read_uint32, resource_path
+from handlers import (MINI_HANDLER_SIZE, HandlerError, codetype_name,
+                      codetype_usage, handler_capabilities, missing_codetypes)
+from optimizer import (STATIC_ASM_REGION, coalesce_writes, compile_asm_hooks, deduplicate_blocks,
+                       eliminate_dead_writes, evaluate_conditionals, fold_writes,
+                       resolve_addresses)
+from placeholders import (HANDLER_WORD_TAGS, KERNEL_HALF_TAGS, KERNEL_WORD_TAGS,
+                          placeholder_table)
 
 try:
     import chardet
@@ -17,25 +35,93 @@ except ImportError as IE:
     print(IE)
     sys.exit(1)
 
-def timer(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        start = time.perf_counter()
-        value = func(*args, **kwargs)
-        end = time.perf_counter()
-        print(tools.color_text(f"\n  :: Completed in {(end - start):0.4f} seconds!\n", defaultColor=tools.TGREENLIT))
-        return value
-    return wrapper
+# The first code line of each line of text, by codelist format
+OCARINA_LINE = re.compile(r"^.*?([A-F0-9]{8}[\t\f ][A-F0-9]{8})", re.IGNORECASE | re.MULTILINE)
+OCARINA_ACTIVE_LINE = re.compile(r"^.*?\*[^\S\n]*([A-F0-9]{8}[\t\f ][A-F0-9]{8})", re.IGNORECASE | re.MULTILINE)
+DOLPHIN_LINE = re.compile(r"^.*?(?<![$\*])([A-F0-9]{8}[\t\f ][A-F0-9]{8})", re.IGNORECASE | re.MULTILINE)
+
+CHARDET_SAMPLE_SIZE = 0x10000
+CODE_DATABASE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+COMPRESSION_UNSUPPORTED = "This GeckoLoader kernel doesn't support compressed codelists, rebuild bin/geckoloader.bin from loader.cpp"
+
+def decode_text(data: bytes) -> str:
+    """ Decodes text of an unknown encoding. UTF-8 (and so ASCII) is tried first,
+        otherwise chardet guesses the encoding from a sample of the text """
+
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        pass
+
+    encodeType = chardet.detect(data[:CHARDET_SAMPLE_SIZE])["encoding"]
+    try:
+        return data.decode(encodeType or locale.getpreferredencoding(False))
+    except (UnicodeDecodeError, LookupError):
+        encodeType = chardet.detect(data)["encoding"]
+        return data.decode(encodeType or locale.getpreferredencoding(False))
+
+def parse_text_codelist(geckoText: Path, includeAll: bool = False, parseCache: CodelistCache = None) -> bytes:
+    """ Returns the raw code lines of a Dolphin (.ini style) or Ocarina text codelist.
+        Ocarina codes are only included when marked active with `*', unless includeAll is set.
+        Only the first code line found on each line of text counts """
+
+    if parseCache is not None:
+        geckoCodes = parseCache.get(geckoText, includeAll)
+        if geckoCodes is not None:
+            return geckoCodes
+
+    with geckoText.open("rb") as gecko:
+        data = gecko.read()
+
+    text = decode_text(data)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    if text.lstrip("\n").startswith(("$", "[")):
+        pattern = DOLPHIN_LINE
+    elif includeAll:
+        pattern = OCARINA_LINE
+    else:
+        pattern = OCARINA_ACTIVE_LINE
+
+    geckoCodes = bytes.fromhex(" ".join(pattern.findall(text)))
+
+    if parseCache is not None:
+        parseCache.put(geckoText, includeAll, data, geckoCodes)
+
+    return geckoCodes
+
+def load_codelist_file(codeFile: Path, includeAll: bool = False, parseCache: CodelistCache = None) -> bytes:
+    """ Returns the raw code lines of a .txt or .gct file, without the GCT header and end of codes line """
+
+    if codeFile.suffix.lower() == ".txt":
+        return parse_text_codelist(codeFile, includeAll, parseCache)
+
+    with codeFile.open("rb") as gct:
+        return gct.read()[8:-8]
 
 class InvalidGeckoCodeError(Exception): pass
+class BuildError(Exception): pass
+class CodelistError(BuildError): pass
+class KernelError(BuildError): pass
+class CodehandlerError(BuildError): pass
+class CodeHookError(BuildError): pass
+class AllocationError(BuildError): pass
+class CostBudgetError(BuildError): pass
 
 class GCT(object):
 
     def __init__(self, f):
-        self.codeList = BytesIO(f.read())
+        """ f: a stream of GCT data, or the GCT data itself (bytes, bytearray or memoryview) """
+
+        if isinstance(f, (bytes, bytearray, memoryview)):
+            self.codeList = BytesIO(f)
+        else:
+            self.codeList = BytesIO(f.read())
+            f.seek(0)
+
         self.rawLineCount = tools.stream_size(self.codeList) >> 3
         self.lineCount = self.rawLineCount - 2
-        f.seek(0)
 
     @property
     def size(self):
@@ -43,136 +129,35 @@ class GCT(object):
 
     @staticmethod
     def determine_codelength(codetype, info: bytes) -> int:
-        if codetype.startswith(b"\x06"):
-            bytelength = int.from_bytes(info, byteorder="big", signed=False)
-            padding = get_alignment(bytelength, 8)
-            return 0x8 + bytelength + padding
-
-        elif (codetype.startswith(b"\x08") or codetype.startswith(b"\x09")
-            or codetype.startswith(b"\x18") or codetype.startswith(b"\x18")):
-            return 0x16
-
-        elif (codetype.startswith(b"\xC0") or codetype.startswith(b"\xC2") or codetype.startswith(b"\xC4")
-            or codetype.startswith(b"\xC3") or codetype.startswith(b"\xC5") or codetype.startswith(b"\xD2")
-            or codetype.startswith(b"\xD4") or codetype.startswith(b"\xD3") or codetype.startswith(b"\xD5")):
-            return 0x8 + (int.from_bytes(info, byteorder="big", signed=False) << 3)
-
-        elif (codetype.startswith(b"\xF2") or codetype.startswith(b"\xF3")
-            or codetype.startswith(b"\xF4") or codetype.startswith(b"\xF5")):
-            return 0x8 + (int.from_bytes(info[:2], byteorder="big", signed=False) << 3)
-
-        elif codetype.startswith(b"\xF6"):
-            return 0x8 + (int.from_bytes(info[:4], byteorder="big", signed=False) << 3)
-
-        else:
-            return 0x8
-
-    def optimize_codelist(self, dolFile: DolFile):
-        codelist = b"\x00\xD0\xC0\xDE"*2
-        skipcodes = 0
-
-        self.codeList.seek(8)
-        while codetype := self.codeList.read(4):
-            info = self.codeList.read(4)
-            address = 0x80000000 | (int.from_bytes(codetype, byteorder="big", signed=False) & 0x1FFFFFF)
-            try:
-                if skipcodes <= 0:
-                    if (codetype.startswith(b"\x00") or codetype.startswith(b"\x01")
-                        or codetype.startswith(b"\x10") or codetype.startswith(b"\x11")):
-                        dolFile.seek(address)
-
-                        counter = int.from_bytes(info[:-2], byteorder="big", signed=False)
-                        value = info[2:]
-
-                        while counter + 1 > 0:
-                            dolFile.write(value[1:])
-                            counter -= 1
-                        continue
-
-                    elif (codetype.startswith(b"\x02") or codetype.startswith(b"\x03")
-                        or codetype.startswith(b"\x12") or codetype.startswith(b"\x13")):
-                        dolFile.seek(address)
-
-                        counter = int.from_bytes(info[:-2], byteorder="big", signed=False)
-                        value = info[2:]
-
-                        while counter + 1 > 0:
-                            dolFile.write(value)
-                            counter -= 1
-                        continue
-
-                    elif (codetype.startswith(b"\x04") or codetype.startswith(b"\x05")
-                        or codetype.startswith(b"\x14") or codetype.startswith(b"\x15")):
-                        dolFile.seek(address)
-                        dolFile.write(info)
-                        continue
-
-                    elif (codetype.startswith(b"\x06") or codetype.startswith(b"\x07")
-                        or codetype.startswith(b"\x16") or codetype.startswith(b"\x17")):
-                        dolFile.seek(address)
-
-                        arraylength = int.from_bytes(info, byteorder="big", signed=False)
-                        padding = get_alignment(arraylength, 8)
-                        
-                        dolFile.write(self.codeList.read(arraylength))
-
-                        self.codeList.seek(padding, 1)
-                        continue
-
-                    elif (codetype.startswith(b"\x08") or codetype.startswith(b"\x09")
-                        or codetype.startswith(b"\x18") or codetype.startswith(b"\x19")):
-                        dolFile.seek(address)
-
-                        value = int.from_bytes(info, byteorder="big", signed=False)
-                        data = read_uint16(self.codeList)
-                        size = (data & 0x3000) >> 12
-                        counter = data & 0xFFF
-                        address_increment = read_uint16(self.codeList)
-                        value_increment = read_uint32(self.codeList)
-
-                        while counter + 1 > 0:
-                            if size == 0:
-                                write_ubyte(dolFile, value & 0xFF)
-                                dolFile.seek(-1, 1)
-                            elif size == 1:
-                                write_uint16(dolFile, value & 0xFFFF)
-                                dolFile.seek(-2, 1)
-                            elif size == 2:
-                                write_uint32(dolFile, value)
-                                dolFile.seek(-4, 1)
-                            else:
-                                raise ValueError("Size type {} does not match 08 codetype specs".format(size))
-                            
-                            dolFile.seek(address_increment, 1)
-                            value += value_increment
-                            counter -= 1
-                            if value > 0xFFFFFFFF:
-                                value -= 0x100000000
-                        continue
-
-                    elif (codetype.startswith(b"\xC6") or codetype.startswith(b"\xC7")
-                        or codetype.startswith(b"\xC6") or codetype.startswith(b"\xC7")):
-                        dolFile.insert_branch(int.from_bytes(info, byteorder="big", signed=False), address, lk=address&1)
-                        continue
-
-                if codetype.hex().startswith("2") or codetype.hex().startswith("3"):
-                    skipcodes += 1
-
-                elif codetype.startswith(b"\xE0"):
-                    skipcodes -= 1
-
-                elif codetype.startswith(b"\xF0"):
-                    codelist += b"\xF0\x00\x00\x00\x00\x00\x00\x00"
-                    break
-
-                self.codeList.seek(-8, 1)
-                codelist += self.codeList.read(GCT.determine_codelength(codetype, info))
-
-            except (RuntimeError, UnmappedAddressError):
-                self.codeList.seek(-8, 1)
-                codelist += self.codeList.read(GCT.determine_codelength(codetype, info))
-
-        self.codeList = BytesIO(codelist)
+        return code_length(int.from_bytes(codetype, byteorder="big", signed=False),
+                           int.from_bytes(info, byteorder="big", signed=False))
+
+    def optimize_codelist(self, dolFile: DolFile, staticAsm: bool = False, staticAsmRegion: tuple = None):
+        """ Pre patches what the codelist does at build time into the dol.
+            Conditionals that only test immutable dol memory are resolved first,
+            so the writes they guard can be folded as well. Codes relative to
+            a constant ba/po are made absolute so they can be folded too.
+            Of the writes left for runtime, those overwritten later in the frame
+            are removed and adjacent ones are merged into string writes.
+            staticAsm: also compile C2 codes into the dol, see optimizer.compile_asm_hooks
+            staticAsmRegion: (start, end) of the memory the C2 codes are compiled to,
+            optimizer.STATIC_ASM_REGION when None """
+
+        codes = parse_codelist(self.codeList.getvalue())
+        codes = evaluate_conditionals(codes, dolFile)
+        codes = resolve_addresses(codes)
+        codes = eliminate_dead_writes(codes)
+        codes = fold_writes(codes, dolFile)
+        if staticAsm:
+            codes = compile_asm_hooks(codes, dolFile, staticAsmRegion or STATIC_ASM_REGION)
+        codes = coalesce_writes(codes)
+
+        self.codeList = BytesIO(assemble_codelist(codes))
+
+    def estimate_cost(self) -> CostReport:
+        """ Estimates the per frame codehandler work of this codelist, see costmodel """
+
+        return estimate_cost(parse_codelist(self.codeList.getvalue()))
 
 class CodeHandler(object):
 
@@ -180,17 +165,8 @@ class CodeHandler(object):
         MINI = "MINI"
         FULL = "FULL"
 
-    def __init__(self, f):
-        self._rawData = BytesIO(f.read())
-
-        """Get codelist pointer"""
-        self._rawData.seek(0xFA)
-        codelistUpper = self._rawData.read(2).hex()
-        self._rawData.seek(0xFE)
-        codelistLower = self._rawData.read(2).hex()
-
-        self.codeListPointer = int(codelistUpper[2:] + codelistLower[2:], 16)
-        self.handlerLength = tools.stream_size(self._rawData)
+    def __init__(self, f, placeholders=None):
+        self.load_binary(f, placeholders)
         self.initAddress = 0x80001800
         self.startAddress = 0x800018A8
 
@@ -207,81 +183,152 @@ class CodeHandler(object):
         self.geckoCodes = None
         self.includeAll = False
         self.optimizeList = False
+        self.staticAsm = False
+        self.staticAsmRegion = None
+        self.parseCache = None
+        self.jobs = None
+        self.gameId = None
+        self.codeNames = None
+        self.conflictPolicy = "warn"
+        self.deduplicatedSize = 0
+        self.warnings = []
+
+    def load_binary(self, f, placeholders=None):
+        """ Loads the handler binary. placeholders: its PlaceholderTable, when already known """
+
+        self._rawData = BytesIO(f.read())
+
+        """Get codelist pointer"""
+        self._rawData.seek(0xFA)
+        codelistUpper = self._rawData.read(2).hex()
+        self._rawData.seek(0xFE)
+        codelistLower = self._rawData.read(2).hex()
+
+        self.codeListPointer = int(codelistUpper[2:] + codelistLower[2:], 16)
+        self.handlerLength = tools.stream_size(self._rawData)
+        self._placeholders = placeholders or placeholder_table(self._rawData.getvalue(), HANDLER_WORD_TAGS)
 
-        if self.handlerLength < 0x900:
+        if self.handlerLength < MINI_HANDLER_SIZE:
             self.type = CodeHandler.Types.MINI
         else:
             self.type = CodeHandler.Types.FULL
 
         f.seek(0)
 
-    def init_gct(self, gctFile: Path, tmpdir: Path=None):
-        if tmpdir is not None:
-            _tmpGct = tmpdir / "gct.bin"
-        else:
-            _tmpGct = Path("gct.bin")
+    def check_codetypes(self):
+        """ Raises HandlerError when the handler doesn't support a codetype of the codelist """
+
+        usage = codetype_usage(parse_codelist(self.geckoCodes.codeList.getvalue()))
+        missing = missing_codetypes(usage, handler_capabilities(self._rawData.getvalue()))
+        if missing:
+            raise HandlerError("The codehandler doesn't support these codetypes used by the codelist: " +
+                               ", ".join([codetype_name(codetype) for codetype in missing]))
 
+    def init_gct(self, gctFile: Path):
         if gctFile.suffix.lower() == ".txt":
-            with _tmpGct.open("wb+") as temp:
-                temp.write(bytes.fromhex("00D0C0DE"*2 + self.parse_input(gctFile) + "F000000000000000"))
-                temp.seek(0)
-                self.geckoCodes = GCT(temp)
+            try:
+                geckoCodes = self.parse_input(gctFile)
+            except (OSError, ValueError, LookupError) as e:
+                raise CodelistError(f"Failed to read the codelist {gctFile}: {e}")
+            self.geckoCodes = GCT(GCT_MAGIC + geckoCodes + GCT_END)
         elif gctFile.suffix.lower() == ".gct":
             with gctFile.open("rb") as gct:
-                self.geckoCodes = GCT(gct)
+                self.geckoCodes = GCT(gct.read())
         elif gctFile.suffix == "":
-            with _tmpGct.open("wb+") as temp:
-                temp.write(b"\x00\xD0\xC0\xDE"*2)
-
-                for file in gctFile.iterdir():
-                    if file.is_file():
-                        if file.suffix.lower() == ".txt":
-                            temp.write(bytes.fromhex(self.parse_input(file)))
-                        elif file.suffix.lower() == ".gct":
-                            with file.open("rb") as gct:
-                                temp.write(gct.read()[8:-8])
-                        else:
-                            print(tools.color_text(f"  :: HINT: {file} is not a .txt or .gct file", defaultColor=tools.TYELLOWLIT))
-            
-                temp.write(b"\xF0\x00\x00\x00\x00\x00\x00\x00")
-                temp.seek(0)
-                self.geckoCodes = GCT(temp)
+            codeFiles = []
+            for file in sorted(gctFile.iterdir()):
+                if file.is_file():
+                    if file.suffix.lower() in (".txt", ".gct"):
+                        codeFiles.append(file)
+                    else:
+                        self.warnings.append(f"HINT: {file} is not a .txt or .gct file")
+
+            codeLists = [parse_codelist(codes) for codes in self.load_codelist_files(codeFiles)]
+            codeLists = self.deduplicate(codeLists)
+            codeLists = self.check_conflicts(codeFiles, codeLists)
+
+            geckoCodes = bytearray(GCT_MAGIC)
+            for codes in codeLists:
+                for code in codes:
+                    geckoCodes += code.raw
+            geckoCodes += GCT_END
+
+            self.geckoCodes = GCT(geckoCodes)
+        elif gctFile.suffix.lower() in CODE_DATABASE_SUFFIXES:
+            if self.gameId is None:
+                raise CodelistError("A game ID is required to select codes from a code database")
+
+            try:
+                with CodeDatabase(gctFile) as database:
+                    self.geckoCodes = GCT(GCT_MAGIC + database.select(self.gameId, self.codeNames) + GCT_END)
+            except CodeDatabaseError as e:
+                raise CodelistError(str(e))
         else:
-            raise NotImplementedError(f"Parsing file type `{gctFile.suffix}' as a GCT is unsupported")
+            raise CodelistError(f"Parsing file type `{gctFile.suffix}' as a GCT is unsupported")
 
-    def parse_input(self, geckoText: Path) -> str:
-        with geckoText.open("rb") as gecko:
-            result = chardet.detect(gecko.read())
-            encodeType = result["encoding"]
+    def parse_input(self, geckoText: Path) -> bytes:
+        return parse_text_codelist(geckoText, self.includeAll, self.parseCache)
 
-        with geckoText.open("r", encoding=encodeType) as gecko:
-            geckoCodes = ""
-            state = None
+    def load_codelist_files(self, files: list) -> list:
+        """ Returns the raw code lines of each .txt/.gct file in order, parsed in a process pool.
+            Raises CodelistError listing every file that couldn't be read """
 
-            for line in gecko.readlines():
-                if line in ("", "\n"):
-                    continue
+        jobs = min(self.jobs or os.cpu_count() or 1, len(files))
+        results = []
+        errors = []
 
-                if state is None:
-                    if line.startswith("$") or line.startswith("["):
-                        state = "Dolphin"
-                    else:
-                        state = "OcarinaM"
-                
+        if jobs <= 1:
+            for file in files:
                 try:
-                    if state == "OcarinaM":
-                        if self.includeAll:
-                            geckoLine = re.findall(r"[A-F0-9]{8}[\t\f ][A-F0-9]{8}", line, re.IGNORECASE)[0]
-                        else:
-                            geckoLine = re.findall(r"(?:\*\s*)([A-F0-9]{8}[\t\f ][A-F0-9]{8})", line, re.IGNORECASE)[0]
-                    else:
-                        geckoLine = re.findall(r"(?<![$\*])[A-F0-9]{8}[\t\f ][A-F0-9]{8}", line, re.IGNORECASE)[0]
-                except IndexError:
-                    continue
+                    results.append(load_codelist_file(file, self.includeAll, self.parseCache))
+                except (OSError, ValueError, LookupError) as e:
+                    errors.append(f"  :: {file}: {e}")
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = [pool.submit(load_codelist_file, file, self.includeAll, self.parseCache) for file in files]
+                for file, future in zip(files, futures):
+                    try:
+                        results.append(future.result())
+                    except (OSError, ValueError, LookupError) as e:
+                        errors.append(f"  :: {file}: {e}")
+
+        if errors:
+            raise CodelistError("Failed to read these codelists:\n" + "\n".join(errors))
+
+        return results
 
-                geckoCodes += geckoLine.replace(" ", "").strip()
+    def deduplicate(self, codeLists: list) -> list:
+        """ Drops code blocks that repeat an identical block of the same or an earlier file,
+            keeping the first copy. Returns the remaining GeckoCode of each file """
 
-        return geckoCodes
+        merged = [code for codes in codeLists for code in codes]
+        kept = {id(code) for code in deduplicate_blocks(merged)}
+
+        self.deduplicatedSize = sum([code.size for code in merged if id(code) not in kept])
+        return [[code for code in codes if id(code) in kept] for codes in codeLists]
+
+    def check_conflicts(self, files: list, codeLists: list) -> list:
+        """ Finds codes of different files writing to overlapping memory, then applies the
+            conflict policy: error fails the build, warn lists them and keeps every code,
+            last drops the earlier files' codes that the later files overwrite entirely.
+            Returns the GeckoCode of each file """
+
+        conflicts = find_conflicts(codeLists)
+        if not conflicts:
+            return codeLists
+
+        names = [file.name for file in files]
+        if self.conflictPolicy == "error":
+            raise CodelistError("Codes of these codelists write to the same memory:\n" +
+                                "\n".join([f"  :: {conflict.describe(names)}" for conflict in conflicts]))
+
+        if self.conflictPolicy == "last":
+            codeLists, conflicts = keep_last(codeLists, conflicts)
+
+        for conflict in conflicts:
+            self.warnings.append(f"WARNING: {conflict.describe(names)}")
+
+        return codeLists
 
     @staticmethod
     def encrypt_key(key: int)  -> int:
@@ -294,32 +341,44 @@ class CodeHandler(object):
         b1 ^= b2
         return (b1 << 24) | (b2 << 16) | (b3 << 8) | b4
 
+    @staticmethod
+    def keystream(key: int, count: int) -> array:
+        """ Returns the key XORed with each word of the codelist, the loader advances it by i << 3 after word i """
+
+        if count == 0:
+            return array("I")
+        return array("I", map((0xFFFFFFFF).__and__, itertools.accumulate(range(0, (count - 1) << 3, 8), initial=key)))
+
+    @staticmethod
+    def crypt_codes(data: bytes, key: int) -> bytes:
+        """ Encrypts or decrypts raw codelist data with the loader's keystream.
+            Trailing bytes that don't fill a word are left as is """
+
+        words = array("I")
+        words.frombytes(data[:len(data) & ~3])
+        if sys.byteorder == "little":
+            words.byteswap()
+
+        stream = CodeHandler.keystream(key, len(words))
+        result = int.from_bytes(words.tobytes(), sys.byteorder, signed=False) ^ int.from_bytes(stream.tobytes(), sys.byteorder, signed=False)
+        words = array("I", result.to_bytes(len(words) << 2, sys.byteorder, signed=False))
+        if sys.byteorder == "little":
+            words.byteswap()
+
+        return words.tobytes() + data[len(data) & ~3:]
+
     def encrypt_codes(self, key: int):
-        self.geckoCodes.codeList.seek(0)
-        i = 0
-        while True:
-            try:
-                packet = read_uint32(self.geckoCodes.codeList)
-                self.geckoCodes.codeList.seek(-4, 1)
-                write_uint32(self.geckoCodes.codeList, (packet^key) & 0xFFFFFFFF)
-                key += (i << 3) & 0xFFFFFFFF
-                if key > 0xFFFFFFFF:
-                    key -= 0x100000000
-                i += 1
-            except:
-                break
+        self.geckoCodes.codeList = BytesIO(CodeHandler.crypt_codes(self.geckoCodes.codeList.getvalue(), key))
+
+    def decrypt_codes(self, key: int):
+        self.geckoCodes.codeList = BytesIO(CodeHandler.crypt_codes(self.geckoCodes.codeList.getvalue(), key))
 
     def find_variable_data(self, variable) -> int:
-        self._rawData.seek(0)
+        """ Returns the offset of a placeholder tag of the handler as it was loaded, see placeholders """
 
-        while sample := self._rawData.read(4):
-            if sample == variable:
-                return self._rawData.tell() - 4
-        
-        return None
+        return self._placeholders.first(variable)
 
     def set_hook_instruction(self, dolFile: DolFile, address: int, varOffset: int, lk=0):
-        self._rawData.seek(varOffset)
         dolFile.seek(address)
         ppc = read_uint32(dolFile)
 
@@ -327,10 +386,11 @@ class CodeHandler(object):
             to, conditional = dolFile.extract_branch_addr(address)
             if conditional:
                 raise NotImplementedError("Hooking to a conditional non spr branch is unsupported")
-            write_uint32(self._rawData, (to - (self.initAddress + varOffset)) & 0x3FFFFFD | 0x48000000 | lk)
-        else:
-            write_uint32(self._rawData, ppc)
- 
+            ppc = (to - (self.initAddress + varOffset)) & 0x3FFFFFD | 0x48000000 | lk
+
+        with self._rawData.getbuffer() as buffer:
+            struct.pack_into(">I", buffer, varOffset, ppc)
+
     def set_variables(self, dolFile: DolFile):
         varOffset = self.find_variable_data(b"\x00\xDE\xDE\xDE")
         if varOffset is None:
@@ -338,13 +398,14 @@ class CodeHandler(object):
 
         self.set_hook_instruction(dolFile, self.hookAddress, varOffset, 0)
 
-        self._rawData.seek(varOffset + 4)
-        write_uint32(self._rawData, ((self.hookAddress + 4) - (self.initAddress + (varOffset + 4))) & 0x3FFFFFD | 0x48000000 | 0)
+        with self._rawData.getbuffer() as buffer:
+            struct.pack_into(">I", buffer, varOffset + 4, ((self.hookAddress + 4) - (self.initAddress + (varOffset + 4))) & 0x3FFFFFD | 0x48000000 | 0)
 
 class KernelLoader(object):
 
-    def __init__(self, f, cli: tools.CommandLineParser=None):
+    def __init__(self, f, cli: tools.CommandLineParser=None, placeholders=None):
         self._rawData = BytesIO(f.read())
+        self._placeholders = placeholders or placeholder_table(self._rawData.getvalue(), KERNEL_WORD_TAGS, KERNEL_HALF_TAGS)
         self._initDataList = None
         self._gpModDataList = None
         self._gpDiscDataList = None
@@ -352,87 +413,82 @@ class KernelLoader(object):
         self._cli = cli
         self.initAddress = None
         self.protect = False
-        self.verbosity = 0
-        self.quiet = False
         self.encrypt = False
+        self.costReport = False
+        self.costBudget = None
+        self.compress = False
+        self.cost = None
+        self.baselineCost = None
+        self.seed = None
+        self._packedCodes = None
+
+    def error(self, msg: str, errorType: type = BuildError, color: str = tools.TREDLIT):
+        """ Exits through the command line parser when there is one, raises errorType otherwise """
 
-    def error(self, msg: str):
         if self._cli is not None:
-            self._cli.error(msg)
+            self._cli.error(tools.color_text(f"{msg}\n", defaultColor=color))
         else:
-            print(msg)
-            sys.exit(1)
+            raise errorType(msg)
 
     def set_variables(self, entryPoint: list, baseOffset: int=0):
-        self._rawData.seek(0)
-
         if self._gpModDataList is None:
             return
-        
-        while sample := self._rawData.read(2):
-            if sample == b"GH":
-                self._rawData.seek(-2, 1)
-                write_uint16(self._rawData, self._gpModDataList[0])
-            elif sample == b"GL":
-                self._rawData.seek(-2, 1)
-                write_uint16(self._rawData, baseOffset + self._gpModDataList[1])
-            elif sample == b"IH":
-                self._rawData.seek(-2, 1)
-                write_uint16(self._rawData, entryPoint[0])
-            elif sample == b"IL":
-                self._rawData.seek(-2, 1)
-                write_uint16(self._rawData, entryPoint[1])
-            elif sample == b"KH":
-                self._rawData.seek(-2, 1)
-                write_uint16(self._rawData, self._gpKeyAddrList[0])
-            elif sample == b"KL":
-                self._rawData.seek(-2, 1)
-                write_uint16(self._rawData, baseOffset + self._gpKeyAddrList[1])
+
+        with self._rawData.getbuffer() as buffer:
+            self._placeholders.pack(buffer, b"GH", ">H", self._gpModDataList[0])
+            self._placeholders.pack(buffer, b"GL", ">H", baseOffset + self._gpModDataList[1])
+            self._placeholders.pack(buffer, b"IH", ">H", entryPoint[0])
+            self._placeholders.pack(buffer, b"IL", ">H", entryPoint[1])
+            self._placeholders.pack(buffer, b"KH", ">H", self._gpKeyAddrList[0])
+            self._placeholders.pack(buffer, b"KL", ">H", baseOffset + self._gpKeyAddrList[1])
+
+    def encryption_key(self, codeHandler: CodeHandler) -> int:
+        """ Returns a random key, or when a seed is set, one derived from the seed,
+            the binaries and the codelist so identical builds produce identical dols """
+
+        if self.seed is None:
+            return random.randrange(0x100000000)
+
+        digest = hashlib.sha256(str(self.seed).encode("utf-8") + b"\x00")
+        digest.update(self._rawData.getvalue())
+        digest.update(codeHandler._rawData.getvalue())
+        digest.update(codeHandler.geckoCodes.codeList.getvalue())
+        return int.from_bytes(digest.digest()[:4], "big")
 
     def complete_data(self, codeHandler: CodeHandler, initpoint: list):
         _upperAddr, _lowerAddr = ((self.initAddress >> 16) & 0xFFFF, self.initAddress & 0xFFFF)
-        _key = random.randrange(0x100000000)
-        self._rawData.seek(0)
-
-        while sample := self._rawData.read(4):
-            if sample == b"HEAP": #Found keyword "HEAP". Goes with the resize of the heap
-                self._rawData.seek(-4, 1)
-
-                gpModInfoOffset = self._rawData.tell()
-                gpModUpperAddr = _upperAddr + 1 if (_lowerAddr + gpModInfoOffset) > 0x7FFF else _upperAddr #Absolute addressing
-                    
-                if codeHandler.allocation == None:
-                    codeHandler.allocation = (codeHandler.handlerLength + codeHandler.geckoCodes.size + 7) & -8
-                    
-                write_uint32(self._rawData, codeHandler.allocation)
-                    
-            elif sample == b"LSIZ": #Found keyword "LSIZ". Goes with the size of the loader
-                self._rawData.seek(-4, 1)
-                write_uint32(self._rawData, len(self._rawData.getbuffer()))
-                    
-            elif sample == b"HSIZ": #Found keyword "HSIZ". Goes with the size of the codehandler
-                self._rawData.seek(-4, 1)
-                write_sint32(self._rawData, codeHandler.handlerLength)
-            
-            elif sample == b"CSIZ": #Found keyword "CSIZ". Goes with the size of the codes
-                self._rawData.seek(-4, 1)
-                write_sint32(self._rawData, codeHandler.geckoCodes.size)
-            
-            elif sample == b"HOOK": #Found keyword "HOOK". Goes with the codehandler hook
-                self._rawData.seek(-4, 1)
-                write_uint32(self._rawData, codeHandler.hookAddress)
-
-            elif sample == b"CRPT": #Found keyword "CRPT". Boolean of the encryption
-                self._rawData.seek(-4, 1)
-                write_bool(self._rawData, self.encrypt, 4)
-
-            elif sample == b"CYPT": #Found keyword "CYPT". Encryption Key
-                self._rawData.seek(-4, 1)
-
-                gpKeyOffset = self._rawData.tell()
-                gpKeyUpperAddr = _upperAddr + 1 if (_lowerAddr + gpKeyOffset) > 0x7FFF else _upperAddr #Absolute addressing
-
-                write_uint32(self._rawData, CodeHandler.encrypt_key(_key))
+        _key = self.encryption_key(codeHandler)
+        table = self._placeholders
+
+        if not table.has(b"HEAP") or not table.has(b"CYPT"):
+            self.error("This GeckoLoader kernel is missing its HEAP or CYPT data", KernelError)
+
+        if self.compress and not table.has(b"CMPR"):
+            self.error(COMPRESSION_UNSUPPORTED, KernelError)
+
+        self._packedCodes = None
+        if self.compress:
+            self._packedCodes = compress(codeHandler.geckoCodes.codeList.getvalue())
+            if len(self._packedCodes) >= codeHandler.geckoCodes.size:
+                self._packedCodes = None
+
+        gpModInfoOffset = table.last(b"HEAP")
+        gpModUpperAddr = _upperAddr + 1 if (_lowerAddr + gpModInfoOffset) > 0x7FFF else _upperAddr #Absolute addressing
+        gpKeyOffset = table.last(b"CYPT")
+        gpKeyUpperAddr = _upperAddr + 1 if (_lowerAddr + gpKeyOffset) > 0x7FFF else _upperAddr #Absolute addressing
+
+        if codeHandler.allocation == None:
+            codeHandler.allocation = (codeHandler.handlerLength + codeHandler.geckoCodes.size + 7) & -8
+
+        with self._rawData.getbuffer() as buffer:
+            table.pack(buffer, b"HEAP", ">I", codeHandler.allocation) #Goes with the resize of the heap
+            table.pack(buffer, b"LSIZ", ">I", len(buffer)) #Size of the loader
+            table.pack(buffer, b"HSIZ", ">i", codeHandler.handlerLength) #Size of the codehandler
+            table.pack(buffer, b"CSIZ", ">i", codeHandler.geckoCodes.size) #Size of the codes
+            table.pack(buffer, b"HOOK", ">I", codeHandler.hookAddress) #Codehandler hook
+            table.pack(buffer, b"CRPT", ">I", 1 if self.encrypt is True else 0) #Boolean of the encryption
+            table.pack(buffer, b"CYPT", ">I", CodeHandler.encrypt_key(_key)) #Encryption key
+            table.pack(buffer, b"CMPR", ">I", 0 if self._packedCodes is None else len(self._packedCodes)) #Size of the compressed codes, 0 when they aren't
 
         if _lowerAddr + gpModInfoOffset > 0xFFFF:
             _lowerAddr -= 0x10000
@@ -443,13 +499,19 @@ class KernelLoader(object):
         self.set_variables(initpoint, _lowerAddr)
         
         if self.encrypt:
-            codeHandler.encrypt_codes(_key)
+            if self._packedCodes is not None:
+                self._packedCodes = CodeHandler.crypt_codes(self._packedCodes, _key)
+            else:
+                codeHandler.encrypt_codes(_key)
 
     def patch_arena(self, codeHandler: CodeHandler, dolFile: DolFile) -> tuple:
         self.complete_data(codeHandler, [(dolFile.entryPoint >> 16) & 0xFFFF, dolFile.entryPoint & 0xFFFF])
 
         self._rawData.seek(0, 2)
-        self._rawData.write(codeHandler._rawData.getvalue() + codeHandler.geckoCodes.codeList.getvalue())
+        if self._packedCodes is not None:
+            self._rawData.write(codeHandler._rawData.getvalue() + self._packedCodes)
+        else:
+            self._rawData.write(codeHandler._rawData.getvalue() + codeHandler.geckoCodes.codeList.getvalue())
 
         self._rawData.seek(0)
         _kernelData = self._rawData.getvalue()
@@ -460,7 +522,7 @@ class KernelLoader(object):
             try:
                 dolFile.append_data_sections([(_kernelData, self.initAddress)])
             except SectionCountFullError:
-                self.error(tools.color_text("There are no unused sections left for GeckoLoader to use!\n", defaultColor=tools.TREDLIT))
+                self.error("There are no unused sections left for GeckoLoader to use!", AllocationError)
 
         dolFile.entryPoint = self.initAddress
         return True, None
@@ -477,7 +539,7 @@ class KernelLoader(object):
             try:
                 dolFile.append_data_sections([(_handlerData, codeHandler.initAddress)])
             except SectionCountFullError:
-                self.error(tools.color_text("There are no unused sections left for GeckoLoader to use!\n", defaultColor=tools.TREDLIT))
+                self.error("There are no unused sections left for GeckoLoader to use!", AllocationError)
 
         return True, None
 
@@ -517,90 +579,112 @@ class KernelLoader(object):
         codeHandler.geckoCodes.codeList.write(b"\xF0\x00\x00\x00\x00\x00\x00\x00")
         codeHandler.geckoCodes.codeList.seek(_oldpos)
 
-    @timer
-    def build(self, gctFile: Path, dolFile: DolFile, codeHandler: CodeHandler, tmpdir: Path, dump: Path):
-        _oldStart = dolFile.entryPoint
+    def check_cost(self, codeHandler: CodeHandler):
+        if not self.costReport and self.costBudget is None:
+            return
+
+        self.cost = codeHandler.geckoCodes.estimate_cost()
+
+        if self.costBudget is not None and self.cost.instructions > self.costBudget:
+            self.error(f"Estimated codehandler cost of {self.cost.instructions} instructions per frame exceeds the budget of {self.costBudget}", CostBudgetError)
+
+    def assemble(self, gctFile: Path, dolFile: DolFile, codeHandler: CodeHandler) -> bool:
+        """ Patches the codelist, codehandler and kernel into the dol without printing anything.
+            Returns False if every code was pre patched, leaving nothing to load at runtime """
 
         """Initialize our codes"""
 
-        codeHandler.init_gct(gctFile, tmpdir)
+        try:
+            codeHandler.init_gct(gctFile)
+        except CodelistError as e:
+            self.error(str(e), CodelistError)
 
         if codeHandler.geckoCodes is None:
-            self.error(tools.color_text("Valid codelist not found. Please provide a .txt/.gct file, or a folder of .txt/.gct files\n", defaultColor=tools.TREDLIT))
+            self.error("Valid codelist not found. Please provide a .txt/.gct file, or a folder of .txt/.gct files", CodelistError)
         
         if self.protect:
             self.protect_game(codeHandler)
 
+        if codeHandler.optimizeList:
+            if self.costReport:
+                self.baselineCost = codeHandler.geckoCodes.estimate_cost()
+            try:
+                codeHandler.geckoCodes.optimize_codelist(dolFile, codeHandler.staticAsm, codeHandler.staticAsmRegion)
+            except (ValueError, LookupError) as e:
+                self.error(f"Failed to optimize the codelist: {e}", CodelistError)
+
+        self.check_cost(codeHandler)
+
+        try:
+            codeHandler.check_codetypes()
+        except HandlerError as e:
+            self.error(str(e), CodehandlerError)
+
         """Get entrypoint (or BSS midpoint) for insert"""
 
+        size = len(self._rawData.getbuffer()) + codeHandler.handlerLength + codeHandler.geckoCodes.size
         if self.initAddress:
-            try:
-                dolFile.resolve_address(self.initAddress)
-                self.error(tools.color_text(f"Init address specified for GeckoLoader (0x{self.initAddress:X}) clobbers existing dol sections", defaultColor=tools.TREDLIT))
-            except UnmappedAddressError:
-                pass
+            # The sections added by the optimizer, like the C2 trampolines of staticAsm, count too
+            for section in dolFile.sections:
+                if section["address"] < self.initAddress + size and self.initAddress < section["address"] + section["size"]:
+                    self.error(f"Init address specified for GeckoLoader (0x{self.initAddress:X}) clobbers existing dol sections", AllocationError)
         else:
-            self.initAddress = dolFile.seek_nearest_unmapped(dolFile.bssAddress, len(self._rawData.getbuffer()) + codeHandler.handlerLength + codeHandler.geckoCodes.size)
+            self.initAddress = dolFile.seek_nearest_unmapped(dolFile.bssAddress, size)
             self._rawData.seek(0)
 
-        if codeHandler.optimizeList:
-            codeHandler.geckoCodes.optimize_codelist(dolFile)
-
         """Is codelist optimized away?"""
 
         if codeHandler.geckoCodes.codeList.getvalue() == b"\x00\xD0\xC0\xDE\x00\xD0\xC0\xDE\xF0\x00\x00\x00\x00\x00\x00\x00":
-            with dump.open("wb") as final:
-                dolFile.save(final)
-
-            if not self.quiet:
-                if self.verbosity >= 3:
-                    dolFile.print_info()
-                    print("-"*64)
-                if self.verbosity >= 1:
-                    print(tools.color_text("\n  :: All codes have been successfully pre patched", defaultColor=tools.TGREENLIT))
-            return
+            return False
 
         hooked = determine_codehook(dolFile, codeHandler, False)
         if hooked:
             _status, _msg = self.patch_arena(codeHandler, dolFile)
         else:
-            self.error(tools.color_text("Failed to find a hook address. Try using option --codehook to use your own address\n", defaultColor=tools.TREDLIT))
+            self.error("Failed to find a hook address. Try using option --codehook to use your own address", CodeHookError)
 
         if _status is False:
-            self.error(tools.color_text(_msg + "\n", defaultColor=tools.TREDLIT))
+            self.error(_msg, AllocationError)
         elif codeHandler.allocation < codeHandler.geckoCodes.size:
-            self.error(tools.color_text("Allocated codespace was smaller than the given codelist\n", defaultColor=tools.TYELLOW))
+            self.error("Allocated codespace was smaller than the given codelist", AllocationError, tools.TYELLOW)
 
-        with dump.open("wb") as final:
-            dolFile.save(final)
+        return True
 
-        if self.quiet:
-            return
-    
-        if self.verbosity >= 3:
-            dolFile.print_info()
-            print("-"*64)
-            
-        if self.verbosity >= 2:
-            print("")
-            info = [f"  :: Start of game modified to address 0x{self.initAddress:X}",
-                    f"  :: Game function `__start()' located at address 0x{_oldStart:X}",
-                    f"  :: Allocation is 0x{codeHandler.allocation:X}; codelist size is 0x{codeHandler.geckoCodes.size:X}",
-                    f"  :: Codehandler hooked at 0x{codeHandler.hookAddress:X}",
-                    f"  :: Codehandler is of type `{codeHandler.type}'",
-                    f"  :: Of the {DolFile.maxTextSections} text sections in this DOL file, {len(dolFile.textSections)} are now being used",
-                    f"  :: Of the {DolFile.maxDataSections} data sections in this DOL file, {len(dolFile.dataSections)} are now being used"]
-
-            for bit in info:
-                print(tools.color_text(bit, defaultColor=tools.TGREENLIT))
-    
-        elif self.verbosity >= 1:
-            print("")
-            info = [f"  :: GeckoLoader set at address 0x{self.initAddress:X}",
-                    f"  :: Legacy size is 0x{codeHandler.allocation:X}; codelist size is 0x{codeHandler.geckoCodes.size:X}",
-                    f"  :: Codehandler is of type `{codeHandler.type}'"]
-            for bit in info:
-                print(tools.color_text(bit, defaultColor=tools.TGREENLIT))
+class Toolchain(object):
+    """ The kernel and codehandler binaries with their placeholder tables, loaded once
+        and shared by every build. Each build gets its own KernelLoader and CodeHandler,
+        whose buffers are only copied from the shared data once they are patched """
+
+    __slots__ = ("kernel", "handler", "_kernelPlaceholders", "_handlerPlaceholders")
+
+    def __init__(self, kernel: bytes, handler: bytes):
+        object.__setattr__(self, "kernel", bytes(kernel))
+        object.__setattr__(self, "handler", bytes(handler))
+        object.__setattr__(self, "_kernelPlaceholders", placeholder_table(self.kernel, KERNEL_WORD_TAGS, KERNEL_HALF_TAGS))
+        object.__setattr__(self, "_handlerPlaceholders", placeholder_table(self.handler, HANDLER_WORD_TAGS))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Toolchain is immutable")
+
+    @classmethod
+    def load(cls, handlerPath: Path = None, kernelPath: Path = None):
+        """ Loads the bundled binaries, or the given ones """
+
+        kernel = (kernelPath or resource_path("bin/geckoloader.bin")).read_bytes()
+        handler = (handlerPath or resource_path("bin/codehandler.bin")).read_bytes()
+        return cls(kernel, handler)
+
+    @property
+    def supportsCompression(self) -> bool:
+        """ Does the kernel have the CMPR field of compressed codelists? """
+
+        return self._kernelPlaceholders.has(b"CMPR")
+
+    def code_handler(self) -> CodeHandler:
+        return CodeHandler(BytesIO(self.handler), self._handlerPlaceholders)
+
+    def kernel_loader(self, cli: tools.CommandLineParser = None) -> KernelLoader:
+        return KernelLoader(BytesIO(self.kernel), cli, self._kernelPlaceholders)
 
 def determine_codehook(dolFile: DolFile, codeHandler: CodeHandler, hook=False) -> bool:
     if codeHandler.hookAddress is None:
@@ -52,6 +52,7 @@ struct Info
   const u32 codeSize;
   const u32 *codehandlerHook;
   const u32 crypted;
+  const u32 compressedSize;
 };
 
 class DiscHeader
@@ -179,6 +180,7 @@ Info gpModInfo = {
     0x4353495A,
     (const u32 *)0x484F4F4B,
     0x43525054,
+    0x434D5052,
 };
 
 inline u32 extractBranchAddr(u32 *bAddr)
@@ -351,6 +353,55 @@ namespace Memory
     }
   };
 
+  namespace Yaz0
+  {
+
+    /*Decodes Yaz0 compressed data. Each bit of a group header, MSB first, marks a literal byte (1)
+    or a back reference (0) of NR RR, with length N + 2 or, if N is 0, the next byte + 0x12*/
+    static void decode(u8 *dest, u8 *src)
+    {
+      u8 *end = dest + ((src[4] << 24) | (src[5] << 16) | (src[6] << 8) | src[7]);
+      u8 group = 0;
+      u32 bits = 0;
+
+      src += 0x10;
+
+      while (dest < end)
+      {
+        if (bits == 0)
+        {
+          group = *src++;
+          bits = 8;
+        }
+
+        if (group & 0x80)
+        {
+          *dest++ = *src++;
+        }
+        else
+        {
+          u8 *copy = dest - (((src[0] & 0xF) << 8) | src[1]) - 1;
+          u32 length = src[0] >> 4;
+          src += 2;
+
+          if (length == 0)
+            length = *src++ + 0x12;
+          else
+            length += 2;
+
+          for (; length > 0 && dest < end; --length)
+          {
+            *dest++ = *copy++;
+          }
+        }
+
+        group <<= 1;
+        --bits;
+      }
+    }
+
+  } // namespace Yaz0
+
   enum class Space : u32
   {
     Start = 0x80000000,
@@ -372,7 +423,18 @@ static void initMods()
   codelistPointer->mLowerOffset = ((u32)sDisc.sMetaData.mOSArenaHi + gpModInfo.handlerSize) & 0xFFFF;
 
   /*Copy codelist to the new allocation*/
-  if (gpModInfo.crypted)
+  if (gpModInfo.compressedSize)
+  {
+    u8 *packedCodes = (u8 *)&gpModInfo + sizeof(Info) + gpModInfo.handlerSize + 4;
+
+    Memory::memcpy(sDisc.sMetaData.mOSArenaHi, (u8 *)&gpModInfo + sizeof(Info) + 4, gpModInfo.handlerSize);
+    if (gpModInfo.crypted)
+    {
+      gpCryptor.xorCrypt((u32 *)packedCodes, (u32 *)packedCodes, gpModInfo.compressedSize >> 2);
+    }
+    Memory::Yaz0::decode(sDisc.sMetaData.mOSArenaHi + gpModInfo.handlerSize, packedCodes);
+  }
+  else if (gpModInfo.crypted)
   {
     Memory::memcpy(sDisc.sMetaData.mOSArenaHi, (u8 *)&gpModInfo + sizeof(Info) + 4, gpModInfo.handlerSize);
     gpCryptor.xorCrypt((u32 *)(sDisc.sMetaData.mOSArenaHi + gpModInfo.handlerSize), (u32 *)((u8 *)&gpModInfo + sizeof(Info) + gpModInfo.handlerSize + 4), gpModInfo.codeSize >> 2);
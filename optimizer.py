@@ -0,0 +1,768 @@
+from codelist import AddressState, CodeType, GeckoCode, iter_states
+from dolreader import DolFile, SectionCountFullError, UnmappedAddressError
+from fileutils import get_alignment, write_ubyte, write_uint16, write_uint32
+from tools import IntervalSet
+
+FOLDABLE_CODETYPES = (CodeType.Write8, CodeType.Write16, CodeType.Write32,
+                      CodeType.WriteString, CodeType.WriteSerial, CodeType.Branch)
+
+def is_mapped(dolFile: DolFile, start: int, end: int) -> bool:
+    """ Is the whole range [start, end) inside a single section of the dol? """
+
+    try:
+        section = dolFile.resolve_address(start)
+    except UnmappedAddressError:
+        return False
+    return end <= section["address"] + section["size"]
+
+def overlaps(ranges: list, start: int, end: int) -> bool:
+    for _start, _end in ranges:
+        if _start < end and start < _end:
+            return True
+    return False
+
+def static_write_ranges(codes: list) -> list:
+    """ Returns every memory range the codelist writes to that can be resolved at build time """
+
+    ranges = []
+    for code, state, _ in iter_states(codes):
+        writeRange = code.write_range(state)
+        if writeRange is not None:
+            ranges.append(writeRange)
+    return ranges
+
+def read_immutable(dolFile: DolFile, address: int, size: int, protected: list) -> int:
+    """ Reads a value from a text section of the dol, returns None if the
+        memory isn't text or is modified by the codelist """
+
+    if address % size != 0 or overlaps(protected, address, address + size):
+        return None
+
+    for section in dolFile.textSections:
+        if section["address"] <= address and address + size <= section["address"] + section["size"]:
+            dolFile.seek(address)
+            return int.from_bytes(dolFile.read(size), byteorder="big", signed=False)
+
+    return None
+
+def evaluate_if(code: GeckoCode, state: AddressState, dolFile: DolFile, protected: list) -> bool:
+    """ Evaluates a 2x/3x conditional against the immutable regions of the dol.
+        Returns the result, or None if it can only be known at runtime """
+
+    if not code.isIf:
+        return None
+
+    address = code.target_address(state)
+    if address is None:
+        return None
+
+    comparison = code.codetype & 0x6
+    if code.codetype & 0x8:
+        value = read_immutable(dolFile, address, 2, protected)
+        if value is None:
+            return None
+        value &= ~(code.info >> 16) & 0xFFFF
+        target = code.info & 0xFFFF
+    else:
+        value = read_immutable(dolFile, address, 4, protected)
+        if value is None:
+            return None
+        target = code.info
+
+    if comparison == 0:
+        return value == target
+    elif comparison == 2:
+        return value != target
+    elif comparison == 4:
+        return value > target
+    else:
+        return value < target
+
+def changes_state(code: GeckoCode, state: AddressState) -> bool:
+    applied = state.copy()
+    applied.apply(code)
+    return applied != state or applied.ba is None or applied.po is None
+
+def resolve_search(code: GeckoCode, dolFile: DolFile, protected: list) -> int:
+    """ Runs an F6 memory search against the dol. Returns the address it finds
+        at runtime, or None if it can only be known at runtime.
+
+        Only matches in text that the codelist doesn't write to are resolved.
+        Memory preceding the match that isn't part of the dol (OS globals, bss)
+        is assumed not to hold an earlier copy of the searched instructions.
+        A search that fails against the dol isn't resolved, as the pattern also
+        exists in the codelist itself once it is copied to the arena """
+
+    if code.codetype != CodeType.MemorySearch or code.info & 0xFFFF0000 == 0 or code.info & 0xFFFF == 0:
+        return None
+
+    start = code.info & 0xFFFF0000
+    end = (code.info & 0xFFFF) << 16
+    pattern = code.payload
+
+    for section in sorted(dolFile.sections, key=lambda section: section["address"]):
+        sectionStart = max(start, section["address"])
+        sectionEnd = min(end, section["address"] + section["size"])
+        if sectionStart >= sectionEnd:
+            continue
+
+        data = section["data"].getvalue()
+        index = data.find(pattern, sectionStart - section["address"], sectionEnd - section["address"])
+        while index >= 0 and (section["address"] + index) & 3:
+            index = data.find(pattern, index + 1, sectionEnd - section["address"])
+        if index < 0:
+            continue
+
+        address = section["address"] + index
+        if section["type"] != DolFile.SectionType.Text or overlaps(protected, address, address + len(pattern)):
+            return None
+        return address
+
+    return None
+
+class _StaticLevel(object):
+    """ One level of code execution status as seen by the conditional evaluator """
+
+    def __init__(self, decision: bool, emitted: bool, state: AddressState):
+        self.decision = decision
+        self.emitted = emitted
+        self.saved = state.copy()
+        self.thenState = None
+
+    def close(self, state: AddressState) -> AddressState:
+        if not self.emitted:
+            # Dead codes never touch the state, so whatever is left is what executed
+            return state
+        if self.thenState is not None:
+            return state.merge(self.thenState)
+        return state.merge(self.saved)
+
+def evaluate_conditionals(codes: list, dolFile: DolFile) -> list:
+    """ Removes conditional blocks that are always false and unwraps those that
+        are always true, rewriting terminators to match the remaining levels.
+
+        A conditional is evaluated when it tests memory in the dol's text
+        sections that no code in the list writes to. F6 searches that resolve
+        become a fixed po, see resolve_search. Writes whose destination
+        can't be resolved at build time (pointer writes, ASM) are assumed to not
+        modify text. Codelists using flow control (6x/CC) are left untouched
+        as removing lines would shift their jumps """
+
+    if any(code.isFlowControl for code in codes):
+        return codes
+
+    # Codes made absolute by a resolved search can reveal writes to the memory
+    # a decision was based on, so decide again without those until it's stable
+    undecidable = set()
+    while True:
+        result, decisions = _evaluate_conditionals(codes, dolFile, undecidable)
+        protected = static_write_ranges(result)
+        clobbered = {i for i, start, end in decisions if overlaps(protected, start, end)}
+        if not clobbered:
+            return result
+        undecidable |= clobbered
+
+def _evaluate_conditionals(codes: list, dolFile: DolFile, undecidable: set) -> tuple:
+    """ Returns the evaluated codelist, and the (index, start, end) memory each decision was based on """
+
+    protected = static_write_ranges(codes)
+    decisions = []
+    result = []
+    stack = []
+    state = AddressState()
+
+    def is_dead() -> bool:
+        return any(level.decision is False and not level.emitted for level in stack)
+
+    for i, code in enumerate(codes):
+        if code.isConditional:
+            poppedEmitted = False
+            if code.endifFirst and stack:
+                level = stack.pop()
+                state = level.close(state)
+                poppedEmitted = level.emitted
+
+            dead = is_dead()
+            decision = None
+            replacement = None
+            if dead or i in undecidable:
+                pass
+            elif code.codetype == CodeType.MemorySearch:
+                found = resolve_search(code, dolFile, protected)
+                if found is not None:
+                    decision = True
+                    replacement = GeckoCode.set_pointer(found)
+                    decisions.append((i, found, found + len(code.payload)))
+            else:
+                decision = evaluate_if(code, state, dolFile, protected)
+                if decision is not None:
+                    decisions.append((i, *read_range(code, state)))
+
+            level = _StaticLevel(decision, not dead and decision is None, state)
+            stack.append(level)
+
+            if level.emitted:
+                if code.endifFirst and not poppedEmitted:
+                    code = code.with_endif_first(False)
+                result.append(code)
+                state.apply(code)
+                continue
+
+            if poppedEmitted:
+                result.append(GeckoCode.endif(1))
+            if replacement is not None:
+                result.append(replacement)
+                state.apply(replacement)
+            continue
+
+        if code.codetype == CodeType.FullTerminator:
+            emitted = any(level.emitted for level in stack)
+            while stack:
+                state = stack.pop().close(state)
+            if emitted or changes_state(code, state):
+                result.append(code)
+            state.apply(code)
+            continue
+
+        if code.codetype == CodeType.Endif:
+            popped = stack[len(stack) - min(code.endifCount, len(stack)):]
+            del stack[len(stack) - len(popped):]
+            for level in reversed(popped):
+                state = level.close(state)
+
+            isElse = False
+            if code.isElse and stack:
+                level = stack[-1]
+                if level.emitted:
+                    isElse = True
+                    level.thenState = state
+                    state = level.saved.copy()
+                elif level.decision is not None:
+                    level.decision = not level.decision
+
+            count = len([level for level in popped if level.emitted])
+            if count > 0 or isElse or changes_state(code, state):
+                result.append(GeckoCode.endif(count, isElse, code.info))
+            state.apply(code)
+            continue
+
+        if is_dead():
+            continue
+
+        result.append(code)
+        state.apply(code)
+
+    return result, decisions
+
+def fold_code(code: GeckoCode, address: int, dolFile: DolFile):
+    """ Applies a RAM write or branch code directly to the dol """
+
+    codetype = code.codetype
+
+    if codetype == CodeType.Branch:
+        dolFile.insert_branch(code.info, address, lk=code.offset & 1)
+        return
+
+    dolFile.seek(address)
+
+    if codetype == CodeType.Write8:
+        dolFile.write(bytes([code.info & 0xFF]) * ((code.info >> 16) + 1))
+    elif codetype == CodeType.Write16:
+        dolFile.write((code.info & 0xFFFF).to_bytes(2, "big", signed=False) * ((code.info >> 16) + 1))
+    elif codetype == CodeType.Write32:
+        write_uint32(dolFile, code.info)
+    elif codetype == CodeType.WriteString:
+        dolFile.write(code.payload[:code.info])
+    elif codetype == CodeType.WriteSerial:
+        value = code.info
+        data = int.from_bytes(code.payload[:2], "big", signed=False)
+        size = (data & 0x3000) >> 12
+        counter = data & 0xFFF
+        addressIncrement = int.from_bytes(code.payload[2:4], "big", signed=False)
+        valueIncrement = int.from_bytes(code.payload[4:8], "big", signed=False)
+
+        while counter + 1 > 0:
+            if size == 0:
+                write_ubyte(dolFile, value & 0xFF)
+                dolFile.seek(-1, 1)
+            elif size == 1:
+                write_uint16(dolFile, value & 0xFFFF)
+                dolFile.seek(-2, 1)
+            elif size == 2:
+                write_uint32(dolFile, value)
+                dolFile.seek(-4, 1)
+            else:
+                raise ValueError("Size type {} does not match 08 codetype specs".format(size))
+
+            counter -= 1
+            value = (value + valueIncrement) & 0xFFFFFFFF
+            if counter + 1 > 0:
+                dolFile.seek(addressIncrement, 1)
+
+def fold_writes(codes: list, dolFile: DolFile) -> list:
+    """ Patches unconditional writes with a build time address directly into the dol,
+        and removes them from the codelist.
+
+        A write is kept in the codelist when a code that remains at runtime writes
+        to the same memory, as folding it would change which write lands last, or
+        when a code before it reads the memory, as that code would see the write
+        on the first frame already """
+
+    states = list(iter_states(codes))
+    candidates = set()
+    read = IntervalSet()
+    readsAnything = False
+
+    for i, (code, state, depth) in enumerate(states):
+        if depth == 0 and code.codetype in FOLDABLE_CODETYPES:
+            writeRange = code.write_range(state)
+            if (writeRange is not None and is_mapped(dolFile, *writeRange)
+                    and not readsAnything and not read.overlaps(*writeRange)):
+                candidates.add(i)
+
+        readRange = read_range(code, state)
+        if readRange == (None, None):
+            readsAnything = True
+        elif readRange is not None:
+            read.add(*readRange)
+
+    while True:
+        kept = [code.write_range(state) for i, (code, state, _) in enumerate(states) if i not in candidates]
+        kept = [writeRange for writeRange in kept if writeRange is not None]
+        demoted = set([i for i in candidates if overlaps(kept, *states[i][0].write_range(states[i][1]))])
+        if not demoted:
+            break
+        candidates -= demoted
+
+    result = []
+    for i, (code, state, _) in enumerate(states):
+        if i in candidates:
+            try:
+                fold_code(code, code.target_address(state), dolFile)
+                continue
+            except (RuntimeError, UnmappedAddressError):
+                pass
+        result.append(code)
+
+    return result
+
+# The low memory region legacy codehandlers are loaded to
+STATIC_ASM_REGION = (0x80001800, 0x80003000)
+
+def branch_offset(ppc: int) -> int:
+    """ Returns the offset of a PC relative b/bc instruction, or None for any other instruction """
+
+    opcode = (ppc >> 26) & 0x3F
+    if ppc & 2:
+        return None
+
+    if opcode == 18:
+        offset = ppc & 0x3FFFFFC
+        if offset & 0x2000000:
+            offset -= 0x4000000
+        return offset
+    elif opcode == 16:
+        offset = ppc & 0xFFFC
+        if offset & 0x8000:
+            offset -= 0x10000
+        return offset
+
+    return None
+
+def relocate_branch(ppc: int, origin: int, destination: int) -> int:
+    """ Re-encodes a PC relative branch found at origin so it keeps its target
+        when placed at destination. Returns None if the new offset doesn't fit """
+
+    offset = branch_offset(ppc)
+    if offset is None:
+        return ppc
+
+    newOffset = (origin + offset) - destination
+    if (ppc >> 26) & 0x3F == 18:
+        if not -0x2000000 <= newOffset < 0x2000000:
+            return None
+        return (ppc & 0xFC000003) | (newOffset & 0x3FFFFFC)
+    else:
+        if not -0x8000 <= newOffset < 0x8000:
+            return None
+        return (ppc & 0xFFFF0003) | (newOffset & 0xFFFC)
+
+def build_trampoline(code: GeckoCode, hookAddress: int, address: int, dolFile: DolFile) -> bytes:
+    """ Returns the payload of a C2 code relocated to address, ending with the branch
+        back to the hook. Returns None if the payload can't be moved there.
+
+        Relative branches within the payload move with it, and copies of the hooked
+        instruction keep branching relative to the hook. Any other relative branch
+        targets memory relative to wherever the codelist is, so the payload is left
+        to the codehandler """
+
+    if len(code.payload) < 8:
+        return None
+
+    dolFile.seek(hookAddress)
+    original = int.from_bytes(dolFile.read(4), byteorder="big", signed=False)
+
+    words = [int.from_bytes(code.payload[i:i+4], byteorder="big", signed=False) for i in range(0, len(code.payload) - 4, 4)]
+    for i, ppc in enumerate(words):
+        offset = branch_offset(ppc)
+        if offset is None:
+            continue
+        if ppc == original:
+            words[i] = relocate_branch(ppc, hookAddress, address + (i << 2))
+            if words[i] is None:
+                return None
+        elif not 0 <= (i << 2) + offset <= len(words) << 2:
+            return None
+
+    returnAddress = address + (len(words) << 2)
+    words.append(((hookAddress + 4) - returnAddress) & 0x3FFFFFC | 0x48000000)
+    return b"".join([word.to_bytes(4, byteorder="big", signed=False) for word in words])
+
+def compile_asm_hooks(codes: list, dolFile: DolFile, region: tuple = STATIC_ASM_REGION) -> list:
+    """ Moves unconditional C2 codes hooking the dol's text into a new section in
+        the (start, end) region of memory, and writes the branches to them directly
+        into the dol, so the codehandler doesn't reinstall them every frame.
+
+        The default region is the one legacy codehandlers are loaded to, so it
+        can't be combined with a loader or emulator that puts its own codehandler
+        there. The part of the region the dol's sections leave free is used, up to
+        the bss, as the game clears the bss and allocates the arena after it.
+        See build_trampoline for the payloads that can be moved """
+
+    if len(dolFile.textSections) + len(dolFile.dataSections) >= DolFile.maxTextSections + DolFile.maxDataSections - 1:
+        return codes
+
+    start = dolFile.seek_nearest_unmapped(region[0])
+    end = min(region[1], dolFile.bssAddress) if dolFile.bssSize else region[1]
+    for section in dolFile.sections:
+        if start < section["address"] < end:
+            end = section["address"]
+
+    states = list(iter_states(codes))
+    hooks = {}
+
+    for i, (code, state, depth) in enumerate(states):
+        if depth > 0 or code.codetype != CodeType.InsertASM:
+            continue
+        hookAddress = code.target_address(state)
+        if hookAddress is None or read_immutable(dolFile, hookAddress, 4, []) is None:
+            continue
+        hooks.setdefault(hookAddress, []).append(i)
+
+    kept = []
+    for i, (code, state, _) in enumerate(states):
+        writeRange = code.write_range(state)
+        if writeRange is not None and not (code.codetype == CodeType.InsertASM and i in hooks.get(writeRange[0], [])):
+            kept.append(writeRange)
+
+    section = b""
+    compiled = {}
+    for hookAddress, indexes in sorted(hooks.items(), key=lambda item: item[1]):
+        if len(indexes) > 1 or overlaps(kept, hookAddress, hookAddress + 4):
+            continue
+
+        address = start + len(section)
+        trampoline = build_trampoline(states[indexes[0]][0], hookAddress, address, dolFile)
+        if trampoline is None or start + ((len(section) + len(trampoline) + 255) & -256) > end:
+            continue
+
+        section += trampoline
+        compiled[indexes[0]] = (hookAddress, address)
+
+    if not compiled:
+        return codes
+
+    try:
+        dolFile.append_text_sections([(section, start)])
+    except SectionCountFullError:
+        dolFile.append_data_sections([(section, start)])
+
+    for hookAddress, address in compiled.values():
+        dolFile.insert_branch(address, hookAddress, lk=0)
+
+    return [code for i, (code, _, _) in enumerate(states) if i not in compiled]
+
+def resolve_addresses(codes: list) -> list:
+    """ Rewrites codes addressed through a build time constant ba or po as
+        absolute codes, and removes the 4x codes setting that register.
+
+        This is done per register, and only when every code reading it can be
+        rewritten, as the register then keeps its default value (0x80000000)
+        for the whole frame. Rewritten codes keep addressing through their own
+        register, since the other one may still change. Codelists using flow control (6x/CC) are left
+        untouched as removing lines would shift their jumps """
+
+    if any(code.isFlowControl for code in codes):
+        return codes
+
+    states = list(iter_states(codes))
+    static = {"ba": True, "po": True}
+
+    for code, state, _ in states:
+        # Searches left for runtime set po, so po doesn't keep its default value
+        if code.codetype == CodeType.MemorySearch:
+            static["po"] = False
+        for register, usage in code.register_usage().items():
+            if usage == "value":
+                static[register] = False
+            elif not code.isSetter:
+                address = code.target_address(state)
+                if address is None or code.with_address(address, code.isPointer) is None:
+                    static[register] = False
+
+    if not static["ba"] and not static["po"]:
+        return codes
+
+    result = []
+    openLevels = 0
+    for code, state, depth in states:
+        usage = code.register_usage()
+        wasOpen = openLevels > 0
+        openLevels = depth + 1 if code.isConditional else depth
+
+        if code.isSetter:
+            target = "ba" if code.codetype < CodeType.LoadPointer else "po"
+            if static[target]:
+                continue
+        elif code.isTerminator:
+            info = code.info
+            if static["ba"]:
+                info &= 0xFFFF
+            if static["po"]:
+                info &= 0xFFFF0000
+            if info != code.info:
+                if code.codetype == CodeType.Endif and code.endifCount == 0 and not code.isElse and info == 0:
+                    continue
+                if code.codetype == CodeType.FullTerminator and not wasOpen and info == 0:
+                    continue
+                code = GeckoCode(code.codeword, info, code.payload)
+        elif any(static[register] for register in usage):
+            code = code.with_address(code.target_address(state), code.isPointer)
+
+        result.append(code)
+
+    return result
+
+MEMORY_WRITE_CODETYPES = (CodeType.Write8, CodeType.Write16, CodeType.Write32,
+                          CodeType.WriteString, CodeType.WriteSerial)
+
+def read_range(code: GeckoCode, state: AddressState) -> tuple:
+    """ Returns the (start, end) range of memory a code reads during the frame,
+        None if it reads nothing, or (None, None) if it could read anything """
+
+    codetype = code.codetype
+
+    if code.isIf:
+        address = code.target_address(state)
+        if address is None:
+            return (None, None)
+        return (address, address + (2 if codetype & 0x8 else 4))
+    elif codetype in (CodeType.LoadBase, CodeType.LoadPointer):
+        # 4NTYZ00N reads at XXXXXXXX, plus ba/po when Y is set; gecko registers aren't known
+        if (code.codeword >> 12) & 0xF or (code.codeword >> 16) & 0xF > 1:
+            return (None, None)
+        address = code.info
+        if (code.codeword >> 16) & 0xF:
+            base = state.po if code.isPointer else state.ba
+            if base is None:
+                return (None, None)
+            address = (address + base) & 0xFFFFFFFF
+        return (address, address + 4)
+    elif codetype == CodeType.MemorySearch:
+        start = code.info & 0xFFFF0000 or state.ba
+        end = (code.info & 0xFFFF) << 16 or state.po
+        if start is None or end is None:
+            return (None, None)
+        return (start, end) if end > start else None
+    elif codetype == CodeType.ExecuteASM:
+        return (None, None)
+    elif codetype & 0xE0 == 0x80 and codetype not in (0x80, 0x86, 0x88):
+        return (None, None)
+    elif codetype & 0xF0 == 0xA0:
+        return (None, None)
+    return None
+
+def eliminate_dead_writes(codes: list) -> list:
+    """ Removes memory writes that are fully overwritten later in the same frame
+        by writes that always execute, with nothing reading the memory in between """
+
+    if any(code.isFlowControl for code in codes):
+        return codes
+
+    covered = IntervalSet()
+    dead = set()
+    states = list(iter_states(codes))
+
+    for i in range(len(states) - 1, -1, -1):
+        code, state, depth = states[i]
+
+        writeRange = code.write_range(state)
+        if writeRange is not None:
+            if code.codetype in MEMORY_WRITE_CODETYPES and covered.contains(*writeRange):
+                dead.add(i)
+                continue
+            # Serial writes skip the memory between their values
+            if depth == 0 and code.codetype != CodeType.WriteSerial:
+                covered.add(*writeRange)
+
+        readRange = read_range(code, state)
+        if readRange == (None, None):
+            covered.clear()
+        elif readRange is not None:
+            covered.remove(*readRange)
+
+    return [code for i, code in enumerate(codes) if i not in dead]
+
+def coalesce_writes(codes: list) -> list:
+    """ Merges consecutive 00/02/04/06 writes to adjacent memory through the
+        same register into single 06 string writes """
+
+    result = []
+    run = []
+
+    def flush():
+        groups = []
+        for i, code in enumerate(run):
+            start, end = code.write_range(AddressState(0, 0))
+            group = {"start": start, "end": end, "codes": [i]}
+            for other in [other for other in groups if other["start"] <= end and start <= other["end"]]:
+                group["start"] = min(group["start"], other["start"])
+                group["end"] = max(group["end"], other["end"])
+                group["codes"] = sorted(other["codes"] + group["codes"])
+                groups.remove(other)
+            groups.append(group)
+
+        # Groups don't touch each other's memory, so each can be written where its first code was
+        for group in sorted(groups, key=lambda group: group["codes"][0]):
+            if len(group["codes"]) == 1:
+                result.append(run[group["codes"][0]])
+            else:
+                result.append(string_write([run[i] for i in group["codes"]], group["start"], group["end"]))
+        run.clear()
+
+    for code in codes:
+        if code.codetype in (CodeType.Write8, CodeType.Write16, CodeType.Write32, CodeType.WriteString):
+            if run and run[0].isPointer != code.isPointer:
+                flush()
+            run.append(code)
+            continue
+        flush()
+        result.append(code)
+
+    flush()
+    return result
+
+def string_write(codes: list, start: int, end: int) -> GeckoCode:
+    """ Builds the 06 code with the final memory contents of the given writes over [start, end) """
+
+    data = bytearray(end - start)
+    for code in codes:
+        _start, _end = code.write_range(AddressState(0, 0))
+        if code.codetype == CodeType.Write8:
+            value = bytes([code.info & 0xFF]) * (_end - _start)
+        elif code.codetype == CodeType.Write16:
+            value = (code.info & 0xFFFF).to_bytes(2, "big", signed=False) * ((_end - _start) >> 1)
+        elif code.codetype == CodeType.Write32:
+            value = code.info.to_bytes(4, "big", signed=False)
+        else:
+            value = code.payload[:code.info]
+        data[_start - start:_end - start] = value
+
+    codeword = ((CodeType.WriteString | (0x10 if codes[0].isPointer else 0)) << 24) | start
+    return GeckoCode(codeword, len(data), bytes(data) + b"\x00" * get_alignment(len(data), 8))
+
+# Codes a block may consist of to be deduplicated, along with 2x/3x conditionals
+DEDUPLICABLE_CODETYPES = MEMORY_WRITE_CODETYPES + (CodeType.InsertASM, CodeType.Branch,
+                                                   CodeType.FullTerminator, CodeType.Endif)
+
+def writes_unknown_memory(code: GeckoCode, state: AddressState) -> bool:
+    """ Could the code write memory that can't be resolved at build time? """
+
+    codetype = code.codetype
+    if code.write_range(state) is not None:
+        return False
+    if code.isWrite or codetype in (CodeType.StoreBase, CodeType.StorePointer, CodeType.ExecuteASM, CodeType.InsertASM,
+                                    CodeType.Branch, CodeType.InsertASMChecksum, CodeType.InsertASMChecksumPointer):
+        return True
+    return codetype & 0xE0 == 0x80 and codetype not in (0x80, 0x82, 0x86)
+
+def block_footprint(states: list) -> tuple:
+    """ Returns the (reads, writes) IntervalSet of a block given its (code, state, depth),
+        or None if the block can't be proven to do the same thing every time it runs """
+
+    reads = IntervalSet()
+    writes = IntervalSet()
+    for code, state, _ in states:
+        if not (code.isIf or code.codetype in DEDUPLICABLE_CODETYPES):
+            return None
+
+        readRange = read_range(code, state)
+        if readRange == (None, None):
+            return None
+        elif readRange is not None:
+            reads.add(*readRange)
+
+        if code.isTerminator:
+            continue
+        writeRange = code.write_range(state)
+        if writeRange is None:
+            if code.isIf:
+                continue
+            return None
+        writes.add(*writeRange)
+
+    # Running the block again must not see its own writes
+    for start, end in writes:
+        if reads.overlaps(start, end):
+            return None
+    return reads, writes
+
+def deduplicate_blocks(codes: list) -> list:
+    """ Removes code blocks that repeat an earlier block byte for byte, when running
+        them again can't change anything: both copies start with the same known ba/po
+        and leave it as it was, and no code in between touches the memory they read or write """
+
+    if any(code.isFlowControl for code in codes):
+        return codes
+
+    states = list(iter_states(codes + [GeckoCode(CodeType.EndOfCodes << 24, 0)]))
+    starts = [i for i, (code, _, depth) in enumerate(states[:-1]) if i == 0 or (depth == 0 and not code.isTerminator)]
+    bounds = list(zip(starts, starts[1:] + [len(codes)]))
+
+    first = {}
+    dropped = set()
+    for blockIndex, (start, end) in enumerate(bounds):
+        code, before, _ = states[start]
+        after = states[end][1]
+        if code.endifFirst or states[end][2] != 0 or before.ba is None or before.po is None or before != after:
+            continue
+
+        key = (b"".join([code.raw for code in codes[start:end]]), before.ba, before.po)
+        if key not in first:
+            first[key] = blockIndex
+            continue
+
+        footprint = block_footprint(states[start:end])
+        if footprint is None:
+            continue
+
+        reads, writes = footprint
+        independent = True
+        for between in range(first[key] + 1, blockIndex):
+            if between in dropped:
+                continue
+            for code, state, _ in states[bounds[between][0]:bounds[between][1]]:
+                writeRange = code.write_range(state)
+                if writeRange is None:
+                    independent = not writes_unknown_memory(code, state)
+                else:
+                    independent = not (reads.overlaps(*writeRange) or writes.overlaps(*writeRange))
+                if not independent:
+                    break
+            if not independent:
+                break
+
+        if independent:
+            dropped.add(blockIndex)
+
+    return [code for blockIndex, (start, end) in enumerate(bounds) if blockIndex not in dropped for code in codes[start:end]]
@@ -0,0 +1,61 @@
+import hashlib
+import struct
+
+# Word sized tags of the kernel, patched with the build's values
+KERNEL_WORD_TAGS = (b"HEAP", b"LSIZ", b"HSIZ", b"CSIZ", b"HOOK", b"CRPT", b"CYPT", b"CMPR")
+# Halfword tags of the kernel, in the immediates of the instructions addressing its data
+KERNEL_HALF_TAGS = (b"GH", b"GL", b"IH", b"IL", b"KH", b"KL")
+# Start of the codehandler's variable data, where its hook instructions go
+HANDLER_WORD_TAGS = (b"\x00\xDE\xDE\xDE",)
+
+# Primary opcodes of the D-form instructions a halfword tag may be the immediate of:
+# addi, addis, ori, oris, lwz, stw
+IMMEDIATE_OPCODES = frozenset((14, 15, 24, 25, 32, 36))
+
+_tables = {}
+
+class PlaceholderTable(object):
+    """ Offsets of the placeholder tags of a binary. Word tags are found at word
+        aligned offsets, halfword tags only as the immediate of a D-form instruction """
+
+    def __init__(self, offsets: dict):
+        self.offsets = offsets
+
+    @classmethod
+    def scan(cls, data: bytes, wordTags: tuple = (), halfTags: tuple = ()):
+        offsets = {tag: [] for tag in wordTags + halfTags}
+
+        for i in range(0, len(data) - 3, 4):
+            word = data[i:i + 4]
+            if word in offsets:
+                offsets[word].append(i)
+            elif data[i] >> 2 in IMMEDIATE_OPCODES and word[2:] in offsets:
+                offsets[word[2:]].append(i + 2)
+
+        return cls({tag: tuple(found) for tag, found in offsets.items()})
+
+    def first(self, tag: bytes) -> int:
+        found = self.offsets.get(tag)
+        return found[0] if found else None
+
+    def last(self, tag: bytes) -> int:
+        found = self.offsets.get(tag)
+        return found[-1] if found else None
+
+    def has(self, tag: bytes) -> bool:
+        return bool(self.offsets.get(tag))
+
+    def pack(self, buffer, tag: bytes, fmt: str, value: int):
+        """ Writes the value over every occurrence of the tag """
+
+        for offset in self.offsets.get(tag, ()):
+            struct.pack_into(fmt, buffer, offset, value)
+
+def placeholder_table(data: bytes, wordTags: tuple = (), halfTags: tuple = ()) -> PlaceholderTable:
+    """ Returns the PlaceholderTable of a binary, scanning it only the first time
+        a binary with the same contents is seen """
+
+    key = (hashlib.sha1(data).digest(), wordTags, halfTags)
+    if key not in _tables:
+        _tables[key] = PlaceholderTable.scan(bytes(data), wordTags, halfTags)
+    return _tables[key]
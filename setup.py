@@ -17,7 +17,9 @@ setup(
     name="GeckoLoader",
     version="7.1.1",
     description="DOL Patcher for extending the codespace of Wii/GC games",
-    executables=[Executable("GeckoLoader.py", icon=os.path.join("bin", "icon.ico"))],
+    executables=[Executable("GeckoLoader.py", icon=os.path.join("bin", "icon.ico")),
+                 Executable("GeckoBatch.py", icon=os.path.join("bin", "icon.ico")),
+                 Executable("GeckoDaemon.py", icon=os.path.join("bin", "icon.ico"))],
     author="JoshuaMK",
     author_email="joshuamkw2002@gmail.com",
     options=options,
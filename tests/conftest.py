@@ -0,0 +1,44 @@
+import struct
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+# The modules of GeckoLoader live at the top of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dolreader import DolFile
+
+HOOK_ADDRESS = 0x80004140
+
+def make_dol() -> DolFile:
+    """ A small dol with a text section of nops holding a VI hook, a data section and bss """
+
+    text = bytearray(struct.pack(">I", 0x60000000) * 0x800)
+    text[0x100:0x110] = bytes.fromhex("7CE33B78 38870034 38A70038 38C7004C")
+    struct.pack_into(">I", text, 0x140, 0x4E800020)
+    data = bytearray(0x1000)
+    struct.pack_into(">I", data, 0x10, 0xDEADBEEF)
+
+    dolFile = DolFile()
+    dolFile.textSections.append({"offset": 0x100, "address": 0x80004000, "size": len(text), "data": BytesIO(bytes(text)), "type": DolFile.SectionType.Text})
+    dolFile.dataSections.append({"offset": 0x100 + len(text), "address": 0x80100000, "size": len(data), "data": BytesIO(bytes(data)), "type": DolFile.SectionType.Data})
+    dolFile.bssAddress = 0x80200000
+    dolFile.bssSize = 0x10000
+    dolFile.entryPoint = 0x80004000
+
+    stream = BytesIO()
+    dolFile.save(stream)
+    return DolFile(stream.getvalue())
+
+@pytest.fixture(scope="session")
+def dol() -> DolFile:
+    return make_dol()
+
+@pytest.fixture
+def dol_path(tmp_path) -> Path:
+    path = tmp_path / "game.dol"
+    with path.open("wb") as f:
+        make_dol().save(f)
+    return path
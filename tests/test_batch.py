@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from codelist import GeckoCode, assemble_codelist
+from GeckoBatch import GeckoBatchCli, ManifestError, load_manifest, run_job, share_dols
+
+@pytest.fixture
+def manifest(tmp_path, dol_path):
+    (tmp_path / "a.gct").write_bytes(assemble_codelist([GeckoCode(0x04100000, 1)]))
+    (tmp_path / "b.gct").write_bytes(assemble_codelist([GeckoCode(0x04100000, 2), GeckoCode(0x04100004, 3)]))
+    path = tmp_path / "batch.json"
+    path.write_text(json.dumps({"defaults": {"dol": dol_path.name, "hookAddress": "80004140", "cacheFolder": str(tmp_path / "cache")},
+                                "jobs": [{"name": "a", "codes": "a.gct", "dest": "out/a.dol"},
+                                         {"name": "b", "codes": "b.gct", "dest": "out/b.dol", "optimize": True},
+                                         {"codes": "missing.gct", "dest": "out/c.dol"}]}))
+    return path
+
+def test_load_manifest(manifest, tmp_path, dol_path):
+    jobs = load_manifest(manifest)
+    assert [job.name for job in jobs] == ["a", "b", "job 3"]
+    assert jobs[0].dol == dol_path and jobs[0].codes == tmp_path / "a.gct" and jobs[0].dest == tmp_path / "out/a.dol"
+    assert jobs[0].options == {"hookAddress": 0x80004140, "cacheFolder": str(tmp_path / "cache")}
+    assert jobs[1].options["optimize"] is True
+
+def test_load_toml_manifest(tmp_path):
+    path = tmp_path / "batch.toml"
+    path.write_text('[defaults]\ndol = "game.dol"\n\n[[jobs]]\ncodes = "a.txt"\ndest = "a.dol"\nhookType = "GX"\n')
+    jobs = load_manifest(path)
+    assert len(jobs) == 1
+    assert jobs[0].options == {"hookType": "GX"}
+
+@pytest.mark.parametrize("manifest", ['{"jobs": {}}', '{"jobs": [1]}', '{"jobs": [{"dol": "a", "codes": "b"}]}',
+                                      '{"jobs": [{"dol": "a", "codes": "b", "dest": "c", "unknown": 1}]}',
+                                      '{"jobs": [{"dol": "a", "codes": "b", "dest": "c", "hookAddress": "zz"}]}', "{"])
+def test_invalid_manifests(tmp_path, manifest):
+    path = tmp_path / "batch.json"
+    path.write_text(manifest)
+    with pytest.raises(ManifestError):
+        load_manifest(path)
+
+def test_run_job(manifest, tmp_path, dol_path):
+    jobs = load_manifest(manifest)
+    summary = run_job(jobs[0])
+    assert summary["error"] is None
+    assert summary["codelistSize"] == 0x18
+    assert (tmp_path / "out/a.dol").read_bytes() != dol_path.read_bytes()
+
+    summary = run_job(jobs[2])
+    assert "missing.gct" in summary["error"]
+    assert not (tmp_path / "out/c.dol").exists()
+
+def test_share_dols(manifest):
+    jobs = load_manifest(manifest)
+    blocks = share_dols(jobs)
+    try:
+        assert len(blocks) == 1
+        size = jobs[0].dol.stat().st_size
+        assert all(job.sharedDol == (blocks[0].name, size) for job in jobs)
+        assert bytes(blocks[0].buf[:size]) == jobs[0].dol.read_bytes()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_batch(manifest, tmp_path, capsys, jobs):
+    cli = GeckoBatchCli()
+    assert cli._exec(cli.parse_args([str(manifest), "--jobs", jobs])) == 1
+
+    out = capsys.readouterr().out
+    assert "Built 2 of 3 jobs" in out and "job 3" in out
+    assert (tmp_path / "out/a.dol").exists() and (tmp_path / "out/b.dol").exists()
@@ -0,0 +1,23 @@
+import builder
+from builder import BuildOptions, build
+from codelist import GeckoCode, assemble_codelist
+from conftest import HOOK_ADDRESS
+
+def test_build_cache_hits_identical_builds(dol, tmp_path):
+    codes = tmp_path / "codes.gct"
+    codes.write_bytes(assemble_codelist([GeckoCode(0x04100000, 1)]))
+    options = BuildOptions(hookAddress=HOOK_ADDRESS, buildCache=tmp_path / "cache")
+
+    first = build(dol, codes, options)
+    second = build(dol, codes, options)
+    assert not first.cached and second.cached
+    assert second.codelistSize == first.codelistSize
+
+def test_build_cache_misses_other_build_modules(dol, tmp_path, monkeypatch):
+    codes = tmp_path / "codes.gct"
+    codes.write_bytes(assemble_codelist([GeckoCode(0x04100000, 1)]))
+    options = BuildOptions(hookAddress=HOOK_ADDRESS, buildCache=tmp_path / "cache")
+
+    build(dol, codes, options)
+    monkeypatch.setattr(builder, "modules_hash", lambda: b"another version")
+    assert not build(dol, codes, options).cached
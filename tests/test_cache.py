@@ -0,0 +1,121 @@
+import os
+import pickle
+
+import pytest
+
+from cache import CodelistCache, MemoryCodelistCache
+from kernel import parse_text_codelist
+
+CACHES = {"disk": lambda folder: CodelistCache(folder),
+          "memory": lambda folder: MemoryCodelistCache(),
+          "memory+disk": lambda folder: MemoryCodelistCache(folder)}
+
+@pytest.fixture(params=CACHES)
+def cache(request, tmp_path):
+    return CACHES[request.param](tmp_path / "cache")
+
+def write_codes(path, text: str, mtime: int = None):
+    path.write_text(text)
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+
+def test_hit_and_miss(cache, tmp_path):
+    path = tmp_path / "codes.txt"
+    write_codes(path, "*04100000 00000001\n")
+    assert cache.get(path, False) is None
+
+    cache.put(path, False, path.read_bytes(), b"codes")
+    assert cache.get(path, False) == b"codes"
+    assert cache.get(path, True) is None
+    assert cache.get(tmp_path / "missing.txt", False) is None
+
+def test_stale_entries(cache, tmp_path):
+    path = tmp_path / "codes.txt"
+    write_codes(path, "*04100000 00000001\n", 1000)
+    cache.put(path, False, path.read_bytes(), b"codes")
+
+    # Only the mtime changed, so the content hash still matches
+    write_codes(path, "*04100000 00000001\n", 2000)
+    assert cache.get(path, False) == b"codes"
+
+    # Same size and a new mtime, but different content
+    write_codes(path, "*04100000 00000002\n", 3000)
+    assert cache.get(path, False) is None
+
+def test_stale_entries_of_another_version(tmp_path):
+    path = tmp_path / "codes.txt"
+    write_codes(path, "*04100000 00000001\n")
+    cache = CodelistCache(tmp_path / "cache")
+    cache.put(path, False, path.read_bytes(), b"codes")
+
+    cache.VERSION = CodelistCache.VERSION + 1
+    assert cache.get(path, False) is None
+
+def test_parse_invalidated_by_changed_codelist(cache, tmp_path):
+    path = tmp_path / "codes.txt"
+    write_codes(path, "*04100000 00000001\n", 1000)
+    assert parse_text_codelist(path, False, cache) == bytes.fromhex("0410000000000001")
+
+    write_codes(path, "*04100000 00000001\n*04100004 00000002\n", 2000)
+    assert parse_text_codelist(path, False, cache) == bytes.fromhex("04100000000000010410000400000002")
+    assert cache.get(path, False) == bytes.fromhex("04100000000000010410000400000002")
+
+def test_evicts_least_recently_used_by_mtime(tmp_path):
+    cache = CodelistCache(tmp_path / "cache", maxEntries=2)
+    paths = [tmp_path / f"{name}.txt" for name in "abc"]
+    for i, path in enumerate(paths[:2]):
+        write_codes(path, f"*0410000{i} 00000001\n")
+        cache.put(path, False, path.read_bytes(), path.name.encode())
+        entryPath = cache._entry_path(path, False)
+        os.utime(entryPath, ns=(1000 + i, 1000 + i))
+
+    # Reading a touches its entry, so b is the least recently used
+    assert cache.get(paths[0], False) == b"a.txt"
+    write_codes(paths[2], "*04100002 00000001\n")
+    cache.put(paths[2], False, paths[2].read_bytes(), b"c.txt")
+
+    assert len(list(cache.folder.glob("*.pickle"))) == 2
+    assert cache.get(paths[1], False) is None
+    assert cache.get(paths[0], False) == b"a.txt"
+    assert cache.get(paths[2], False) == b"c.txt"
+
+def test_memory_evicts_least_recently_used(tmp_path):
+    cache = MemoryCodelistCache(maxEntries=2)
+    paths = [tmp_path / f"{name}.txt" for name in "abc"]
+    for path in paths:
+        write_codes(path, "*04100000 00000001\n")
+
+    cache.put(paths[0], False, paths[0].read_bytes(), b"a.txt")
+    cache.put(paths[1], False, paths[1].read_bytes(), b"b.txt")
+    assert cache.get(paths[0], False) == b"a.txt"
+    cache.put(paths[2], False, paths[2].read_bytes(), b"c.txt")
+
+    assert cache.get(paths[1], False) is None
+    assert cache.get(paths[0], False) == b"a.txt"
+
+def test_memory_entry_paths(tmp_path, monkeypatch):
+    path = tmp_path / "codes.txt"
+    write_codes(path, "*04100000 00000001\n")
+    cache = MemoryCodelistCache()
+
+    # Without a folder the entry paths are only keys, one per file and includeAll setting
+    cache.put(path, False, path.read_bytes(), b"active")
+    cache.put(path, True, path.read_bytes(), b"all")
+    assert len(cache.entries) == 2
+    assert list(tmp_path.iterdir()) == [path]
+
+    monkeypatch.chdir(tmp_path)
+    assert cache._entry_path(path.relative_to(tmp_path), False) == cache._entry_path(path, False)
+    assert cache.get(path.relative_to(tmp_path), True) == b"all"
+
+def test_memory_entries_persist_through_the_folder(tmp_path):
+    path = tmp_path / "codes.txt"
+    write_codes(path, "*04100000 00000001\n")
+    cache = MemoryCodelistCache(tmp_path / "cache")
+    cache.put(path, False, path.read_bytes(), b"codes")
+
+    # Worker processes only get the persistent cache
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.entries == {}
+    assert copy.get(path, False) == b"codes"
+    assert CodelistCache(tmp_path / "cache").get(path, False) == b"codes"
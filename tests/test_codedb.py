@@ -0,0 +1,92 @@
+import pytest
+
+from builder import BuildOptions, CodelistError, build
+from codedb import CodeDatabase, CodeDatabaseError, parse_game_ini
+from conftest import HOOK_ADDRESS
+
+GAME_INI = """[Gecko]
+$Infinite lives [author]
+04100000 00000001
+*Lives never go down
+$Moon jump
+04100010 00000002
+04100014 00000003
+$Disabled
+04100020 00000004
+[Gecko_Enabled]
+$Infinite lives
+$Moon jump
+$Disabled
+[Gecko_Disabled]
+$Disabled
+"""
+
+REGION_FREE_INI = """[Gecko]
+$Moon jump
+04100030 00000005
+$All regions
+04100040 00000006
+[Gecko_Enabled]
+$All regions
+"""
+
+@pytest.fixture
+def settings(tmp_path):
+    folder = tmp_path / "GameSettings"
+    folder.mkdir()
+    (folder / "GMSE01.ini").write_text(GAME_INI)
+    (folder / "GMS.ini").write_text(REGION_FREE_INI)
+    return folder
+
+def test_parse_game_ini(settings):
+    codes = parse_game_ini(settings / "GMSE01.ini")
+    assert [(code.name, code.creator, code.enabled) for code in codes] == [("Infinite lives", "author", True),
+                                                                          ("Moon jump", "", True),
+                                                                          ("Disabled", "", False)]
+    assert codes[0].notes == ["Lives never go down"]
+    assert bytes(codes[1].lines) == bytes.fromhex("04100010 00000002 04100014 00000003")
+
+def test_import_only_changed_inis(settings, tmp_path):
+    with CodeDatabase(tmp_path / "codes.db") as database:
+        assert database.import_folder(settings, jobs=1) == (2, 0, 0)
+        assert database.games() == ["GMS", "GMSE01"]
+        assert database.import_folder(settings, jobs=1) == (0, 0, 0)
+
+        (settings / "GMS.ini").unlink()
+        (settings / "GMSE01.ini").write_text(GAME_INI.replace("00000001", "00000009"))
+        assert database.import_folder(settings, jobs=1) == (1, 1, 0)
+        assert database.games() == ["GMSE01"]
+        assert database.select("GMSE01", ["Infinite lives"]) == bytes.fromhex("04100000 00000009")
+
+def test_select(settings, tmp_path):
+    with CodeDatabase(tmp_path / "codes.db") as database:
+        # Parsed in a process pool
+        assert database.import_folder(settings, jobs=2) == (2, 0, 0)
+
+        # The full ID's Moon jump overrides the region free one
+        assert database.find("gmse01") == [("All regions", "", True), ("Infinite lives", "author", True),
+                                           ("Moon jump", "", True), ("Disabled", "", False)]
+        assert database.select("GMSE01") == bytes.fromhex("04100040 00000006 04100000 00000001 04100010 00000002 04100014 00000003")
+        assert database.select("GMSP01") == bytes.fromhex("04100040 00000006")
+        assert database.select("GMSE01", ["Moon jump", "All regions"]) == bytes.fromhex("04100010 00000002 04100014 00000003 04100040 00000006")
+
+        with pytest.raises(CodeDatabaseError):
+            database.select("GMSE01", ["Missing"])
+        with pytest.raises(CodeDatabaseError):
+            database.select("RMGE01")
+
+def test_not_a_database(tmp_path):
+    path = tmp_path / "codes.db"
+    path.write_bytes(b"not a database" * 100)
+    with pytest.raises(CodeDatabaseError):
+        CodeDatabase(path)
+
+def test_build_from_database(dol, settings, tmp_path):
+    with CodeDatabase(tmp_path / "codes.db") as database:
+        database.import_folder(settings, jobs=1)
+
+    result = build(dol, tmp_path / "codes.db", BuildOptions(hookAddress=HOOK_ADDRESS, gameId="GMSE01", codeNames=["Moon jump"]))
+    assert result.codelistSize == 0x20
+
+    with pytest.raises(CodelistError):
+        build(dol, tmp_path / "codes.db", BuildOptions(hookAddress=HOOK_ADDRESS))
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from builder import BuildOptions, build
+from codelist import GeckoCode, assemble_codelist
+from compression import MAX_MATCH, WINDOW_SIZE, CompressionError, compress, decompress
+from conftest import HOOK_ADDRESS
+from kernel import KernelError, Toolchain
+
+def sample_data() -> list:
+    rng = random.Random(34)
+    samples = [b"", b"a", b"ab", b"abc", b"\x00" * 1000, b"ab" * 5000, bytes(range(256)) * 40, rng.randbytes(10000)]
+    for _ in range(200):
+        alphabet = rng.randint(1, 5)
+        samples.append(bytes([rng.randrange(alphabet) for _ in range(rng.randint(0, 2000))]))
+    return samples
+
+def test_round_trip():
+    for data in sample_data():
+        packed = compress(data)
+        assert len(packed) % 4 == 0
+        assert decompress(packed) == data
+
+def test_window_and_match_limits():
+    # A match exactly WINDOW_SIZE back, one just out of reach, and runs longer than MAX_MATCH
+    block = random.Random(1).randbytes(64)
+    for gap in (WINDOW_SIZE - len(block), WINDOW_SIZE - len(block) + 1):
+        data = block + bytes(gap) + block
+        assert decompress(compress(data)) == data
+
+    data = b"\xAB" * (MAX_MATCH * 3 + 7)
+    packed = compress(data)
+    assert decompress(packed) == data
+    assert len(packed) <= 0x20
+
+def test_codelist_shrinks():
+    codes = assemble_codelist([GeckoCode(0x04100000 | (i * 4), 0x60000000) for i in range(0x200)])
+    packed = compress(codes)
+    assert len(packed) < len(codes) // 2
+    assert decompress(packed) == codes
+
+def test_decompress_rejects_bad_data():
+    with pytest.raises(CompressionError):
+        decompress(b"Yaz1" + bytes(12))
+
+    packed = compress(b"abcdefgh" * 64)
+    with pytest.raises(CompressionError):
+        decompress(packed[:len(packed) // 2])
+
+def test_build_stores_the_compressed_codelist(dol, tmp_path):
+    base = Toolchain.load()
+    toolchain = Toolchain(base.kernel + b"CMPR", base.handler)
+    codes = assemble_codelist([GeckoCode(0x04100000 | (i * 4), 0x60000000) for i in range(0x200)])
+    (tmp_path / "codes.gct").write_bytes(codes)
+
+    result = build(dol, tmp_path / "codes.gct", BuildOptions(hookAddress=HOOK_ADDRESS, compress=True, seed=1), toolchain)
+
+    section = [section for section in result.dolFile.sections if section["address"] == result.initAddress][0]
+    packed = section["data"].getvalue()[len(toolchain.kernel) + len(toolchain.handler):]
+    assert packed[:4] == b"Yaz0"
+    assert decompress(packed) == codes
+
+def test_kernel_without_compression_is_rejected(dol, tmp_path):
+    toolchain = Toolchain.load()
+    if toolchain.supportsCompression:
+        pytest.skip("The bundled kernel supports compressed codelists")
+
+    with pytest.raises(KernelError):
+        BuildOptions(compress=True).validate(toolchain)
+
+    (tmp_path / "codes.gct").write_bytes(assemble_codelist([GeckoCode(0x04100000, 0)]))
+    with pytest.raises(KernelError):
+        build(dol, tmp_path / "codes.gct", BuildOptions(hookAddress=HOOK_ADDRESS, compress=True), toolchain)
@@ -0,0 +1,66 @@
+import pytest
+
+from builder import BuildOptions, CodelistError, build
+from codelist import GeckoCode, assemble_codelist
+from conflicts import find_conflicts, keep_last
+from conftest import HOOK_ADDRESS
+from emulator import compare_runs, run_codelist
+
+def merge(codeLists: list) -> list:
+    return [code for codes in codeLists for code in codes]
+
+def apply_last(codeLists: list) -> tuple:
+    return keep_last(codeLists, find_conflicts(codeLists))
+
+def test_last_drops_overwritten_writes():
+    codeLists = [[GeckoCode(0x04100000, 1), GeckoCode(0x04100010, 2)], [GeckoCode(0x06100000, 8, bytes(8))]]
+    newLists, remaining = apply_last(codeLists)
+    assert newLists == [[GeckoCode(0x04100010, 2)], codeLists[1]]
+    assert remaining == []
+
+def test_last_keeps_writes_read_before_the_overwrite(dol):
+    # The conditional of the first file reads its own write before the second file replaces it
+    codeLists = [[GeckoCode(0x04100000, 1), GeckoCode(0x20100000, 1), GeckoCode(0x04100010, 2), GeckoCode(0xE0000000, 0x80008000)],
+                 [GeckoCode(0x04100000, 3)]]
+    newLists, remaining = apply_last(codeLists)
+    assert newLists == codeLists
+    assert len(remaining) == 1
+    assert compare_runs(run_codelist(merge(codeLists), dol, 0), run_codelist(merge(newLists), dol, 0)) == []
+
+def test_last_keeps_writes_read_by_a_search():
+    codeLists = [[GeckoCode(0x04100000, 1), GeckoCode(0xF6000001, 0x80108011, bytes.fromhex("0000000100000000")),
+                  GeckoCode(0xE0000000, 0x80008000)],
+                 [GeckoCode(0x04100000, 3)]]
+    assert apply_last(codeLists)[0] == codeLists
+
+def test_last_needs_every_byte_overwritten_first():
+    # The read comes after the overwrite of the bytes it reads, but before the rest are overwritten
+    codeLists = [[GeckoCode(0x06100000, 8, bytes(8))],
+                 [GeckoCode(0x04100000, 3), GeckoCode(0x20100004, 0), GeckoCode(0xE0000000, 0x80008000), GeckoCode(0x04100004, 4)]]
+    assert apply_last(codeLists)[0] == codeLists
+
+    codeLists[1][1] = GeckoCode(0x20100000, 3)
+    assert apply_last(codeLists)[0] == [[], codeLists[1]]
+
+@pytest.fixture
+def conflicting(tmp_path):
+    folder = tmp_path / "codes"
+    folder.mkdir()
+    (folder / "a.gct").write_bytes(assemble_codelist([GeckoCode(0x04100000, 1), GeckoCode(0x04100010, 2)]))
+    (folder / "b.gct").write_bytes(assemble_codelist([GeckoCode(0x04100000, 3)]))
+    return folder
+
+def test_error_policy(dol, conflicting):
+    with pytest.raises(CodelistError):
+        build(dol, conflicting, BuildOptions(hookAddress=HOOK_ADDRESS, conflicts="error"))
+
+def test_warn_policy(dol, conflicting):
+    result = build(dol, conflicting, BuildOptions(hookAddress=HOOK_ADDRESS, conflicts="warn"))
+    assert len(result.warnings) == 1
+    assert "a.gct" in result.warnings[0] and "b.gct" in result.warnings[0]
+    assert result.codelistSize == 0x28
+
+def test_last_policy(dol, conflicting):
+    result = build(dol, conflicting, BuildOptions(hookAddress=HOOK_ADDRESS, conflicts="last"))
+    assert result.warnings == []
+    assert result.codelistSize == 0x20
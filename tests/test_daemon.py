@@ -0,0 +1,132 @@
+import asyncio
+import json
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from codelist import GeckoCode, assemble_codelist
+from daemon import BuildDaemon
+from daemonclient import (BUILD_CANCELLED, BUILD_FAILED, INVALID_PARAMS, INVALID_REQUEST, METHOD_NOT_FOUND,
+                          PARSE_ERROR, PROTOCOL_VERSION, DaemonClient, DaemonError)
+
+@pytest.fixture
+def daemon():
+    # Unix socket paths are short, so the socket isn't in tmp_path
+    with tempfile.TemporaryDirectory() as folder:
+        server = BuildDaemon(Path(folder) / "daemon.sock", workers=1)
+        thread = threading.Thread(target=asyncio.run, args=(server.serve(),))
+        thread.start()
+        while not server.socketPath.exists():
+            time.sleep(0.01)
+
+        yield server
+
+        if thread.is_alive():
+            with DaemonClient(server.socketPath) as client:
+                client.shutdown()
+        thread.join(10)
+        assert not thread.is_alive()
+
+@pytest.fixture
+def codes(tmp_path) -> Path:
+    path = tmp_path / "codes.gct"
+    path.write_bytes(assemble_codelist([GeckoCode(0x04100000, 1)]))
+    return path
+
+def send(stream, *messages) -> list:
+    """ Sends raw lines to the daemon, and returns the message answering the last one """
+
+    for message in messages:
+        stream.write((message if isinstance(message, str) else json.dumps(message)).encode("utf-8") + b"\n")
+    stream.flush()
+    return json.loads(stream.readline())
+
+def test_ping(daemon):
+    with DaemonClient(daemon.socketPath) as client:
+        assert client.ping() == {"version": PROTOCOL_VERSION, "workers": 1, "running": 0, "completed": 0}
+
+def test_build(daemon, dol_path, codes, tmp_path):
+    stages = []
+    with DaemonClient(daemon.socketPath) as client:
+        summary = client.build(dol_path, codes, tmp_path / "out/game.dol", {"hookAddress": 0x80004140},
+                               "build-1", lambda event: stages.append((event["id"], event["stage"])))
+        assert client.ping()["completed"] == 1
+
+    assert stages == [("build-1", "queued"), ("build-1", "building"), ("build-1", "saving")]
+    assert summary["codelistSize"] == 0x18 and summary["dest"] == str(tmp_path / "out/game.dol")
+    assert (tmp_path / "out/game.dol").exists()
+
+def test_failed_builds(daemon, dol_path, codes, tmp_path):
+    with DaemonClient(daemon.socketPath) as client:
+        with pytest.raises(DaemonError) as error:
+            client.build(dol_path, tmp_path / "missing.gct", tmp_path / "out.dol", {"hookAddress": 0x80004140})
+        assert error.value.code == BUILD_FAILED
+
+        with pytest.raises(DaemonError) as error:
+            client.build(dol_path, codes, tmp_path / "out.dol", {"unknown": 1})
+        assert error.value.code == INVALID_PARAMS
+
+        with pytest.raises(DaemonError) as error:
+            client.call("build", {"dol": "game.dol", "codes": str(codes), "dest": str(tmp_path / "out.dol")})
+        assert error.value.code == INVALID_PARAMS
+
+        with pytest.raises(DaemonError) as error:
+            client.call("unknown")
+        assert error.value.code == METHOD_NOT_FOUND
+
+    assert not (tmp_path / "out.dol").exists()
+
+def test_invalid_requests(daemon):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(str(daemon.socketPath))
+        stream = connection.makefile("rwb")
+
+        reply = send(stream, "{")
+        assert reply["id"] is None and reply["error"]["code"] == PARSE_ERROR
+        assert send(stream, {"id": 1, "method": "ping"})["error"]["code"] == INVALID_REQUEST
+        assert send(stream, {"jsonrpc": "2.0", "id": True, "method": "ping"})["error"]["code"] == INVALID_REQUEST
+        assert send(stream, {"jsonrpc": "2.0", "id": 2, "method": "ping", "params": []})["error"]["code"] == INVALID_PARAMS
+        assert send(stream, {"jsonrpc": "2.0", "id": 3, "method": "build"})["error"]["code"] == INVALID_PARAMS
+        assert send(stream, {"jsonrpc": "2.0", "method": "build", "params": {}})["error"]["code"] == INVALID_REQUEST
+
+        # Notifications are never answered, so the reply is the one of the next request
+        assert send(stream, {"jsonrpc": "2.0", "method": "ping"}, {"jsonrpc": "2.0", "id": "4", "method": "ping"})["id"] == "4"
+
+def test_cancel(daemon, dol_path, codes, tmp_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(str(daemon.socketPath))
+        stream = connection.makefile("rwb")
+
+        # Running or queued, a cancelled build is never saved
+        params = {"dol": str(dol_path), "codes": str(codes), "options": {"hookAddress": 0x80004140}}
+        send(stream, {"jsonrpc": "2.0", "id": "a", "method": "build", "params": {**params, "dest": str(tmp_path / "a.dol")}},
+             {"jsonrpc": "2.0", "id": "b", "method": "build", "params": {**params, "dest": str(tmp_path / "b.dol")}})
+
+        with DaemonClient(daemon.socketPath) as client:
+            assert client.cancel("b")
+            assert not client.cancel("b")
+            assert not client.cancel("unknown")
+
+        replies = {}
+        while len(replies) < 2:
+            message = json.loads(stream.readline())
+            if "id" in message:
+                replies[message["id"]] = message
+
+    assert "result" in replies["a"] and (tmp_path / "a.dol").exists()
+    assert replies["b"]["error"]["code"] == BUILD_CANCELLED and not (tmp_path / "b.dol").exists()
+
+def test_shutdown(daemon):
+    with DaemonClient(daemon.socketPath) as client:
+        assert client.shutdown() is None
+    for _ in range(500):
+        if not daemon.socketPath.exists():
+            break
+        time.sleep(0.01)
+    assert not daemon.socketPath.exists()
+    with pytest.raises(DaemonError):
+        DaemonClient(daemon.socketPath)
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from builder import BuildOptions, CodelistError, build
+from conftest import HOOK_ADDRESS
+from kernel import CodeHandler, parse_text_codelist
+
+OCARINA = """Infinite lives [author]
+*04100000 00000001
+*04100004 00000002 first code of the line only 04100008 00000003
+Inactive code
+04100010 00000004
+* 0410000c 0000000A
+"""
+
+DOLPHIN = """[Gecko]
+$Infinite lives [author]
+04100000 00000001
+*04100004 00000002 in a note
+$Moon jump
+04100010 00000004
+[Gecko_Enabled]
+$Infinite lives
+"""
+
+@pytest.mark.parametrize("includeAll, expected", [(False, "04100000 00000001 04100004 00000002 0410000C 0000000A"),
+                                                  (True, "04100000 00000001 04100004 00000002 04100010 00000004 0410000C 0000000A")])
+def test_ocarina(tmp_path, includeAll, expected):
+    path = tmp_path / "codes.txt"
+    path.write_text(OCARINA)
+    assert parse_text_codelist(path, includeAll) == bytes.fromhex(expected)
+
+@pytest.mark.parametrize("includeAll", [False, True])
+def test_dolphin(tmp_path, includeAll):
+    # Every code of a Dolphin codelist counts, but never the ones of notes
+    path = tmp_path / "codes.txt"
+    path.write_text(DOLPHIN)
+    assert parse_text_codelist(path, includeAll) == bytes.fromhex("04100000 00000001 04100010 00000004")
+
+@pytest.mark.parametrize("encoding, newline", [("utf-8-sig", "\r\n"), ("utf-16", "\n"), ("cp1252", "\r")])
+def test_encodings_and_newlines(tmp_path, encoding, newline):
+    path = tmp_path / "codes.txt"
+    path.write_bytes(("\n\n" + DOLPHIN.replace("Moon jump", "Saut lunaire élevé")).replace("\n", newline).encode(encoding))
+    assert parse_text_codelist(path) == bytes.fromhex("04100000 00000001 04100010 00000004")
+
+def test_undecodable_text(dol, tmp_path):
+    path = tmp_path / "codes.txt"
+    path.write_bytes(b"*04100000 00000001\n\xff\xfe\x00\x81")
+    with pytest.raises(CodelistError):
+        build(dol, path, BuildOptions(hookAddress=HOOK_ADDRESS))
+
+def crypt_words(data: bytes, key: int) -> bytes:
+    # The word by word loop the keystream replaced
+    result = bytearray(data)
+    for i in range(len(data) // 4):
+        packet = int.from_bytes(data[i * 4:i * 4 + 4], "big")
+        result[i * 4:i * 4 + 4] = ((packet ^ key) & 0xFFFFFFFF).to_bytes(4, "big")
+        key = (key + (i << 3)) & 0xFFFFFFFF
+    return bytes(result)
+
+def test_crypt_codes_matches_the_loop():
+    rng = random.Random(33)
+    for size in (0, 3, 4, 8, 0x10, 0x1001, 0x4000):
+        data = rng.randbytes(size)
+        for key in (0, 0xFFFFFFFF, 0xFFFFFFF8, rng.getrandbits(32)):
+            encrypted = CodeHandler.crypt_codes(data, key)
+            assert encrypted == crypt_words(data, key)
+            assert CodeHandler.crypt_codes(encrypted, key) == data
+
+def test_keystream():
+    assert list(CodeHandler.keystream(0xFFFFFFF0, 5)) == [0xFFFFFFF0, 0xFFFFFFF0, 0xFFFFFFF8, 0x00000008, 0x00000020]
+    assert list(CodeHandler.keystream(1, 0)) == []
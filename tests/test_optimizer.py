@@ -0,0 +1,144 @@
+import pytest
+
+from builder import AllocationError, BuildError, BuildOptions, build
+from codelist import GeckoCode, assemble_codelist, iter_states
+from conftest import HOOK_ADDRESS, make_dol
+from emulator import check_optimizer
+from fileutils import read_uint32
+from optimizer import (block_footprint, compile_asm_hooks, deduplicate_blocks, evaluate_conditionals,
+                       fold_writes, resolve_addresses)
+
+BLOCK = [GeckoCode(0x20100000, 1), GeckoCode(0x04100010, 2), GeckoCode(0xE0000000, 0x80008000)]
+
+def test_constant_conditionals_are_folded(dol):
+    # The text of the dol is all nops, and isn't written by the codelist
+    true = [GeckoCode(0x20004000, 0x60000000), GeckoCode(0x04100000, 1), GeckoCode(0xE0000000, 0x80008000)]
+    assert evaluate_conditionals(true, make_dol()) == [GeckoCode(0x04100000, 1)]
+    assert check_optimizer(true, dol) == []
+
+    false = [GeckoCode(0x20004000, 0), GeckoCode(0x04100000, 1), GeckoCode(0xE0000000, 0x80008000)]
+    assert evaluate_conditionals(false, make_dol()) == []
+    assert check_optimizer(false, dol) == []
+
+def test_conditionals_on_written_text_are_kept():
+    codes = [GeckoCode(0x04004000, 1), GeckoCode(0x20004000, 0x60000000), GeckoCode(0x04100000, 1),
+             GeckoCode(0xE0000000, 0x80008000)]
+    assert evaluate_conditionals(codes, make_dol()) == codes
+
+def test_nested_terminators_only_close_the_kept_levels(dol):
+    # Only the conditionals on data are left for runtime
+    codes = [GeckoCode(0x20100000, 1), GeckoCode(0x20004000, 0x60000000), GeckoCode(0x04100010, 2),
+             GeckoCode(0xE2000002, 0), GeckoCode(0x04100014, 3)]
+    assert evaluate_conditionals(codes, make_dol()) == [GeckoCode(0x20100000, 1), GeckoCode(0x04100010, 2),
+                                                        GeckoCode(0xE2000001, 0), GeckoCode(0x04100014, 3)]
+    assert check_optimizer(codes, dol) == []
+
+    codes = [GeckoCode(0x20100000, 1), GeckoCode(0x20004000, 0x60000000), GeckoCode(0x20100004, 1),
+             GeckoCode(0x04100010, 2), GeckoCode(0xE2000003, 0x80008000), GeckoCode(0x04100014, 3)]
+    assert evaluate_conditionals(codes, make_dol()) == [GeckoCode(0x20100000, 1), GeckoCode(0x20100004, 1),
+                                                        GeckoCode(0x04100010, 2), GeckoCode(0xE2000002, 0x80008000),
+                                                        GeckoCode(0x04100014, 3)]
+    assert check_optimizer(codes, dol) == []
+
+def test_else_of_a_constant_conditional_is_unwrapped(dol):
+    codes = [GeckoCode(0x20100000, 1), GeckoCode(0x20004000, 0), GeckoCode(0x04100010, 2), GeckoCode(0xE2100000, 0),
+             GeckoCode(0x04100014, 3), GeckoCode(0xE2000002, 0)]
+    assert evaluate_conditionals(codes, make_dol()) == [GeckoCode(0x20100000, 1), GeckoCode(0x04100014, 3),
+                                                        GeckoCode(0xE2000001, 0)]
+    assert check_optimizer(codes, dol) == []
+
+def test_search_left_for_runtime_keeps_po_resets(dol):
+    # The search of data isn't resolved, so po is only back at 0x80000000 after the terminator
+    codes = [GeckoCode(0xF6000001, 0x80108011, bytes.fromhex("DEADBEEF00000000")),
+             GeckoCode(0xE0000000, 0x80008000), GeckoCode(0x14000100, 0x12345678)]
+    assert resolve_addresses(codes)[1].info & 0xFFFF == 0x8000
+    assert check_optimizer(codes, dol) == []
+
+def test_writes_found_by_an_earlier_search_arent_folded(dol):
+    # Folded, the search would already find the serial write on the first frame and count twice
+    codes = [GeckoCode(0xF6000001, 0x80108011, bytes.fromhex("0000004600000046")), GeckoCode(0x86000000, 1),
+             GeckoCode(0xE0000000, 0x80008000), GeckoCode(0x42000000, 0x80100000),
+             GeckoCode(0x08000004, 0x46, bytes.fromhex("2001000400000000"))]
+    assert fold_writes(codes, make_dol()) == codes
+    assert check_optimizer(codes, dol) == []
+
+def test_writes_read_by_an_earlier_conditional_arent_folded():
+    codes = [GeckoCode(0x20100000, 1), GeckoCode(0x86000000, 1), GeckoCode(0xE0000000, 0x80008000),
+             GeckoCode(0x04100000, 1), GeckoCode(0x04100010, 2)]
+    assert fold_writes(codes, make_dol()) == codes[:4]
+
+def test_block_footprint():
+    reads, writes = block_footprint(list(iter_states(BLOCK)))
+    assert list(reads) == [(0x80100000, 0x80100004)]
+    assert list(writes) == [(0x80100010, 0x80100014)]
+
+    # Running the block again could see its own write
+    codes = [GeckoCode(0x20100000, 1), GeckoCode(0x04100000, 2), GeckoCode(0xE0000000, 0x80008000)]
+    assert block_footprint(list(iter_states(codes))) is None
+
+def test_repeated_blocks_are_dropped(dol):
+    codes = BLOCK + [GeckoCode(0x04100020, 5)] + BLOCK
+    assert deduplicate_blocks(codes) == codes[:4]
+    assert check_optimizer(codes, dol) == []
+
+def test_blocks_around_writes_to_their_memory_are_kept():
+    codes = BLOCK + [GeckoCode(0x04100000, 5)] + BLOCK
+    assert deduplicate_blocks(codes) == codes
+
+def test_deduplicated_bytes_of_a_folder(dol, tmp_path):
+    folder = tmp_path / "codes"
+    folder.mkdir()
+    (folder / "a.gct").write_bytes(assemble_codelist(BLOCK + [GeckoCode(0x04100020, 5)]))
+    (folder / "b.gct").write_bytes(assemble_codelist(BLOCK))
+
+    result = build(dol, folder, BuildOptions(hookAddress=HOOK_ADDRESS))
+    assert result.deduplicatedSize == 0x18
+    assert result.codelistSize == 0x30
+    assert result.warnings == []
+
+def compile_hook(payload: str, *region) -> tuple:
+    """ Compiles a C2 code hooking the start of text, returns the remaining codes and where the hook branches """
+
+    dolFile = make_dol()
+    payload = bytes.fromhex(payload)
+    codes = compile_asm_hooks([GeckoCode(0xC2004000, len(payload) // 8, payload)], dolFile, *region)
+    dolFile.seek(0x80004000)
+    branch = read_uint32(dolFile)
+    return codes, None if branch == 0x60000000 else (0x80004000 + (branch & 0x3FFFFFC) - 0x4000000) & 0xFFFFFFFF
+
+def test_trampolines_keep_branches_within_the_payload():
+    assert compile_hook("41820008 38600001 4200FFFC 00000000") == ([], 0x80001800)
+
+def test_trampolines_reject_branches_relative_to_the_codelist():
+    codes, branch = compile_hook("48000100 00000000")
+    assert len(codes) == 1 and branch is None
+
+    codes, branch = compile_hook("38600001 4182FF00 60000000 00000000")
+    assert len(codes) == 1 and branch is None
+
+def test_trampoline_region():
+    assert compile_hook("38600001 00000000", (0x80003000, 0x80003100)) == ([], 0x80003000)
+    # Only what is left before the text section is used
+    assert compile_hook("38600001 00000000", (0x80003F00, 0x80005000)) == ([], 0x80003F00)
+    # The game clears the bss, and allocates the arena after it
+    codes, branch = compile_hook("38600001 00000000", (0x80200000, 0x80300000))
+    assert len(codes) == 1 and branch is None
+
+@pytest.mark.parametrize("region", [(0x80003100, 0x80003000), (0x80003002, 0x80003100), (0x7FFFF000, 0x80003000), (0x80003000,)])
+def test_invalid_trampoline_regions(dol, tmp_path, region):
+    path = tmp_path / "codes.gct"
+    path.write_bytes(assemble_codelist([GeckoCode(0x04100000, 1)]))
+    with pytest.raises(BuildError):
+        build(dol, path, BuildOptions(hookAddress=HOOK_ADDRESS, optimize=True, staticAsm=True, staticAsmRegion=region))
+
+def test_init_address_clobbering_trampolines(dol, tmp_path):
+    path = tmp_path / "codes.gct"
+    path.write_bytes(assemble_codelist([GeckoCode(0xC2004000, 1, bytes.fromhex("38600001 00000000")), GeckoCode(0x04100000, 0)]))
+    options = BuildOptions(hookAddress=HOOK_ADDRESS, optimize=True, staticAsm=True, staticAsmRegion=(0x80003000, 0x80003100))
+
+    result = build(dol, path, options)
+    assert result.dolFile.resolve_address(0x80003000)["address"] == 0x80003000
+
+    options.initAddress = 0x80002F00
+    with pytest.raises(AllocationError):
+        build(dol, path, options)
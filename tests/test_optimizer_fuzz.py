@@ -0,0 +1,29 @@
+import pytest
+
+from codelist import GeckoCode
+from emulator import check_optimizer, fuzz_optimizer
+
+SEEDS = range(100, 108)
+
+def describe(failures: list) -> str:
+    return "\n".join([f"{codes}: {differences}" for codes, differences in failures[:5]])
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_fuzz_optimizer(dol, seed):
+    failures = fuzz_optimizer(dol, cases=100, seed=seed)
+    assert not failures, describe(failures)
+
+@pytest.mark.parametrize("seed", [32, 33, 34, 35, *SEEDS])
+def test_fuzz_optimizer_long_codelists(dol, seed):
+    failures = fuzz_optimizer(dol, cases=100, seed=seed, length=48, frames=3)
+    assert not failures, describe(failures)
+
+def test_serial_write_keeps_the_memory_between_its_values(dol):
+    # The 08 code writes 0x80100000, 0x80100004 and 0x80100008, not the byte at 0x80100001
+    codes = [GeckoCode(0x00100001, 0xAB), GeckoCode(0x08100000, 0x11, bytes.fromhex("0002000400000000"))]
+    assert check_optimizer(codes, dol) == []
+
+def test_hooks_overwrite_what_they_hook(dol):
+    # The codehandler writes the branch of the D2 code over the earlier write
+    codes = [GeckoCode(0x12000E80, 0xAAAF), GeckoCode(0xD2000E80, 1, bytes.fromhex("6000000000000000"))]
+    assert check_optimizer(codes, dol) == []
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+from builder import BuildOptions
+from codelist import GeckoCode, assemble_codelist
+from kernel import Toolchain
+from watcher import FileWatcher, WatchSession
+
+@pytest.fixture(params=["inotify", "polling"])
+def polling(request, monkeypatch) -> bool:
+    if request.param == "polling":
+        monkeypatch.setattr(sys, "platform", "win32")
+    elif not sys.platform.startswith("linux"):
+        pytest.skip("inotify is only used on Linux")
+    return request.param == "polling"
+
+def touch(path, data: bytes, mtime: int):
+    path.write_bytes(data)
+    os.utime(path, ns=(mtime, mtime))
+
+def test_file_watcher(tmp_path, polling):
+    folder = tmp_path / "codes"
+    folder.mkdir()
+    touch(folder / "a.txt", b"a", 1000)
+    touch(tmp_path / "game.dol", b"dol", 1000)
+    touch(tmp_path / "other.dol", b"other", 1000)
+
+    with FileWatcher([folder, tmp_path / "game.dol"], interval=0.01) as watcher:
+        assert watcher.polling == polling
+        assert watcher.wait(0.05) == set()
+
+        # Files next to a watched file aren't reported
+        touch(tmp_path / "other.dol", b"changed", 2000)
+        assert watcher.wait(0.05) == set()
+
+        touch(folder / "a.txt", b"changed", 2000)
+        touch(folder / "b.txt", b"new", 2000)
+        assert watcher.wait(5) == {(folder / "a.txt").resolve(), (folder / "b.txt").resolve()}
+
+        (folder / "b.txt").unlink()
+        touch(tmp_path / "game.dol", b"changed", 2000)
+        assert watcher.wait(5) == {(folder / "b.txt").resolve(), (tmp_path / "game.dol").resolve()}
+
+def test_watch_session(tmp_path, dol_path):
+    folder = tmp_path / "codes"
+    folder.mkdir()
+    touch(folder / "a.gct", assemble_codelist([GeckoCode(0x04100000, 1)]), 1000)
+    dest = tmp_path / "out/game.dol"
+
+    session = WatchSession(dol_path, folder, dest, BuildOptions(), Toolchain.load(), tmp_path / "cache")
+    assert session.paths == [dol_path.resolve(), folder.resolve()]
+
+    result = session.rebuild()
+    assert result.codelistSize == 0x18
+    built = dest.read_bytes()
+
+    # The hook found by the first build is reused, and only the new codelist is read
+    touch(folder / "b.gct", assemble_codelist([GeckoCode(0x04100004, 2)]), 2000)
+    result = session.rebuild({(folder / "b.gct").resolve()})
+    assert result.codelistSize == 0x20
+    assert result.hookAddress == session._hookAddress
+    assert dest.read_bytes() != built
+
+    # A changed dol is read again
+    dol_path.write_bytes(dol_path.read_bytes()[:-4] + b"\xFF" * 4)
+    dolFile = session._dolFile
+    session.rebuild({dol_path.resolve()})
+    assert session._dolFile is not dolFile
@@ -1,3 +1,4 @@
+import bisect
 import struct
 import sys
 import os
@@ -54,6 +55,58 @@ def align_byte_size(obj, alignment: int, fillchar="00"):
     else:
         raise NotImplementedError(f"Aligning the size of class {type(obj)} is unsupported")
 
+class IntervalSet(object):
+    """ A set of integers stored as sorted, disjoint [start, end) intervals """
+
+    def __init__(self, intervals: list = []):
+        self._starts = []
+        self._ends = []
+        for start, end in intervals:
+            self.add(start, end)
+
+    def __iter__(self):
+        return zip(self._starts, self._ends)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def add(self, start: int, end: int):
+        if start >= end:
+            return
+        i = bisect.bisect_left(self._ends, start)
+        j = bisect.bisect_right(self._starts, end)
+        if i < j:
+            start = min(start, self._starts[i])
+            end = max(end, self._ends[j - 1])
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def remove(self, start: int, end: int):
+        if start >= end:
+            return
+        i = bisect.bisect_right(self._ends, start)
+        j = bisect.bisect_left(self._starts, end)
+        remaining = []
+        if i < j and self._starts[i] < start:
+            remaining.append((self._starts[i], start))
+        if i < j and self._ends[j - 1] > end:
+            remaining.append((end, self._ends[j - 1]))
+        self._starts[i:j] = [interval[0] for interval in remaining]
+        self._ends[i:j] = [interval[1] for interval in remaining]
+
+    def clear(self):
+        self._starts.clear()
+        self._ends.clear()
+
+    def contains(self, start: int, end: int) -> bool:
+        """ Is [start, end) entirely inside the set? """
+        i = bisect.bisect_right(self._starts, start) - 1
+        return i >= 0 and self._ends[i] >= end
+
+    def overlaps(self, start: int, end: int) -> bool:
+        i = bisect.bisect_right(self._ends, start)
+        return i < len(self._starts) and self._starts[i] < end
+
 def color_text(text: str, textToColor: list=[("", None)], defaultColor: str=None) -> str:
     currentColor = None
     formattedText = ""
@@ -0,0 +1,204 @@
+import copy
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from builder import BuildOptions, BuildResult, build, load_dol, read_dol
+from cache import MemoryCodelistCache
+from kernel import Toolchain
+
+# inotify(7) event masks and flags
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x800
+IN_CLOEXEC = 0x80000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event without its name: wd, mask, cookie, len
+EVENT_HEADER = struct.Struct("iIII")
+
+# Rebuilds with fewer changed codelists than this parse them in process instead of starting a process pool
+POOL_THRESHOLD = 8
+
+class FileWatcher(object):
+    """ Waits for changes to a set of files and folders. Files of a watched folder
+        are watched too. Uses inotify on Linux and falls back to polling the mtimes
+        of the paths elsewhere, or when inotify is unavailable """
+
+    def __init__(self, paths: list, interval: float = 0.25, settle: float = 0.02):
+        """ interval: seconds between polls when polling
+            settle: seconds to keep collecting changes after the first one, so that
+            a save touching several files is reported as a single change """
+
+        self.paths = [Path(path).resolve() for path in paths]
+        self.interval = interval
+        self.settle = settle
+        self._fd = None
+        self._watches = {}
+        self._snapshot = None
+
+        if sys.platform.startswith("linux"):
+            self._init_inotify()
+        if self._fd is None:
+            self._snapshot = self.snapshot()
+
+    @property
+    def polling(self) -> bool:
+        return self._fd is None
+
+    def _init_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+
+        # Editors often save by replacing the file, so files are watched through their folder
+        folders = {path if path.is_dir() else path.parent for path in self.paths}
+        for folder in folders:
+            wd = libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK)
+            if wd < 0:
+                os.close(fd)
+                return
+            self._watches[wd] = folder
+
+        self._fd = fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def watches(self, path: Path) -> bool:
+        """ Returns if a change of path concerns one of the watched paths """
+
+        return path in self.paths or path.parent in self.paths
+
+    def snapshot(self) -> dict:
+        """ Returns the mtime and size of every watched file, and of the files of every watched folder """
+
+        snapshot = {}
+        for path in self.paths:
+            try:
+                files = [path] if not path.is_dir() else [file for file in path.iterdir() if file.is_file()]
+                for file in files:
+                    stat = file.stat()
+                    snapshot[file] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+        return snapshot
+
+    def wait(self, timeout: float = None) -> set:
+        """ Blocks until watched files change, returning the paths of the files that
+            changed, were created or were removed. Returns an empty set on timeout """
+
+        if self._fd is not None:
+            changed = self._read_events(timeout)
+            if changed:
+                deadline = time.monotonic() + self.settle
+                while (remaining := deadline - time.monotonic()) > 0:
+                    changed |= self._read_events(remaining)
+            return changed
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.snapshot()
+            changed = {path for path in snapshot.keys() | self._snapshot.keys()
+                       if snapshot.get(path) != self._snapshot.get(path)}
+            if changed:
+                time.sleep(self.settle)
+                self._snapshot = self.snapshot()
+                return changed | {path for path in self._snapshot.keys() ^ snapshot.keys()}
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else max(min(self.interval, deadline - time.monotonic()), 0))
+
+    def _read_events(self, timeout: float) -> set:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        try:
+            data = os.read(self._fd, 0x10000)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\x00")
+            offset += length
+
+            if wd in self._watches and name:
+                path = self._watches[wd] / os.fsdecode(name)
+                if self.watches(path):
+                    changed.add(path)
+        return changed
+
+class WatchSession(object):
+    """ Rebuilds a dol whenever it or its codelists change. The parsed dol, the hook
+        address found in it and the parsed codelists are kept in memory between
+        builds, so a rebuild only parses the files that changed """
+
+    def __init__(self, dolPath: Path, codes: Path, dest: Path, options: BuildOptions, toolchain: Toolchain, cacheFolder: Path = None):
+        """ cacheFolder: persistent CodelistCache backing the one in memory """
+
+        self.dolPath = dolPath.resolve()
+        self.codes = codes.resolve()
+        self.dest = dest
+        self.options = options
+        self.toolchain = toolchain
+        self.parseCache = MemoryCodelistCache(cacheFolder)
+        self._dolFile = None
+        self._hookAddress = None
+
+    @property
+    def paths(self) -> list:
+        return [self.dolPath, self.codes]
+
+    def rebuild(self, changed: set = None) -> BuildResult:
+        """ Builds and saves the dol. changed is the set of files that changed since
+            the last build, None to start over """
+
+        start = time.perf_counter()
+        if self._dolFile is None or changed is None or self.dolPath in changed:
+            self._dolFile = load_dol(read_dol(self.dolPath))
+            self._hookAddress = None
+
+        options = copy.copy(self.options)
+        # The optimizer may patch the dol before the hook is searched for
+        searchesHook = options.hookAddress is None and not options.optimize
+        if searchesHook:
+            options.hookAddress = self._hookAddress
+        if changed is not None and len(changed - {self.dolPath}) < POOL_THRESHOLD:
+            options.jobs = 1
+
+        result = build(self._dolFile, self.codes, options, self.toolchain, self.parseCache)
+        if searchesHook:
+            self._hookAddress = result.hookAddress
+
+        self.dest.parent.mkdir(parents=True, exist_ok=True)
+        result.save(self.dest)
+        result.elapsed = time.perf_counter() - start
+        return result